@@ -0,0 +1,139 @@
+# backend/api/archives.py
+"""Leitura em streaming de arquivos compactados (ZIP / tar.gz) com faturas."""
+import hashlib
+import os
+import tarfile
+import zipfile
+
+from .extraction import ItemLote, ResultadoLote, process_batch, save_to_temp
+
+ARCHIVE_MAX_MEMBERS = 500
+ARCHIVE_MAX_MEMBER_SIZE = 50 * 1024 * 1024  # 50MB por PDF
+
+
+class ArquivoCompactadoInvalido(Exception):
+    """O arquivo enviado não é um ZIP/tar.gz legível."""
+
+
+def _membro_ignorado(nome):
+    """Ignora diretórios e lixo de sistema (ex.: __MACOSX, arquivos ocultos)."""
+    base = os.path.basename(nome.rstrip('/'))
+    return not base or base.startswith('.') or nome.startswith('__MACOSX/')
+
+
+def iter_archive_members(fileobj):
+    """Itera ``(nome, stream)`` para cada membro de um ZIP ou tar.gz.
+
+    Os membros são abertos um de cada vez e devem ser consumidos antes de
+    avançar para o próximo; nada é descompactado em disco. ``stream`` é
+    ``None`` para membros que não são PDF, permitindo ao chamador reportá-los.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        yield from _iter_zip(fileobj)
+        return
+
+    fileobj.seek(0)
+    try:
+        # Modo 'r|*' lê o tar sequencialmente, sem exigir seek nem índice
+        tar = tarfile.open(fileobj=fileobj, mode='r|*')
+    except tarfile.TarError:
+        raise ArquivoCompactadoInvalido("Arquivo não é um ZIP ou tar.gz válido")
+
+    with tar:
+        yield from _iter_tar(tar)
+
+
+def _iter_zip(fileobj):
+    with zipfile.ZipFile(fileobj) as zf:
+        # O diretório central já lista tudo: o limite é checado antes do primeiro membro
+        membros = [info for info in zf.infolist() if not info.is_dir() and not _membro_ignorado(info.filename)]
+        if len(membros) > ARCHIVE_MAX_MEMBERS:
+            raise ArquivoCompactadoInvalido(
+                f"Arquivo compactado excede o limite de {ARCHIVE_MAX_MEMBERS} arquivos"
+            )
+        for info in membros:
+            if not info.filename.lower().endswith('.pdf'):
+                yield info.filename, None
+                continue
+            with zf.open(info) as stream:
+                yield info.filename, stream
+
+
+def _iter_tar(tar):
+    # Sem índice no tar: o limite só é conhecido ao chegar no membro excedente
+    contador = 0
+    for member in tar:
+        if not member.isfile() or _membro_ignorado(member.name):
+            continue
+        contador += 1
+        if contador > ARCHIVE_MAX_MEMBERS:
+            raise ArquivoCompactadoInvalido(
+                f"Arquivo compactado excede o limite de {ARCHIVE_MAX_MEMBERS} arquivos; "
+                f"{member.name} e os seguintes não foram processados"
+            )
+        if not member.name.lower().endswith('.pdf'):
+            yield member.name, None
+            continue
+        stream = tar.extractfile(member)
+        try:
+            yield member.name, stream
+        finally:
+            stream.close()
+
+
+def iter_archive_items(fileobj):
+    """Converte os membros de um arquivo compactado em itens de lote.
+
+    Cada PDF é copiado para um temporário (calculando o SHA-256) no momento
+    em que o item é pedido, de modo que só existem em disco os membros em
+    extração.
+
+    Se o arquivo se mostrar inválido depois do primeiro membro (tar além do
+    limite de membros, truncado ou corrompido), os membros anteriores já
+    podem ter virado faturas: em vez de propagar o erro, o lote termina com
+    um item de erro e o resultado parcial é devolvido normalmente.
+    """
+    membros = iter_archive_members(fileobj)
+    nome_arquivo = os.path.basename(getattr(fileobj, 'name', None) or '') or 'arquivo compactado'
+    recebidos = 0
+    while True:
+        try:
+            nome_membro, stream = next(membros)
+        except StopIteration:
+            return
+        except (ArquivoCompactadoInvalido, tarfile.TarError, EOFError) as e:
+            if not recebidos:
+                raise
+            yield ItemLote(nome_arquivo, erro=f"Arquivo compactado inválido: {e}")
+            return
+        recebidos += 1
+
+        if stream is None:
+            yield ItemLote(nome_membro, erro="Apenas arquivos PDF são aceitos")
+            continue
+        hasher = hashlib.sha256()
+        try:
+            pdf_path = save_to_temp(stream, max_size=ARCHIVE_MAX_MEMBER_SIZE, hasher=hasher)
+        except ValueError as e:
+            yield ItemLote(nome_membro, erro=str(e))
+            continue
+        except (tarfile.TarError, EOFError) as e:
+            # Stream do tar quebrado no meio do membro: não há como seguir para o próximo
+            yield ItemLote(nome_membro, erro=f"Arquivo compactado inválido: {e}")
+            return
+        yield ItemLote(nome_membro, pdf_path=pdf_path, temporario=True, sha256=hasher.hexdigest())
+
+
+def process_archive(customer, fileobj):
+    """Processa os PDFs de um arquivo compactado com extração em paralelo.
+
+    Retorna ``(resultado, total_enviadas)``, onde ``resultado`` é um
+    ``ResultadoLote`` com um item por membro encontrado.
+    """
+    resultado = ResultadoLote()
+    for tipo, payload in process_batch(customer, iter_archive_items(fileobj)):
+        resultado.add(tipo, payload)
+    total_enviadas = len(resultado.faturas_processadas) + len(resultado.avisos) + len(resultado.faturas_com_erro)
+    return resultado, total_enviadas
@@ -0,0 +1,90 @@
+# backend/api/conditional.py
+"""GET condicional (ETag / Last-Modified) para as telas que o frontend consulta em polling.
+
+Os validadores saem de agregados baratos (contagem e ``max`` dos carimbos de
+tempo) das tabelas que alimentam cada resposta; se o cliente já tem a versão
+atual, a view responde 304 sem montar nem serializar nada.
+
+Exclusões só mudam a contagem, não o ``max``: o ETag as detecta, o
+Last-Modified não. Clientes que enviam ``If-None-Match`` (navegadores enviam
+junto com ``If-Modified-Since``) sempre têm precedência, como manda a RFC 9110.
+"""
+import hashlib
+
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import Fatura, FaturaResumoMensal, FaturaTask, UnidadeConsumidora
+
+
+def _agregado(queryset, *campos_data, **extras):
+    valores = queryset.aggregate(
+        total=Count('pk'), **extras, **{f'max_{campo}': Max(campo) for campo in campos_data}
+    )
+    datas = [valores[f'max_{campo}'] for campo in campos_data if valores[f'max_{campo}']]
+    return valores, max(datas) if datas else None
+
+
+def _combinar(*agregados):
+    partes = [valores for valores, _ in agregados]
+    datas = [data for _, data in agregados if data]
+    return partes, max(datas) if datas else None
+
+
+def faturas_validators(customer):
+    """Faturas do cliente e as UCs (código da UC aparece em cada fatura)."""
+    return _combinar(
+        _agregado(Fatura.objects.filter(unidade_consumidora__customer=customer), 'updated_at'),
+        _agregado(UnidadeConsumidora.objects.filter(customer=customer), 'updated_at'),
+    )
+
+
+def grade_validators(customer, ano):
+    """Resumo mensal de todos os anos (a grade lista os anos disponíveis) e as UCs.
+
+    ``ano`` entra no ETag porque, sem o parâmetro, a grade é a do ano corrente.
+    """
+    partes, ultima_modificacao = _combinar(
+        _agregado(FaturaResumoMensal.objects.filter(customer=customer), 'updated_at'),
+        _agregado(UnidadeConsumidora.objects.filter(customer=customer), 'updated_at'),
+    )
+    return partes + [str(ano)], ultima_modificacao
+
+
+def tasks_validators(customer):
+    """Tarefas do cliente: cada transição de estado grava um destes carimbos.
+
+    A promoção de fila (``enqueue``) não grava carimbo nenhum; ela só sobe
+    jobs de fila, então a contagem por fila basta para mudar o ETag.
+    """
+    return _combinar(
+        _agregado(
+            FaturaTask.objects.filter(unidade_consumidora__customer=customer),
+            'created_at', 'started_at', 'completed_at', 'next_run_at',
+            **{f'fila_{fila}': Count('pk', filter=Q(fila=fila)) for fila, _ in FaturaTask.FILA_CHOICES}
+        ),
+    )
+
+
+def conditional_response(request, validadores, gerar):
+    """Responde 304 se o cliente já tem a versão atual; senão chama ``gerar()``.
+
+    ``validadores`` é o par ``(partes, ultima_modificacao)`` de uma das funções
+    ``*_validators``; o ETag inclui também o caminho e a query string.
+    """
+    partes, ultima_modificacao = validadores
+    digest = hashlib.sha1(repr((request.get_full_path(), partes)).encode()).hexdigest()
+    etag = f'"{digest}"'
+    last_modified = ultima_modificacao.timestamp() if ultima_modificacao else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = gerar()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        # O navegador pode guardar, mas deve revalidar a cada uso
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,225 @@
+# backend/api/exports.py
+"""Exportação das faturas em planilha (CSV ou XLSX) para os contadores.
+
+As linhas saem de um cursor do lado do servidor (``values().iterator()``) e
+vão direto para um ``StreamingHttpResponse``: nada é acumulado, então a
+memória é a mesma para 50 ou 500 000 faturas.
+
+O XLSX é montado com ``zipfile`` em modo de escrita sem ``seek`` (ver
+``api/zipstream.py``): cada linha da planilha é comprimida e enviada assim
+que escrita, sem arquivo temporário nem dependência extra. As células são
+texto inline ou número, sem estilos.
+"""
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .zipstream import SaidaZip
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# (coluna do values(), cabeçalho)
+COLUNAS_FATURA = [
+    ('unidade_consumidora__customer__nome', 'Cliente'),
+    ('unidade_consumidora__customer__cpf', 'CPF'),
+    ('unidade_consumidora__codigo', 'UC'),
+    ('mes_referencia', 'Mês de referência'),
+    ('vencimento', 'Vencimento'),
+    ('valor', 'Valor (R$)'),
+    ('arquivo', 'Arquivo'),
+]
+
+# Chaves de ``Fatura.dados_extraidos`` (saída de ``process_single_pdf``) que viram colunas.
+# UC, mês, vencimento e valor já estão nas colunas da fatura.
+CAMPOS_EXTRAIDOS = [
+    ('distribuidora', 'Distribuidora'),
+    ('cpf_cnpj', 'CPF/CNPJ na fatura'),
+    ('nome_cliente', 'Nome na fatura'),
+    ('endereco_cliente', 'Endereço na fatura'),
+    ('leitura_anterior', 'Leitura anterior'),
+    ('leitura_atual', 'Leitura atual'),
+    ('quantidade_dias', 'Dias'),
+    ('consumo_kwh', 'Consumo (kWh)'),
+    ('saldo_kwh', 'Saldo (kWh)'),
+    ('energia_injetada', 'Energia injetada (kWh)'),
+    ('preco_energia_injetada', 'Preço energia injetada'),
+    ('consumo_scee', 'Consumo SCEE (kWh)'),
+    ('preco_energia_compensada', 'Preço energia compensada'),
+    ('consumo_nao_compensado', 'Consumo não compensado (kWh)'),
+    ('preco_kwh_nao_compensado', 'Preço kWh não compensado'),
+    ('preco_fio_b', 'Preço fio B'),
+    ('preco_adc_bandeira', 'Adicional de bandeira'),
+    ('contribuicao_iluminacao', 'Contribuição iluminação pública'),
+    ('ciclo_geracao', 'Ciclo de geração'),
+    ('uc_geradora', 'UC geradora'),
+    ('geracao_ultimo_ciclo', 'Geração último ciclo (kWh)'),
+]
+
+CABECALHO = [titulo for _, titulo in COLUNAS_FATURA] + [titulo for _, titulo in CAMPOS_EXTRAIDOS]
+# Colunas de quantidades e preços; códigos (UC, CPF) ficam como texto para manter zeros à esquerda
+NUMERICAS = {'valor', 'quantidade_dias', 'consumo_kwh', 'energia_injetada', 'preco_energia_injetada',
+             'consumo_scee', 'preco_energia_compensada', 'consumo_nao_compensado', 'preco_kwh_nao_compensado',
+             'preco_fio_b', 'preco_adc_bandeira', 'contribuicao_iluminacao', 'geracao_ultimo_ciclo'}
+_INDICES_NUMERICOS = frozenset(
+    indice for indice, (chave, _) in enumerate(COLUNAS_FATURA + CAMPOS_EXTRAIDOS) if chave in NUMERICAS
+)
+
+_NUMERO = re.compile(r'-?\d+(\.\d+)?')
+_CONTROLE_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# Linhas do CSV são agrupadas em blocos deste tamanho antes de ir para o socket
+TAMANHO_BLOCO = 64 * 1024
+
+
+class FormatoInvalido(ValueError):
+    pass
+
+
+def _linhas(queryset):
+    """Uma lista de valores por fatura, na ordem do ``CABECALHO``: datas já formatadas,
+    números como ``str`` com ponto."""
+    colunas = [coluna for coluna, _ in COLUNAS_FATURA]
+    faturas = queryset.order_by(
+        'unidade_consumidora__customer__nome', 'unidade_consumidora__codigo', 'mes_referencia', 'id'
+    ).values(*colunas, 'dados_extraidos')
+
+    for fatura in faturas.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        mes, vencimento, valor = fatura['mes_referencia'], fatura['vencimento'], fatura['valor']
+        extraidos = fatura['dados_extraidos'] or {}
+        yield [
+            fatura['unidade_consumidora__customer__nome'],
+            fatura['unidade_consumidora__customer__cpf'],
+            fatura['unidade_consumidora__codigo'],
+            mes.strftime('%m/%Y'),
+            vencimento.strftime('%d/%m/%Y') if vencimento else None,
+            str(valor) if valor is not None else None,
+            fatura['arquivo'] or None,
+        ] + [extraidos.get(chave) for chave, _ in CAMPOS_EXTRAIDOS]
+
+
+def _numero(indice, valor):
+    return indice in _INDICES_NUMERICOS and _NUMERO.fullmatch(valor) is not None
+
+
+class _Eco:
+    """Pseudo-arquivo do ``csv.writer``: devolve a linha em vez de guardá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def _celula_csv(indice, valor):
+    if valor is None:
+        return ''
+    valor = str(valor)
+    if _numero(indice, valor):
+        return valor.replace('.', ',')  # Excel em pt-BR
+    if valor[:1] in ('=', '+', '-', '@'):
+        return "'" + valor  # não deixa o Excel interpretar como fórmula
+    return valor
+
+
+def stream_csv(linhas):
+    """CSV com ``;`` e vírgula decimal, como o Excel em português abre direto."""
+    escritor = csv.writer(_Eco(), delimiter=';')
+    bloco = ['\ufeff' + escritor.writerow(CABECALHO)]
+    tamanho = 0
+    for linha in linhas:
+        texto = escritor.writerow([_celula_csv(indice, valor) for indice, valor in enumerate(linha)])
+        bloco.append(texto)
+        tamanho += len(texto)
+        if tamanho >= TAMANHO_BLOCO:
+            yield ''.join(bloco)
+            bloco, tamanho = [], 0
+    if bloco:
+        yield ''.join(bloco)
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Faturas" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '</Relationships>'
+)
+
+
+def _celula_xlsx(indice, valor):
+    if valor is None:
+        return '<c/>'
+    valor = str(valor)
+    if _numero(indice, valor):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROLE_XML.sub('', valor))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _linha_xlsx(valores):
+    return ('<row>' + ''.join(_celula_xlsx(i, valor) for i, valor in enumerate(valores)) + '</row>').encode()
+
+
+def stream_xlsx(linhas):
+    """Planilha XLSX mínima (uma aba, sem estilos), enviada à medida que é escrita."""
+    saida = SaidaZip()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as pacote:
+        pacote.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        pacote.writestr('_rels/.rels', _RELS)
+        pacote.writestr('xl/workbook.xml', _WORKBOOK)
+        pacote.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield saida.esvaziar()
+
+        with pacote.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as aba:
+            aba.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            aba.write(_linha_xlsx(CABECALHO))
+            for linha in linhas:
+                aba.write(_linha_xlsx(linha))
+                if saida.partes:
+                    yield saida.esvaziar()
+            aba.write(b'</sheetData></worksheet>')
+    yield saida.esvaziar()
+
+
+def export_response(queryset, formato, nome_base):
+    """``StreamingHttpResponse`` com as faturas do queryset no ``formato`` pedido (csv ou xlsx)."""
+    if formato not in FORMATOS:
+        raise FormatoInvalido(f"Formato inválido: {formato}. Use {' ou '.join(FORMATOS)}")
+
+    gerador = stream_xlsx if formato == 'xlsx' else stream_csv
+    response = StreamingHttpResponse(gerador(_linhas(queryset)), content_type=FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nome_base}.{formato}"'
+    return response
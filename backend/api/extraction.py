@@ -0,0 +1,575 @@
+# backend/api/extraction.py
+"""Pipeline compartilhado de extração e registro de faturas enviadas em PDF."""
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from .limiter import FILA_LOTE, CapacidadeEsgotada, extraction_slot
+from .models import Fatura, UnidadeConsumidora
+from .pdf_validation import PdfInvalido, validate_pdf
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_TIMEOUT = 30  # segundos por PDF
+CHUNK_SIZE = 64 * 1024
+
+# Tipos de resultado devolvidos pelo pipeline
+PROCESSADA = 'processada'
+AVISO = 'aviso'
+ERRO = 'erro'
+
+
+def save_to_temp(arquivo, max_size=None, hasher=None):
+    """Copia um arquivo enviado (ou stream) para um PDF temporário em blocos.
+
+    Retorna o caminho do arquivo temporário. Se ``max_size`` for informado,
+    a cópia é interrompida com ``ValueError`` ao ultrapassar o limite; se
+    ``hasher`` for informado, ele é atualizado com cada bloco copiado.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        try:
+            if hasattr(arquivo, 'chunks'):
+                blocos = arquivo.chunks(CHUNK_SIZE)
+            else:
+                blocos = iter(lambda: arquivo.read(CHUNK_SIZE), b'')
+
+            total = 0
+            for bloco in blocos:
+                total += len(bloco)
+                if max_size is not None and total > max_size:
+                    raise ValueError(f"Arquivo excede o limite de {max_size // (1024 * 1024)} MB")
+                if hasher is not None:
+                    hasher.update(bloco)
+                temp_file.write(bloco)
+        except Exception:
+            temp_file.close()
+            os.unlink(temp_file.name)
+            raise
+        return temp_file.name
+
+
+def _executar_com_triagem(comando, continuar):
+    """Roda o script em modo ``--triagem``: lê o probe, responde se continua e colhe a saída.
+
+    Devolve um ``CompletedProcess`` cujo ``stdout`` é o probe, quando a
+    extração para nele, ou o resultado da extração completa.
+    """
+    expirou = threading.Event()
+    with tempfile.TemporaryFile(mode='w+') as saida_erro:
+        processo = subprocess.Popen(
+            comando, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=saida_erro, text=True
+        )
+
+        def encerrar():
+            expirou.set()
+            processo.kill()
+
+        # readline/communicate não têm prazo próprio: o timer encerra o processo
+        prazo = threading.Timer(EXTRACTION_TIMEOUT, encerrar)
+        prazo.start()
+        try:
+            linha = processo.stdout.readline()
+            try:
+                probe = json.loads(linha)
+            except json.JSONDecodeError:
+                probe = None  # o script falhou antes do probe: o erro vem na saída final
+            parar = probe is not None and not continuar(probe)
+            stdout, _ = processo.communicate('parar\n' if parar else 'continuar\n')
+        finally:
+            prazo.cancel()
+            if processo.poll() is None:
+                processo.kill()
+                processo.wait()
+        if expirou.is_set():
+            raise subprocess.TimeoutExpired(comando, EXTRACTION_TIMEOUT)
+        saida_erro.seek(0)
+        return subprocess.CompletedProcess(
+            comando, processo.returncode, linha if parar else stdout, saida_erro.read()
+        )
+
+
+def run_extraction(pdf_path, fila=FILA_LOTE, continuar=None):
+    """Executa o script de extração sobre um PDF e devolve o dicionário de dados.
+
+    A extração completa traz também o texto bruto do PDF em ``texto`` (ver
+    ``separar_texto``). Com ``continuar``, o mesmo subprocesso roda antes o
+    probe (só a primeira página: UC, CPF, mês de referência e vencimento) e
+    só segue para a extração completa se ``continuar(probe)`` for verdadeiro;
+    senão devolve o próprio probe (``modo == 'probe'``). Falhas do subprocesso são convertidas em ``{'status': 'error', 'erro': ...}``.
+    Cada execução (com ou sem probe) ocupa uma única vaga do limitador global
+    de extrações, na fila de prioridade ``fila``; sem vaga dentro do prazo,
+    ``CapacidadeEsgotada`` é propagada.
+    """
+    script_path = os.path.join(settings.BASE_DIR, 'scripts', 'extract_fatura_data.py')
+    try:
+        with extraction_slot(fila):
+            if continuar is None:
+                result = subprocess.run(
+                    [sys.executable, script_path, '--texto', pdf_path],
+                    capture_output=True,
+                    text=True,
+                    timeout=EXTRACTION_TIMEOUT
+                )
+            else:
+                result = _executar_com_triagem([sys.executable, script_path, '--triagem', pdf_path], continuar)
+    except subprocess.TimeoutExpired:
+        return {'status': 'error', 'erro': 'Timeout na extração de dados'}
+
+    if result.returncode != 0:
+        return {'status': 'error', 'erro': f"Erro na extração: {result.stderr}"}
+
+    try:
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        return {'status': 'error', 'erro': 'Erro ao processar resultado da extração'}
+
+
+# Abreviações usadas nas faturas (português), mais as inglesas aceitas antes
+MESES = {
+    'JAN': 1, 'FEV': 2, 'MAR': 3, 'ABR': 4, 'MAI': 5, 'JUN': 6,
+    'JUL': 7, 'AGO': 8, 'SET': 9, 'OUT': 10, 'NOV': 11, 'DEZ': 12,
+    'FEB': 2, 'APR': 4, 'MAY': 5, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'DEC': 12,
+}
+
+
+def parse_mes_referencia(valor):
+    """Converte 'MAI/2024' em date(2024, 5, 1); usa o mês atual como fallback.
+
+    As faturas trazem o mês abreviado em português; o ``strptime('%b')``
+    usado antes só entendia as abreviações inglesas e mandava FEV, ABR, MAI,
+    AGO, SET, OUT e DEZ para o fallback (o probe descartaria a fatura errada).
+    """
+    if valor:
+        try:
+            mes, ano = str(valor).strip().upper().split('/')
+            return date(int(ano), MESES[mes[:3]], 1)
+        except (KeyError, ValueError):
+            pass
+    return timezone.now().date().replace(day=1)
+
+
+def parse_vencimento(valor):
+    """Converte 'DD/MM/AAAA' em date, ou None se inválido."""
+    if valor:
+        try:
+            return datetime.strptime(valor, '%d/%m/%Y').date()
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def resolve_uc(customer, nome_arquivo, uc_codigo):
+    """Localiza a UC do cliente a partir do código extraído.
+
+    Retorna ``(uc, None)`` em caso de sucesso, ou ``(None, (tipo, payload))``
+    com o aviso/erro que impede o registro da fatura.
+    """
+    if not uc_codigo:
+        return None, (ERRO, {
+            "arquivo": nome_arquivo,
+            "erro": "Não foi possível extrair o código da UC do PDF"
+        })
+
+    uc = customer.unidades_consumidoras.filter(codigo=uc_codigo).first()
+    if uc:
+        return uc, None
+
+    uc_outro_cliente = UnidadeConsumidora.objects.filter(
+        codigo=uc_codigo
+    ).exclude(customer=customer).select_related('customer').first()
+
+    if uc_outro_cliente:
+        return None, (AVISO, {
+            "tipo": "uc_outro_cliente",
+            "arquivo": nome_arquivo,
+            "uc_codigo": uc_codigo,
+            "cliente_nome": uc_outro_cliente.customer.nome,
+            "cliente_id": uc_outro_cliente.customer.id,
+            "mensagem": f"A UC {uc_codigo} está cadastrada no cliente '{uc_outro_cliente.customer.nome}', não no cliente atual."
+        })
+
+    return None, (AVISO, {
+        "tipo": "uc_nao_encontrada",
+        "arquivo": nome_arquivo,
+        "uc_codigo": uc_codigo,
+        "mensagem": f"A UC {uc_codigo} não está cadastrada no sistema. Cadastre-a primeiro ou verifique se o código está correto."
+    })
+
+
+def find_duplicate(user, sha256):
+    """Fatura já armazenada, entre os clientes do usuário, com conteúdo idêntico."""
+    if not sha256:
+        return None
+    return Fatura.objects.filter(
+        sha256=sha256,
+        unidade_consumidora__customer__user=user
+    ).select_related('unidade_consumidora').first()
+
+
+def duplicate_aviso(nome_arquivo, sha256, fatura_existente):
+    """Aviso para um PDF byte a byte idêntico a uma fatura já armazenada."""
+    periodo = fatura_existente.mes_referencia.strftime('%m/%Y')
+    return AVISO, {
+        "tipo": "arquivo_duplicado",
+        "arquivo": nome_arquivo,
+        "sha256": sha256,
+        "uc_codigo": fatura_existente.unidade_consumidora.codigo,
+        "mes_referencia": periodo,
+        "fatura_existente_id": fatura_existente.id,
+        "mensagem": f"Este arquivo já foi enviado: fatura da UC {fatura_existente.unidade_consumidora.codigo} no período {periodo}."
+    }
+
+
+def check_fatura(customer, nome_arquivo, extracted_data):
+    """Decide, sem gravar nada, se os dados extraídos resultam em uma nova fatura.
+
+    Retorna ``(uc, mes_referencia, None)`` quando a fatura pode ser criada, ou
+    ``(None, None, (tipo, payload))`` com o aviso/erro que impede o registro.
+    Basta a UC e o mês de referência, então serve também para o resultado
+    do modo ``probe``.
+    """
+    if extracted_data.get('status') == 'error':
+        return None, None, (ERRO, {
+            "arquivo": nome_arquivo,
+            "erro": extracted_data.get('erro', 'Erro na extração')
+        })
+
+    uc, rejeicao = resolve_uc(customer, nome_arquivo, extracted_data.get('unidade_consumidora'))
+    if rejeicao:
+        return None, None, rejeicao
+
+    mes_referencia = parse_mes_referencia(extracted_data.get('mes_referencia'))
+
+    fatura_existente = Fatura.objects.filter(
+        unidade_consumidora=uc,
+        mes_referencia=mes_referencia
+    ).first()
+
+    if fatura_existente:
+        return None, None, (AVISO, {
+            "tipo": "fatura_duplicada",
+            "arquivo": nome_arquivo,
+            "uc_codigo": uc.codigo,
+            "mes_referencia": mes_referencia.strftime('%m/%Y'),
+            "fatura_existente_id": fatura_existente.id,
+            "mensagem": f"Já existe uma fatura para a UC {uc.codigo} no período {mes_referencia.strftime('%m/%Y')}."
+        })
+
+    return uc, mes_referencia, None
+
+
+def separar_texto(extracted_data):
+    """Separa o texto bruto (vai para ``Fatura.texto``) dos campos extraídos."""
+    dados = dict(extracted_data)
+    return dados, dados.pop('texto', '') or ''
+
+
+def register_fatura(customer, nome_arquivo, arquivo, extracted_data, sha256='', message_id=''):
+    """Valida os dados extraídos e cria a fatura na UC correta do cliente.
+
+    Retorna ``(tipo, payload)`` no mesmo formato usado nas listas
+    ``faturas_processadas``, ``avisos`` e ``faturas_com_erro``.
+    """
+    uc, mes_referencia, rejeicao = check_fatura(customer, nome_arquivo, extracted_data)
+    if rejeicao:
+        return rejeicao
+    extracted_data, texto = separar_texto(extracted_data)
+
+    fatura = Fatura.objects.create(
+        unidade_consumidora=uc,
+        mes_referencia=mes_referencia,
+        arquivo=arquivo,
+        valor=extracted_data.get('valor_total'),
+        vencimento=parse_vencimento(extracted_data.get('data_vencimento')),
+        downloaded_at=timezone.now(),
+        sha256=sha256,
+        email_message_id=message_id,
+        dados_extraidos=extracted_data,
+        texto=texto
+    )
+    logger.info("Fatura criada: ID %s, UC %s, mês %s", fatura.id, uc.codigo, mes_referencia)
+
+    return PROCESSADA, {
+        "id": fatura.id,
+        "arquivo": nome_arquivo,
+        "uc": uc.codigo,
+        "mes_referencia": mes_referencia,
+        "valor": fatura.valor,
+        "dados_extraidos": extracted_data
+    }
+
+
+class ItemLote:
+    """Um arquivo de um lote: origem do conteúdo e, após a extração, os dados.
+
+    O conteúdo vem de ``arquivo`` (upload) ou de ``pdf_path`` (cópia local,
+    ex.: staging ou membro de ZIP). ``resultado`` guarda a decisão tomada
+    antes da extração (erro ou duplicata), dispensando extrair e registrar;
+    ``temporario`` indica que ``pdf_path`` deve ser removido ao final.
+    """
+
+    def __init__(self, nome, arquivo=None, pdf_path=None, erro=None, temporario=False, sha256='',
+                 message_id=''):
+        self.nome = nome
+        self.arquivo = arquivo
+        self.pdf_path = pdf_path
+        self.temporario = temporario
+        self.sha256 = sha256
+        self.message_id = message_id  # Message-ID do e-mail de origem, se houver
+        self.dados = None
+        self.somente_probe = False  # ``dados`` veio só do probe (fatura descartada)
+        self.resultado = (ERRO, {"arquivo": nome, "erro": erro}) if erro else None
+
+    def cleanup(self):
+        if self.temporario and self.pdf_path and os.path.exists(self.pdf_path):
+            os.unlink(self.pdf_path)
+
+
+def items_from_uploads(arquivos):
+    """Converte os arquivos do campo ``faturas`` em itens de lote."""
+    for arquivo in arquivos:
+        if not arquivo.name.lower().endswith('.pdf'):
+            yield ItemLote(arquivo.name, erro="Apenas arquivos PDF são aceitos")
+        else:
+            yield ItemLote(arquivo.name, arquivo=arquivo, sha256=getattr(arquivo, 'sha256', ''))
+
+
+def validate_items(itens):
+    """Recusa, antes de qualquer extração, arquivos que não são PDFs utilizáveis."""
+    for item in itens:
+        if item.resultado is None:
+            try:
+                validate_pdf(item.pdf_path or item.arquivo)
+            except PdfInvalido as e:
+                item.resultado = (ERRO, {"arquivo": item.nome, "erro": str(e)})
+            except OSError as e:
+                item.resultado = (ERRO, {"arquivo": item.nome, "erro": f"Erro ao ler o arquivo: {e}"})
+        yield item
+
+
+def mark_duplicates(user, itens):
+    """Resolve reenvios pelo SHA-256 antes de qualquer extração.
+
+    Itens idênticos a uma fatura já armazenada (ou a outro item do mesmo
+    lote) recebem um aviso ``arquivo_duplicado`` e não são extraídos.
+    """
+    vistos = {}
+    for item in itens:
+        if item.resultado is None and item.sha256:
+            if item.sha256 in vistos:
+                item.resultado = (AVISO, {
+                    "tipo": "arquivo_duplicado",
+                    "arquivo": item.nome,
+                    "sha256": item.sha256,
+                    "arquivo_original": vistos[item.sha256],
+                    "mensagem": f"Arquivo idêntico a '{vistos[item.sha256]}', enviado no mesmo lote."
+                })
+            else:
+                vistos[item.sha256] = item.nome
+                fatura_existente = find_duplicate(user, item.sha256)
+                if fatura_existente:
+                    item.resultado = duplicate_aviso(item.nome, item.sha256, fatura_existente)
+        yield item
+
+
+class TriagemCliente:
+    """Retrato das UCs e faturas do cliente, usado para triar o resultado do probe.
+
+    É montado na thread da requisição e consultado pelas threads de extração,
+    que não acessam o banco. Só descarta o que certamente não será
+    armazenado; a decisão final (e o aviso) continua com ``check_fatura``.
+    """
+
+    def __init__(self, customer):
+        self.ucs = {}
+        # Ordem crescente: a UC mais recente com o código prevalece, como em resolve_uc
+        for uc_id, codigo in customer.unidades_consumidoras.order_by('created_at').values_list('id', 'codigo'):
+            self.ucs[codigo] = uc_id
+        self.existentes = set(
+            Fatura.objects.filter(
+                unidade_consumidora__customer=customer
+            ).values_list('unidade_consumidora_id', 'mes_referencia')
+        )
+
+    def sera_armazenada(self, dados):
+        uc_id = self.ucs.get(dados.get('unidade_consumidora'))
+        if uc_id is None:
+            return False
+        return (uc_id, parse_mes_referencia(dados.get('mes_referencia'))) not in self.existentes
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool global de extração, compartilhado por todas as requisições do processo.
+
+    O tamanho do pool (``EXTRACTION_MAX_WORKERS``) é o teto de extrações
+    simultâneas por processo; cada lote ainda respeita o seu próprio limite.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EXTRACTION_MAX_WORKERS,
+                thread_name_prefix='extracao'
+            )
+        return _executor
+
+
+def _extrair(item, triagem=None, fila=FILA_LOTE):
+    """Fase sem acesso ao banco: localiza/copia o PDF em disco e extrai.
+
+    Com ``triagem``, roda antes o probe (primeira página), no mesmo
+    subprocesso e na mesma vaga, e só faz a extração completa se a fatura
+    puder ser armazenada; probes inconclusivos seguem para a extração completa.
+    """
+    if item.resultado:
+        return
+    try:
+        if item.pdf_path is None and hasattr(item.arquivo, 'temporary_file_path'):
+            # Upload já gravado em disco pelo handler: extrai sem nova cópia
+            item.pdf_path = item.arquivo.temporary_file_path()
+        elif item.pdf_path is None:
+            item.pdf_path = save_to_temp(item.arquivo)
+            item.temporario = True
+        continuar = None
+        if triagem is not None:
+            def continuar(probe):
+                return probe.get('status') != 'success' or triagem.sera_armazenada(probe)
+        item.dados = run_extraction(item.pdf_path, fila=fila, continuar=continuar)
+        item.somente_probe = item.dados.get('modo') == 'probe'
+    except CapacidadeEsgotada as e:
+        # Falha passageira: o arquivo não é registrado e pode ser reenviado após o Retry-After
+        logger.warning("Sem vaga para extrair %s: %s", item.nome, e)
+        item.resultado = (ERRO, {"arquivo": item.nome, "erro": str(e), "retry_after": e.retry_after})
+    except Exception as e:
+        logger.exception("Erro ao extrair %s", item.nome)
+        item.dados = {'status': 'error', 'erro': str(e)}
+
+
+def extract_in_order(itens, max_workers=None, triagem=None, fila=FILA_LOTE):
+    """Extrai os itens em paralelo e os devolve na ordem original.
+
+    Mantém no máximo ``max_workers`` extrações em andamento para este lote
+    (padrão ``EXTRACTION_MAX_WORKERS_PER_REQUEST``); o iterável ``itens`` só é
+    consumido à medida que há vaga, o que limita também os temporários em disco.
+    ``triagem`` (``TriagemCliente``) habilita o probe antes da extração completa
+    e ``fila`` é a fila de prioridade do limitador usada pelas extrações.
+    """
+    limite = max(1, min(
+        max_workers or settings.EXTRACTION_MAX_WORKERS_PER_REQUEST,
+        settings.EXTRACTION_MAX_WORKERS
+    ))
+    executor = get_executor()
+    pendentes = deque()
+    try:
+        for item in itens:
+            pendentes.append((item, executor.submit(_extrair, item, triagem, fila)))
+            if len(pendentes) >= limite:
+                item_pronto, future = pendentes.popleft()
+                future.result()
+                yield item_pronto
+        while pendentes:
+            item_pronto, future = pendentes.popleft()
+            future.result()
+            yield item_pronto
+    finally:
+        # Consumidor abandonou o lote (ex.: cliente SSE desconectou)
+        for item_pendente, future in pendentes:
+            future.cancel()
+            if not future.cancelled():
+                future.result()
+            item_pendente.cleanup()
+
+
+def register_item(customer, item, fila=FILA_LOTE):
+    """Fase com acesso ao banco: registra um item já extraído, nunca propagando exceções."""
+    if item.resultado:
+        item.cleanup()
+        return item.resultado
+    try:
+        if item.somente_probe:
+            _, _, rejeicao = check_fatura(customer, item.nome, item.dados)
+            if rejeicao:
+                return rejeicao
+            # O cenário mudou desde a triagem (ex.: fatura removida): extrai tudo
+            item.dados = run_extraction(item.pdf_path, fila=fila)
+        if item.arquivo is not None:
+            return register_fatura(customer, item.nome, item.arquivo, item.dados,
+                                   sha256=item.sha256, message_id=item.message_id)
+        with open(item.pdf_path, 'rb') as pdf_file:
+            arquivo = File(pdf_file, name=os.path.basename(item.nome))
+            return register_fatura(customer, item.nome, arquivo, item.dados,
+                                   sha256=item.sha256, message_id=item.message_id)
+    except Exception as e:
+        logger.exception("Erro ao processar %s", item.nome)
+        return ERRO, {"arquivo": item.nome, "erro": str(e)}
+    finally:
+        item.cleanup()
+
+
+def process_batch(customer, itens, max_workers=None, fila=FILA_LOTE):
+    """Extrai em paralelo e registra na ordem original, gerando ``(tipo, payload)``.
+
+    Arquivos inválidos e reenvios são resolvidos antes da extração. Faturas de UCs de fora do cliente ou de meses já cadastrados são
+    descartadas pelo probe, sem a extração completa (e o OCR).
+    """
+    itens = mark_duplicates(customer.user, validate_items(itens))
+    triagem = TriagemCliente(customer)
+    for item in extract_in_order(itens, max_workers=max_workers, triagem=triagem, fila=fila):
+        yield register_item(customer, item, fila)
+
+
+class ResultadoLote:
+    """Acumula os resultados por arquivo de um lote de upload."""
+
+    def __init__(self):
+        self.faturas_processadas = []
+        self.faturas_com_erro = []
+        self.avisos = []
+
+    def add(self, tipo, payload):
+        if tipo == PROCESSADA:
+            self.faturas_processadas.append(payload)
+        elif tipo == AVISO:
+            self.avisos.append(payload)
+        else:
+            self.faturas_com_erro.append(payload)
+
+    @property
+    def retry_after(self):
+        """Maior espera sugerida entre os arquivos recusados por falta de vaga de extração."""
+        esperas = [erro['retry_after'] for erro in self.faturas_com_erro if 'retry_after' in erro]
+        return max(esperas) if esperas else None
+
+    def as_summary(self, total_enviadas):
+        """Totais do lote, sem as listas por arquivo."""
+        return {
+            "message": f"{len(self.faturas_processadas)} fatura(s) processada(s) com sucesso",
+            "total_processadas": len(self.faturas_processadas),
+            "total_avisos": len(self.avisos),
+            "total_erros": len(self.faturas_com_erro),
+            "total_enviadas": total_enviadas
+        }
+
+    def as_response_data(self, total_enviadas):
+        return {
+            "message": f"{len(self.faturas_processadas)} fatura(s) processada(s) com sucesso",
+            "faturas_processadas": self.faturas_processadas,
+            "faturas_com_erro": self.faturas_com_erro,
+            "avisos": self.avisos,
+            "total_enviadas": total_enviadas
+        }
@@ -0,0 +1,446 @@
+# backend/api/jobs.py
+"""Fila de tarefas em background persistida em ``FaturaTask``.
+
+Os workers (``manage.py run_fatura_worker`` / ``task_processor.py``) disputam
+os jobs com ``SELECT ... FOR UPDATE SKIP LOCKED``: cada job pendente é
+entregue a um único worker, sem bloquear os demais. Quem pega um job recebe
+uma concessão (lease) renovada por heartbeat; se o worker morrer, a
+concessão expira e o job volta a ficar disponível.
+
+Falhas transitórias (OCR que travou, deadlock no banco) são repetidas até
+``TASK_MAX_ATTEMPTS`` vezes, com backoff exponencial e jitter; handlers
+sinalizam falhas definitivas com ``ErroPermanente``.
+
+Cada job pertence a uma fila de prioridade (``FaturaTask.fila``): os workers
+pegam primeiro os jobs interativos, depois os de lote e por último o
+backfill; um job liberado há mais de ``TASK_LANE_MAX_WAIT`` segundos passa
+na frente de todos, para que as filas baixas não fiquem paradas.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import (
+    Aggregate, Case, Count, DurationField, ExpressionWrapper, F, IntegerField, Min, Q, Sum, Value, When
+)
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .extraction import AVISO, PROCESSADA, parse_vencimento, register_fatura, run_extraction, separar_texto
+from .limiter import FILA_LOTE, FILAS
+from .models import Fatura, FaturaLog, FaturaTask
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class ErroPermanente(Exception):
+    """Falha que não se resolve repetindo o job (configuração, arquivo ausente)."""
+
+
+def handler(tipo):
+    """Registra a função que executa os jobs de um ``FaturaTask.tipo``."""
+    def registrar(func):
+        HANDLERS[tipo] = func
+        return func
+    return registrar
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def backoff(tentativa):
+    """Espera até a próxima tentativa: exponencial com jitter.
+
+    O teto dobra a cada tentativa (limitado a ``TASK_RETRY_MAX_SECONDS``) e a
+    espera é sorteada na metade superior dele, para que jobs que falharam
+    juntos não voltem todos no mesmo instante.
+    """
+    teto = min(settings.TASK_RETRY_MAX_SECONDS, settings.TASK_RETRY_BASE_SECONDS * 2 ** (tentativa - 1))
+    return teto / 2 + random.uniform(0, teto / 2)
+
+
+ATIVOS = ('PENDING', 'IN_PROGRESS')
+
+
+def enqueue(unidade_consumidora, mes_referencia, tipo, fatura=None, fila=FILA_LOTE):
+    """Enfileira um job e devolve ``(task, criada)``, como ``get_or_create``.
+
+    Se já existe um job ativo para a mesma UC/mês/tipo (restrição
+    ``faturatask_ativa_unica``), ele é devolvido com ``criada=False`` em vez
+    de repetir o download/extração; se o novo pedido é de uma fila mais
+    prioritária, o job pendente é promovido para ela.
+    """
+    mes_referencia = mes_referencia.replace(day=1)
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                task = FaturaTask.objects.create(
+                    unidade_consumidora=unidade_consumidora,
+                    mes_referencia=mes_referencia,
+                    tipo=tipo,
+                    fatura=fatura,
+                    fila=fila,
+                    status='PENDING',
+                    next_run_at=timezone.now()
+                )
+            return task, True
+        except IntegrityError:
+            existente = FaturaTask.objects.filter(
+                unidade_consumidora=unidade_consumidora,
+                mes_referencia=mes_referencia,
+                tipo=tipo,
+                status__in=ATIVOS
+            ).first()
+            if existente is None:
+                continue  # o job ativo terminou entre o INSERT e a consulta
+
+            if FILAS.index(fila) < FILAS.index(existente.fila):
+                if FaturaTask.objects.filter(pk=existente.pk, status='PENDING').update(fila=fila):
+                    existente.fila = fila
+            return existente, False
+    raise RuntimeError(f"Não foi possível enfileirar {tipo} da UC {unidade_consumidora.codigo}")
+
+
+def _prioridade(agora):
+    """Ordem de atendimento: jobs envelhecidos primeiro, depois a prioridade da fila."""
+    envelhecidos = agora - timedelta(seconds=settings.TASK_LANE_MAX_WAIT)
+    return Case(
+        When(status='PENDING', next_run_at__lte=envelhecidos, then=Value(0)),
+        *[When(fila=fila, then=Value(indice + 1)) for indice, fila in enumerate(FILAS)],
+        output_field=IntegerField()
+    )
+
+
+def claim_next(worker_id, filas=None):
+    """Reserva o próximo job disponível para ``worker_id`` (ou ``None``).
+
+    Disponível = pendente com ``next_run_at`` vencido, ou em andamento com a
+    concessão vencida (worker morto). Jobs travados por outra transação são
+    pulados, não esperados. Cada reserva conta como uma tentativa. Com
+    ``filas``, só considera jobs dessas filas (workers dedicados).
+    """
+    while True:
+        agora = timezone.now()
+        with transaction.atomic():
+            disponiveis = FaturaTask.objects.select_for_update(skip_locked=True).filter(
+                Q(status='PENDING', next_run_at__lte=agora)
+                | Q(status='IN_PROGRESS', lease_expires_at__lt=agora)
+            )
+            if filas:
+                disponiveis = disponiveis.filter(fila__in=filas)
+            task = disponiveis.order_by(_prioridade(agora), 'next_run_at', 'id').first()
+            if task is None:
+                return None
+
+            if task.status == 'IN_PROGRESS':
+                logger.warning("Concessão do job %s expirou (worker %s); reassumindo", task.id, task.worker)
+                if task.attempts >= settings.TASK_MAX_ATTEMPTS:
+                    # O job derruba o worker toda vez: não insistir
+                    _falhar(task, agora, f"Worker interrompido em {task.attempts} tentativa(s)")
+                    continue
+
+            task.status = 'IN_PROGRESS'
+            task.worker = worker_id
+            task.attempts += 1
+            task.started_at = agora
+            task.completed_at = None
+            task.heartbeat_at = agora
+            task.lease_expires_at = agora + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+            task.save(update_fields=[
+                'status', 'worker', 'attempts', 'started_at', 'completed_at',
+                'heartbeat_at', 'lease_expires_at'
+            ])
+        return task
+
+
+def _falhar(task, agora, mensagem):
+    task.status = 'FAILURE'
+    task.completed_at = agora
+    task.error_message = mensagem
+    task.lease_expires_at = None
+    task.save(update_fields=['status', 'completed_at', 'error_message', 'lease_expires_at'])
+    FaturaLog.objects.create(task=task, fatura_id=task.fatura_id, level='ERROR', message=mensagem)
+
+
+def heartbeat(task, worker_id):
+    """Renova a concessão; ``False`` se o job não pertence mais a este worker."""
+    agora = timezone.now()
+    return FaturaTask.objects.filter(
+        pk=task.pk, worker=worker_id, status='IN_PROGRESS'
+    ).update(
+        heartbeat_at=agora,
+        lease_expires_at=agora + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    ) == 1
+
+
+def finish(task, worker_id, sucesso, mensagem='', retentar=False):
+    """Conclui a tentativa, se o job ainda pertencer a este worker.
+
+    Sucesso vira SUCCESS. Uma falha com ``retentar`` volta para PENDING com
+    ``next_run_at`` no futuro enquanto houver tentativas; senão vira FAILURE.
+    """
+    agora = timezone.now()
+    nova_tentativa = not sucesso and retentar and task.attempts < settings.TASK_MAX_ATTEMPTS
+    if nova_tentativa:
+        espera = backoff(task.attempts)
+        campos = dict(
+            status='PENDING',
+            next_run_at=agora + timedelta(seconds=espera),
+            completed_at=agora,
+            error_message=mensagem,
+            worker='',
+            lease_expires_at=None
+        )
+    else:
+        campos = dict(
+            status='SUCCESS' if sucesso else 'FAILURE',
+            completed_at=agora,
+            error_message=None if sucesso else mensagem,
+            lease_expires_at=None
+        )
+
+    atualizadas = FaturaTask.objects.filter(
+        pk=task.pk, worker=worker_id, status='IN_PROGRESS'
+    ).update(**campos)
+    if not atualizadas:
+        logger.warning("Job %s foi reassumido por outro worker; resultado descartado", task.id)
+        return False
+
+    if nova_tentativa:
+        level = 'WARNING'
+        mensagem = (
+            f"Tentativa {task.attempts}/{settings.TASK_MAX_ATTEMPTS} falhou: {mensagem}. "
+            f"Nova tentativa em {espera:.0f}s"
+        )
+    else:
+        level = 'INFO' if sucesso else 'ERROR'
+    FaturaLog.objects.create(
+        task=task,
+        fatura_id=task.fatura_id,
+        level=level,
+        message=mensagem or ('Tarefa concluída' if sucesso else 'Tarefa falhou')
+    )
+    return True
+
+
+PERCENTIS = (50, 90, 99)
+
+ESPERA = ExpressionWrapper(F('started_at') - F('next_run_at'), output_field=DurationField())
+EXECUCAO = ExpressionWrapper(F('completed_at') - F('started_at'), output_field=DurationField())
+
+
+class _Percentil(Aggregate):
+    """``percentile_disc`` do PostgreSQL: percentil pela posição mais próxima, sem trazer as linhas."""
+    function = 'PERCENTILE_DISC'
+    template = '%(function)s(%(fracao)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expressao, fracao, **extra):
+        super().__init__(expressao, fracao=fracao, output_field=DurationField(), **extra)
+
+
+def _percentis_sql(nome, expressao):
+    """Agregados ``<nome>_p50``, ``<nome>_p90``... para ``annotate``/``aggregate``."""
+    return {f'{nome}_p{p}': _Percentil(expressao, p / 100) for p in PERCENTIS}
+
+
+def _percentis(linha, nome):
+    """Percentis agregados de ``linha`` em segundos (negativos viram zero)."""
+    return {
+        f'p{p}': None if linha[f'{nome}_p{p}'] is None
+        else round(max(0.0, linha[f'{nome}_p{p}'].total_seconds()), 3)
+        for p in PERCENTIS
+    }
+
+
+def latency_metrics(tasks):
+    """Percentis de espera na fila e de execução por cliente e tipo de tarefa.
+
+    Agregado no banco (``percentile_disc``), sem carregar os jobs. Só a
+    última tentativa de cada job concluído em ``tasks`` entra na conta, pois
+    o job guarda apenas os instantes dela: espera é ``started_at -
+    next_run_at`` (desde que o job ficou liberado, ou seja, após o backoff
+    da retentativa) e execução é ``completed_at - started_at``. As esperas
+    e execuções das tentativas anteriores não são medidas; elas aparecem
+    apenas em ``tentativas_media``.
+    """
+    grupos = tasks.filter(
+        status__in=['SUCCESS', 'FAILURE'], started_at__isnull=False, completed_at__isnull=False
+    ).values(
+        'unidade_consumidora__customer_id', 'unidade_consumidora__customer__nome', 'tipo'
+    ).annotate(
+        total=Count('id'),
+        falhas=Count('id', filter=Q(status='FAILURE')),
+        tentativas=Sum('attempts'),
+        **_percentis_sql('espera', ESPERA),
+        **_percentis_sql('execucao', EXECUCAO),
+    ).order_by('unidade_consumidora__customer__nome', 'tipo')
+
+    return [
+        {
+            "cliente_id": grupo['unidade_consumidora__customer_id'],
+            "cliente_nome": grupo['unidade_consumidora__customer__nome'],
+            "tipo": grupo['tipo'],
+            "total": grupo['total'],
+            "falhas": grupo['falhas'],
+            "tentativas_media": round(grupo['tentativas'] / grupo['total'], 2),
+            "espera_fila_s": _percentis(grupo, 'espera'),
+            "execucao_s": _percentis(grupo, 'execucao'),
+        }
+        for grupo in grupos
+    ]
+
+
+def lane_metrics(tasks, desde):
+    """Profundidade e latência de cada fila de prioridade.
+
+    Profundidade = jobs prontos para rodar, agendados (retentativas) e em
+    andamento agora; latência = idade do job pronto mais antigo e percentis
+    de espera (última tentativa, como em ``latency_metrics``) dos jobs
+    iniciados desde ``desde``.
+    """
+    agora = timezone.now()
+    metricas = {}
+    for fila in FILAS:
+        da_fila = tasks.filter(fila=fila)
+        pendentes = da_fila.filter(status='PENDING')
+        mais_antigo = pendentes.filter(next_run_at__lte=agora).aggregate(m=Min('next_run_at'))['m']
+        iniciados = da_fila.filter(started_at__gte=desde).exclude(status='PENDING').aggregate(
+            total=Count('id'), **_percentis_sql('espera', ESPERA)
+        )
+        metricas[fila] = {
+            "prontos": pendentes.filter(next_run_at__lte=agora).count(),
+            "agendados": pendentes.filter(next_run_at__gt=agora).count(),
+            "em_andamento": da_fila.filter(status='IN_PROGRESS').count(),
+            "espera_mais_antigo_s": round((agora - mais_antigo).total_seconds(), 3) if mais_antigo else None,
+            "iniciados": iniciados['total'],
+            "espera_fila_s": _percentis(iniciados, 'espera'),
+        }
+    return metricas
+
+
+class Heartbeat:
+    """Thread que renova a concessão do job enquanto ele executa."""
+
+    def __init__(self, task, worker_id):
+        self.task = task
+        self.worker_id = worker_id
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'heartbeat-{task.id}', daemon=True)
+
+    def _run(self):
+        try:
+            while not self._parar.wait(settings.TASK_HEARTBEAT_SECONDS):
+                if not heartbeat(self.task, self.worker_id):
+                    logger.warning("Job %s perdeu a concessão", self.task.id)
+                    return
+        finally:
+            connection.close()  # conexão própria desta thread
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+
+class Worker:
+    """Laço de um processo worker: reserva, executa e finaliza jobs."""
+
+    def __init__(self, worker_id=None, poll_interval=None, filas=None):
+        self.id = worker_id or default_worker_id()
+        self.poll_interval = poll_interval or settings.TASK_POLL_INTERVAL
+        self.filas = list(filas) if filas else None
+        self.parar = threading.Event()
+
+    def run(self):
+        logger.info("Worker %s iniciado (filas: %s)", self.id, ', '.join(self.filas or FILAS))
+        while not self.parar.is_set():
+            close_old_connections()
+            task = claim_next(self.id, self.filas)
+            if task is None:
+                self.parar.wait(self.poll_interval)
+                continue
+            self.execute(task)
+        logger.info("Worker %s encerrado", self.id)
+
+    def execute(self, task):
+        func = HANDLERS.get(task.tipo)
+        with Heartbeat(task, self.id):
+            try:
+                if func is None:
+                    raise ErroPermanente(f"Tipo de tarefa sem handler: {task.tipo}")
+                mensagem = func(task)
+            except ErroPermanente as e:
+                logger.error("Job %s (%s) falhou: %s", task.id, task.tipo, e)
+                finish(task, self.id, False, str(e))
+            except Exception as e:
+                logger.exception("Job %s (%s) falhou na tentativa %s", task.id, task.tipo, task.attempts)
+                finish(task, self.id, False, str(e), retentar=True)
+            else:
+                finish(task, self.id, True, mensagem)
+
+
+# --- Handlers ----------------------------------------------------------
+
+
+@handler('REEXTRACAO')
+def reextrair_fatura(task):
+    """Roda de novo a extração sobre o PDF armazenado e atualiza valor/vencimento,
+    os dados extraídos e o texto indexado."""
+    # Pelo manager (sem o texto atual); ``task.fatura`` usaria o manager base e o traria
+    fatura = Fatura.objects.filter(pk=task.fatura_id).first() if task.fatura_id else None
+    if fatura is None or not fatura.arquivo:
+        raise ErroPermanente("Fatura sem arquivo para reextrair")
+
+    dados = run_extraction(fatura.arquivo.path, fila=task.fila)
+    if dados.get('status') == 'error':
+        raise RuntimeError(dados.get('erro', 'Erro na extração'))
+
+    fatura.valor = dados.get('valor_total') or fatura.valor
+    fatura.vencimento = parse_vencimento(dados.get('data_vencimento')) or fatura.vencimento
+    fatura.dados_extraidos, fatura.texto = separar_texto(dados)
+    fatura.save(update_fields=['valor', 'vencimento', 'dados_extraidos', 'texto', 'updated_at'])
+    return f"Fatura {fatura.id} reextraída: valor {fatura.valor}, vencimento {fatura.vencimento}"
+
+
+@handler('IMPORTACAO')
+def importar_fatura(task):
+    """Baixa a fatura da distribuidora e a registra pelo pipeline de upload.
+
+    O download é feito pelo backend configurado em ``FATURA_IMPORT_BACKEND``:
+    uma função ``(unidade_consumidora, mes_referencia) -> caminho do PDF``.
+    """
+    if not settings.FATURA_IMPORT_BACKEND:
+        raise ErroPermanente("Download automático da distribuidora não configurado (FATURA_IMPORT_BACKEND)")
+
+    uc = task.unidade_consumidora
+    baixar = import_string(settings.FATURA_IMPORT_BACKEND)
+    pdf_path = baixar(uc, task.mes_referencia)
+    try:
+        dados = run_extraction(pdf_path, fila=task.fila)
+        nome = os.path.basename(pdf_path)
+        with open(pdf_path, 'rb') as pdf_file:
+            tipo, payload = register_fatura(uc.customer, nome, File(pdf_file, name=nome), dados)
+    finally:
+        if os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+
+    if tipo == AVISO and payload.get('tipo') == 'fatura_duplicada':
+        return payload['mensagem']
+    if tipo != PROCESSADA:
+        # Fatura rejeitada (UC/mês divergentes etc.): baixar de novo não muda nada
+        raise ErroPermanente(payload.get('mensagem') or payload.get('erro'))
+    task.fatura_id = payload['id']
+    FaturaTask.objects.filter(pk=task.pk).update(fatura_id=payload['id'])
+    return f"Fatura {payload['id']} importada para a UC {uc.codigo}"
@@ -0,0 +1,344 @@
+# backend/api/limiter.py
+"""Controle de admissão das extrações de PDF (pdfplumber/OCR).
+
+Cada extração ocupa uma vaga do processo (semáforo) e uma vaga do host
+(lock ``flock`` em um de N arquivos compartilhados entre processos, ex.:
+workers do gunicorn e comandos de gerenciamento). Quando a fila de espera
+está cheia ou a espera passa do limite, ``CapacidadeEsgotada`` é levantada
+para que as views respondam 429.
+
+As extrações são separadas em filas de prioridade (``FILAS``): pré-visualização
+interativa, lotes de upload e backfill (reextrações, importações em massa).
+Cada fila pode ter vagas do host reservadas; as demais são compartilhadas e,
+nelas, uma fila só entra se nenhuma fila mais prioritária estiver esperando,
+a menos que já espere há ``EXTRACTION_LANE_MAX_WAIT`` segundos (evita que as
+filas baixas fiquem paradas indefinidamente).
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: apenas o limite por processo é aplicado
+    fcntl = None
+
+POLL_INTERVAL = 0.1  # segundos entre tentativas de obter vaga no host
+
+FILA_INTERATIVA = 'interativa'
+FILA_LOTE = 'lote'
+FILA_BACKFILL = 'backfill'
+FILAS = (FILA_INTERATIVA, FILA_LOTE, FILA_BACKFILL)  # em ordem de prioridade
+
+
+class CapacidadeEsgotada(Exception):
+    """Não há vaga de extração disponível dentro do limite de espera."""
+
+    def __init__(self, fila, aguardando, retry_after):
+        self.fila = fila
+        self.aguardando = aguardando
+        self.retry_after = retry_after
+        super().__init__(f"Capacidade de extração esgotada na fila {fila} ({aguardando} aguardando)")
+
+
+class _MetricasFila:
+    """Contadores de uma fila de prioridade neste processo."""
+
+    def __init__(self):
+        self.aguardando = 0
+        self.em_uso = 0
+        self.concedidas = 0
+        self.rejeicoes = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.execucao_total = 0.0
+
+    def as_dict(self):
+        concedidas = self.concedidas
+        return {
+            "em_uso": self.em_uso,
+            "aguardando": self.aguardando,
+            "concedidas": concedidas,
+            "rejeicoes": self.rejeicoes,
+            "espera_media_s": round(self.espera_total / concedidas, 3) if concedidas else 0.0,
+            "espera_max_s": round(self.espera_max, 3),
+            "execucao_media_s": round(self.execucao_total / concedidas, 3) if concedidas else 0.0,
+        }
+
+
+class ExtractionLimiter:
+    def __init__(self, capacidade, vagas_host, max_fila, timeout, lock_dir,
+                 reservas=None, espera_max_prioridade=30):
+        self.capacidade = capacidade
+        self.vagas_host = vagas_host if fcntl else 0
+        self.max_fila = max_fila
+        self.timeout = timeout
+        self.lock_dir = lock_dir
+        # Vagas do host exclusivas de cada fila; o restante é compartilhado
+        self.reservas = {fila: 0 for fila in FILAS}
+        self.reservas.update(reservas or {})
+        # Sem vagas do host, a fila interativa é limitada por um semáforo próprio
+        self._semaforo_interativo = threading.BoundedSemaphore(max(1, self.reservas[FILA_INTERATIVA]))
+        # Pelo menos uma vaga fica compartilhada, senão as filas sem reserva nunca
+        # rodam (ex.: host de uma CPU com a reserva padrão da interativa); corta
+        # primeiro as reservas das filas menos prioritárias
+        for fila in reversed(FILAS):
+            excesso = sum(self.reservas.values()) - max(0, self.vagas_host - 1)
+            if excesso <= 0:
+                break
+            self.reservas[fila] -= min(excesso, self.reservas[fila])
+        self.compartilhadas = max(0, self.vagas_host - sum(self.reservas.values()))
+        self.espera_max_prioridade = espera_max_prioridade
+        self._semaforo = threading.BoundedSemaphore(capacidade)
+        self._lock = threading.Lock()
+        self.filas = {fila: _MetricasFila() for fila in FILAS}
+
+    # --- Vagas do host -------------------------------------------------
+
+    def _lock_path(self, indice, fila=None):
+        if fila:
+            return os.path.join(self.lock_dir, f"extracao-{fila}-{indice}.lock")
+        return os.path.join(self.lock_dir, f"extracao-{indice}.lock")
+
+    def _try_lock(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+    def _try_host_slot(self, fila, compartilhada):
+        caminhos = [self._lock_path(i, fila) for i in range(self.reservas[fila])]
+        if compartilhada:
+            caminhos += [self._lock_path(i) for i in range(self.compartilhadas)]
+        for caminho in caminhos:
+            fd = self._try_lock(caminho)
+            if fd is not None:
+                return fd
+        return None
+
+    def _espera_path(self, fila):
+        return os.path.join(self.lock_dir, f"espera-{fila}.lock")
+
+    def _fila_aguardando_no_host(self, fila):
+        """Algum processo espera vaga nesta fila? (quem espera segura ``LOCK_SH``)"""
+        fd = self._try_lock(self._espera_path(fila))
+        if fd is None:
+            return True
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        return False
+
+    def _prioritaria_aguardando(self, fila):
+        return any(self._fila_aguardando_no_host(f) for f in FILAS[:FILAS.index(fila)])
+
+    def _acquire_host_slot(self, fila, prazo):
+        if not self.vagas_host:
+            return None
+        os.makedirs(self.lock_dir, exist_ok=True)
+        espera_fd = os.open(self._espera_path(fila), os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(espera_fd, fcntl.LOCK_SH)
+        inicio = time.monotonic()
+        try:
+            while True:
+                envelhecida = time.monotonic() - inicio >= self.espera_max_prioridade
+                compartilhada = envelhecida or not self._prioritaria_aguardando(fila)
+                fd = self._try_host_slot(fila, compartilhada)
+                if fd is not None:
+                    return fd
+                if time.monotonic() >= prazo:
+                    raise TimeoutError
+                time.sleep(POLL_INTERVAL)
+        finally:
+            fcntl.flock(espera_fd, fcntl.LOCK_UN)
+            os.close(espera_fd)
+
+    def _contar_ocupadas(self, caminhos):
+        ocupadas = 0
+        for caminho in caminhos:
+            fd = self._try_lock(caminho)
+            if fd is None:
+                ocupadas += 1
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return ocupadas
+
+    def host_slots_in_use(self, fila=None):
+        """Conta as vagas do host ocupadas (por qualquer processo).
+
+        Com ``fila``, conta só as vagas reservadas a ela.
+        """
+        if not self.vagas_host:
+            return None
+        os.makedirs(self.lock_dir, exist_ok=True)
+        if fila:
+            return self._contar_ocupadas([self._lock_path(i, fila) for i in range(self.reservas[fila])])
+        caminhos = [self._lock_path(i) for i in range(self.compartilhadas)]
+        for f in FILAS:
+            caminhos += [self._lock_path(i, f) for i in range(self.reservas[f])]
+        return self._contar_ocupadas(caminhos)
+
+    # --- Admissão ------------------------------------------------------
+
+    @property
+    def aguardando(self):
+        return sum(m.aguardando for m in self.filas.values())
+
+    def retry_after(self, fila=FILA_LOTE):
+        """Estimativa (s) para o cliente tentar de novo, pela duração média das extrações."""
+        metricas = self.filas.values()
+        concedidas = sum(m.concedidas for m in metricas)
+        media = sum(m.execucao_total for m in metricas) / concedidas if concedidas else 5.0
+        vagas = max(1, (self.reservas[fila] + self.compartilhadas) if self.vagas_host else self.capacidade)
+        return max(1, math.ceil(media * (self.filas[fila].aguardando + 1) / vagas))
+
+    def _rejeitar(self, fila):
+        with self._lock:
+            self.filas[fila].rejeicoes += 1
+        raise CapacidadeEsgotada(fila, self.filas[fila].aguardando, self.retry_after(fila))
+
+    def check_admission(self, fila=FILA_LOTE):
+        """Rejeita de imediato novas requisições quando a fila já está cheia.
+
+        A admissão é por processo: conta só as esperas deste processo
+        (``max_fila``). Entre processos só se sabe se alguém espera na fila,
+        não quantos; lá a disputa é resolvida em ``slot``, pelo prazo de espera.
+        """
+        if self.filas[fila].aguardando >= self.max_fila:
+            self._rejeitar(fila)
+
+    @contextmanager
+    def slot(self, fila=FILA_LOTE, timeout=None):
+        """Ocupa uma vaga de extração do processo e do host durante o bloco.
+
+        A fila interativa não disputa o semáforo do processo (que os lotes
+        podem ocupar por inteiro); ela é limitada pelas vagas do host ou, sem
+        elas, por um semáforo próprio do tamanho da sua reserva.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        metricas = self.filas[fila]
+        if fila != FILA_INTERATIVA:
+            semaforo = self._semaforo
+        elif not self.vagas_host:
+            semaforo = self._semaforo_interativo
+        else:
+            semaforo = None
+        with self._lock:
+            if metricas.aguardando >= self.max_fila:
+                fila_cheia = True
+            else:
+                fila_cheia = False
+                metricas.aguardando += 1
+        if fila_cheia:
+            self._rejeitar(fila)
+
+        inicio = time.monotonic()
+        prazo = inicio + timeout
+        fd = None
+        try:
+            if semaforo is not None and not semaforo.acquire(timeout=timeout):
+                raise TimeoutError
+            try:
+                fd = self._acquire_host_slot(fila, prazo)
+            except BaseException:
+                if semaforo is not None:
+                    semaforo.release()
+                raise
+        except TimeoutError:
+            with self._lock:
+                metricas.aguardando -= 1
+            self._rejeitar(fila)
+        except BaseException:
+            with self._lock:
+                metricas.aguardando -= 1
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._lock:
+            metricas.aguardando -= 1
+            metricas.em_uso += 1
+            metricas.concedidas += 1
+            metricas.espera_total += espera
+            metricas.espera_max = max(metricas.espera_max, espera)
+
+        execucao_inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            if semaforo is not None:
+                semaforo.release()
+            with self._lock:
+                metricas.em_uso -= 1
+                metricas.execucao_total += time.monotonic() - execucao_inicio
+
+    def stats(self):
+        vagas_host_em_uso = self.host_slots_in_use()
+        filas = {}
+        for fila in FILAS:
+            with self._lock:
+                filas[fila] = self.filas[fila].as_dict()
+            filas[fila].update({
+                "vagas_reservadas": self.reservas[fila],
+                "vagas_reservadas_em_uso": self.host_slots_in_use(fila),
+                "aguardando_no_host": self._fila_aguardando_no_host(fila) if self.vagas_host else None,
+            })
+
+        totais = {
+            chave: sum(f[chave] for f in filas.values())
+            for chave in ('em_uso', 'aguardando', 'concedidas', 'rejeicoes')
+        }
+        with self._lock:
+            metricas = self.filas.values()
+            espera_total = sum(m.espera_total for m in metricas)
+            execucao_total = sum(m.execucao_total for m in metricas)
+            espera_max = max(m.espera_max for m in metricas)
+        concedidas = totais['concedidas']
+        return {
+            "pid": os.getpid(),
+            "capacidade_processo": self.capacidade,
+            "vagas_host": self.vagas_host or None,
+            "vagas_host_em_uso": vagas_host_em_uso,
+            "vagas_compartilhadas": self.compartilhadas if self.vagas_host else None,
+            "max_fila": self.max_fila,
+            **totais,
+            "espera_media_s": round(espera_total / concedidas, 3) if concedidas else 0.0,
+            "espera_max_s": round(espera_max, 3),
+            "execucao_media_s": round(execucao_total / concedidas, 3) if concedidas else 0.0,
+            "filas": filas,
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Limitador único do processo, configurado a partir do settings."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = ExtractionLimiter(
+                capacidade=settings.EXTRACTION_MAX_WORKERS,
+                vagas_host=settings.EXTRACTION_HOST_SLOTS,
+                max_fila=settings.EXTRACTION_MAX_QUEUE,
+                timeout=settings.EXTRACTION_SLOT_TIMEOUT,
+                lock_dir=settings.EXTRACTION_LOCK_DIR,
+                reservas=settings.EXTRACTION_LANE_RESERVED_SLOTS,
+                espera_max_prioridade=settings.EXTRACTION_LANE_MAX_WAIT,
+            )
+        return _limiter
+
+
+def extraction_slot(fila=FILA_LOTE, timeout=None):
+    """Atalho para ``get_limiter().slot()``."""
+    return get_limiter().slot(fila=fila, timeout=timeout)
@@ -0,0 +1,108 @@
+# backend/api/mailboxes.py
+"""Leitura incremental de caixas postais locais (mbox / maildir) com faturas anexadas."""
+import hashlib
+import os
+import tempfile
+from email import policy
+from email.parser import BytesParser
+
+from .extraction import ItemLote
+
+_parser = BytesParser(policy=policy.default)
+
+# Folga na comparação com o ctime: o kernel grava o ctime com um relógio de
+# baixa resolução e alguns sistemas de arquivos o arredondam para o segundo
+MARGEM_CTIME = 1
+
+
+def iter_mbox(path, inicio=0):
+    """Itera ``(posicao_seguinte, mensagem)`` de um mbox a partir do byte ``inicio``.
+
+    O arquivo é lido linha a linha; só a mensagem corrente fica em memória.
+    ``posicao_seguinte`` é o offset onde começa a próxima mensagem e serve de
+    ponto de retomada.
+    """
+    with open(path, 'rb') as mbox:
+        mbox.seek(inicio)
+        linhas = []
+        while True:
+            posicao = mbox.tell()
+            linha = mbox.readline()
+            if not linha or (linha.startswith(b'From ') and linhas):
+                if linhas:
+                    yield posicao, _parser.parsebytes(b''.join(linhas))
+                    linhas = []
+                if not linha:
+                    return
+            linhas.append(linha)
+
+
+def _chave_maildir(nome):
+    """Parte única do nome no maildir (sem as flags ``:2,S`` que mudam ao ler)."""
+    return nome.split(':', 1)[0]
+
+
+def iter_maildir(path, ultima_chave='', desde=None):
+    """Itera ``(chave, mensagem)`` de um maildir, em ordem, após ``ultima_chave``.
+
+    Os nomes do maildir começam pelo timestamp de entrega, então a ordem
+    lexicográfica acompanha a chegada das mensagens. Uma mensagem movida de
+    outra pasta mantém o nome (e a chave antiga); o rename atualiza o ctime
+    do arquivo, então chaves até ``ultima_chave`` com ctime posterior a
+    ``desde`` (timestamp, com folga de ``MARGEM_CTIME``) também são lidas.
+    Trocas de flag (``:2,S``) também atualizam o ctime: anexos relidos assim
+    caem na checagem de SHA-256.
+    """
+    arquivos = {}
+    for subpasta in ('cur', 'new'):
+        pasta = os.path.join(path, subpasta)
+        if not os.path.isdir(pasta):
+            continue
+        with os.scandir(pasta) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and not entrada.name.startswith('.'):
+                    arquivos[_chave_maildir(entrada.name)] = entrada
+
+    chaves = []
+    for chave, entrada in arquivos.items():
+        try:
+            if chave > ultima_chave or (desde is not None and entrada.stat().st_ctime > desde - MARGEM_CTIME):
+                chaves.append(chave)
+        except FileNotFoundError:
+            continue
+
+    for chave in sorted(chaves):
+        try:
+            with open(arquivos[chave].path, 'rb') as arquivo:
+                mensagem = _parser.parse(arquivo)
+        except FileNotFoundError:
+            continue  # movida/removida por outro cliente de e-mail
+        yield chave, mensagem
+
+
+def message_id(mensagem, fallback):
+    valor = (mensagem.get('Message-ID') or '').strip()
+    return valor[:255] or fallback
+
+
+def _eh_pdf(parte):
+    nome = (parte.get_filename() or '').lower()
+    return parte.get_content_type() == 'application/pdf' or nome.endswith('.pdf')
+
+
+def iter_pdf_items(mensagem, msg_id):
+    """Converte os anexos PDF de uma mensagem em itens de lote (temporários com SHA-256)."""
+    for indice, parte in enumerate(mensagem.walk()):
+        if parte.is_multipart() or not _eh_pdf(parte):
+            continue
+        nome = parte.get_filename() or f'anexo_{indice}.pdf'
+        conteudo = parte.get_payload(decode=True) or b''
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+            temp_file.write(conteudo)
+        yield ItemLote(
+            nome,
+            pdf_path=temp_file.name,
+            temporario=True,
+            sha256=hashlib.sha256(conteudo).hexdigest(),
+            message_id=msg_id
+        )
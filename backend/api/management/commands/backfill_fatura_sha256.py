@@ -0,0 +1,50 @@
+# backend/api/management/commands/backfill_fatura_sha256.py
+import hashlib
+
+from django.core.management.base import BaseCommand
+
+from api.models import Fatura
+
+
+class Command(BaseCommand):
+    help = 'Calcula o SHA-256 dos PDFs já armazenados para a detecção de reenvios'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra o que seria alterado sem fazer alterações reais'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        faturas = Fatura.objects.filter(sha256='').exclude(arquivo='').only('id', 'arquivo')
+
+        self.stdout.write(f'Encontradas {faturas.count()} faturas sem hash')
+
+        atualizadas = 0
+        com_erro = 0
+        for fatura in faturas.iterator(chunk_size=200):
+            try:
+                hasher = hashlib.sha256()
+                with fatura.arquivo.open('rb') as arquivo:
+                    for bloco in arquivo.chunks():
+                        hasher.update(bloco)
+            except (OSError, ValueError) as e:
+                com_erro += 1
+                self.stdout.write(self.style.ERROR(f'  Fatura {fatura.id}: {e}'))
+                continue
+
+            if not dry_run:
+                Fatura.objects.filter(pk=fatura.pk).update(sha256=hasher.hexdigest())
+            atualizadas += 1
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING(f'\nDRY RUN - {atualizadas} fatura(s) seriam atualizadas')
+            )
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(f'\n{atualizadas} fatura(s) atualizada(s), {com_erro} com erro')
+        )
@@ -0,0 +1,54 @@
+# backend/api/management/commands/backfill_fatura_texto.py
+from django.core.management.base import BaseCommand
+
+from api.limiter import FILA_BACKFILL, extraction_slot
+from api.models import Fatura
+from scripts.extract_fatura_data import extract_text_from_pdf
+
+
+class Command(BaseCommand):
+    help = 'Extrai o texto dos PDFs já armazenados para a busca textual (fila de backfill)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cliente', type=int, help='Apenas as faturas deste cliente (ID)')
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Extrai de novo também as faturas que já têm texto'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra quantas faturas seriam processadas sem alterar nada'
+        )
+
+    def handle(self, *args, **options):
+        faturas = Fatura.objects.exclude(arquivo='').only('id', 'arquivo')
+        if not options['todas']:
+            faturas = faturas.filter(texto='')
+        if options['cliente']:
+            faturas = faturas.filter(unidade_consumidora__customer_id=options['cliente'])
+
+        total = faturas.count()
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'DRY RUN - {total} fatura(s) seriam indexadas'))
+            return
+
+        self.stdout.write(f'Extraindo o texto de {total} fatura(s)')
+        indexadas = 0
+        com_erro = 0
+        for fatura in faturas.iterator(chunk_size=200):
+            try:
+                # Mesma vaga do limitador que as extrações, sem atrasar uploads e reextrações
+                with extraction_slot(FILA_BACKFILL):
+                    texto = extract_text_from_pdf(fatura.arquivo.path)
+            except Exception as e:
+                com_erro += 1
+                self.stdout.write(self.style.ERROR(f'  Fatura {fatura.id}: {e}'))
+                continue
+
+            # O tsvector (Fatura.busca) é recalculado pelo banco
+            Fatura.objects.filter(pk=fatura.pk).update(texto=texto)
+            indexadas += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{indexadas} fatura(s) indexada(s), {com_erro} com erro'))
@@ -0,0 +1,43 @@
+# backend/api/management/commands/cleanup_fatura_uploads.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import FaturaUpload
+from api.uploads import discard_staging_file
+
+
+class Command(BaseCommand):
+    help = 'Remove uploads retomáveis abandonados e seus arquivos de staging'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra o que seria removido sem fazer alterações reais'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        limite = timezone.now() - settings.UPLOAD_SESSION_EXPIRY
+
+        expirados = FaturaUpload.objects.filter(status='RECEBENDO', updated_at__lt=limite)
+        finalizados = FaturaUpload.objects.exclude(status='RECEBENDO').filter(updated_at__lt=limite)
+
+        self.stdout.write(f'Uploads expirados: {expirados.count()}')
+        self.stdout.write(f'Uploads finalizados antigos: {finalizados.count()}')
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('\nEste foi um DRY RUN - nenhuma alteração foi feita')
+            )
+            return
+
+        for upload in expirados.iterator():
+            discard_staging_file(upload)
+        removidos, _ = (expirados | finalizados).delete()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'\n{removidos} upload(s) removido(s) com sucesso!')
+        )
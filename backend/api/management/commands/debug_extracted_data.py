@@ -2,6 +2,7 @@
 
 from django.core.management.base import BaseCommand
 from api.models import Fatura
+from api.limiter import extraction_slot
 import subprocess
 import sys
 import json
@@ -68,12 +69,14 @@ class Command(BaseCommand):
                         # Executar script de extração
                         script_path = os.path.join(settings.BASE_DIR, 'scripts', 'extract_fatura_data.py')
                         
-                        result = subprocess.run(
-                            [sys.executable, script_path, arquivo_path],
-                            capture_output=True,
-                            text=True,
-                            timeout=30
-                        )
+                        # Ocupa uma vaga do limitador global de extrações
+                        with extraction_slot():
+                            result = subprocess.run(
+                                [sys.executable, script_path, arquivo_path],
+                                capture_output=True,
+                                text=True,
+                                timeout=30
+                            )
                         
                         if result.returncode == 0:
                             try:
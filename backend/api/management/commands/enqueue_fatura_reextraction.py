@@ -0,0 +1,41 @@
+# backend/api/management/commands/enqueue_fatura_reextraction.py
+from django.core.management.base import BaseCommand
+
+from api.jobs import enqueue
+from api.limiter import FILA_BACKFILL
+from api.models import Fatura
+
+
+class Command(BaseCommand):
+    help = 'Enfileira a reextração das faturas armazenadas na fila de backfill (baixa prioridade)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cliente', type=int, help='Apenas as faturas deste cliente (ID)')
+        parser.add_argument('--ano', type=int, help='Apenas faturas com mês de referência neste ano')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra quantas faturas seriam enfileiradas sem criar tarefas'
+        )
+
+    def handle(self, *args, **options):
+        faturas = Fatura.objects.exclude(arquivo='').select_related('unidade_consumidora')
+        if options['cliente']:
+            faturas = faturas.filter(unidade_consumidora__customer_id=options['cliente'])
+        if options['ano']:
+            faturas = faturas.filter(mes_referencia__year=options['ano'])
+
+        total = faturas.count()
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'DRY RUN - {total} fatura(s) seriam enfileiradas'))
+            return
+
+        novas = 0
+        for fatura in faturas.iterator(chunk_size=200):
+            _, criada = enqueue(fatura.unidade_consumidora, fatura.mes_referencia, 'REEXTRACAO',
+                                fatura=fatura, fila=FILA_BACKFILL)
+            novas += criada
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{novas} reextração(ões) enfileirada(s) na fila de backfill; {total - novas} já estava(m) na fila'
+        ))
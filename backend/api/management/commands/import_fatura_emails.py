@@ -0,0 +1,173 @@
+# backend/api/management/commands/import_fatura_emails.py
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from api.extraction import PROCESSADA, ResultadoLote, process_batch
+from api.mailboxes import iter_maildir, iter_mbox, iter_pdf_items, message_id
+from api.models import Customer, FaturaEmailImport
+from api.routing import process_inbox
+
+
+class Command(BaseCommand):
+    help = 'Importa as faturas em PDF anexadas aos e-mails de uma caixa postal local (mbox ou maildir)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('origem', help='Arquivo mbox ou diretório maildir')
+        parser.add_argument(
+            '--usuario',
+            required=True,
+            help='Usuário dono da carteira; as faturas são roteadas entre os clientes dele pela UC/CPF'
+        )
+        parser.add_argument(
+            '--cliente',
+            type=int,
+            help='ID do cliente: envia todas as faturas para ele em vez de rotear'
+        )
+        parser.add_argument(
+            '--formato',
+            choices=['auto', 'mbox', 'maildir'],
+            default='auto',
+            help='Formato da caixa postal (padrão: diretório = maildir, arquivo = mbox)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Extrações simultâneas (padrão: 2)'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=25,
+            help='Mensagens por lote; o progresso é salvo ao fim de cada lote (padrão: 25)'
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            help='Máximo de mensagens lidas nesta execução'
+        )
+        parser.add_argument(
+            '--do-inicio',
+            action='store_true',
+            help='Ignora o progresso salvo e relê a caixa postal inteira'
+        )
+
+    def handle(self, *args, **options):
+        origem = os.path.abspath(options['origem'])
+        if not os.path.exists(origem):
+            raise CommandError(f'Caixa postal não encontrada: {origem}')
+
+        formato = options['formato']
+        if formato == 'auto':
+            formato = 'maildir' if os.path.isdir(origem) else 'mbox'
+        self.formato = formato
+
+        try:
+            self.user = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"Usuário '{options['usuario']}' não encontrado")
+
+        self.customer = None
+        if options['cliente']:
+            try:
+                self.customer = Customer.objects.get(pk=options['cliente'], user=self.user)
+            except Customer.DoesNotExist:
+                raise CommandError(f"Cliente {options['cliente']} não encontrado para o usuário")
+
+        self.workers = options['workers']
+        checkpoint, _ = FaturaEmailImport.objects.get_or_create(origem=origem)
+        if options['do_inicio']:
+            checkpoint.posicao = ''
+        inicio_varredura = timezone.now()
+
+        if formato == 'mbox':
+            inicio = int(checkpoint.posicao or 0)
+            if inicio > os.path.getsize(origem):
+                self.stdout.write(self.style.WARNING('mbox menor que o progresso salvo (rotacionado?); relendo do início'))
+                inicio = 0
+            mensagens = (
+                (str(posicao), msg, message_id(msg, f'mbox:{origem}:{posicao}'))
+                for posicao, msg in iter_mbox(origem, inicio)
+            )
+        else:
+            desde = checkpoint.varrido_em.timestamp() if checkpoint.varrido_em and checkpoint.posicao else None
+            mensagens = (
+                (chave, msg, message_id(msg, f'maildir:{chave}'))
+                for chave, msg in iter_maildir(origem, checkpoint.posicao, desde)
+            )
+
+        self.stdout.write(f'Importando {formato} {origem} a partir de "{checkpoint.posicao or "início"}"')
+
+        total = ResultadoLote()
+        lidas = 0
+        lote = []
+        completa = True
+        for posicao, msg, msg_id in mensagens:
+            lote.append((posicao, msg_id, msg))
+            lidas += 1
+            if len(lote) >= options['lote']:
+                self._processar_lote(checkpoint, lote, total)
+                lote = []
+            if options['limite'] and lidas >= options['limite']:
+                completa = False
+                break
+        if lote:
+            self._processar_lote(checkpoint, lote, total)
+        if formato == 'maildir' and completa:
+            # Próxima execução relê as mensagens movidas para a pasta a partir daqui
+            checkpoint.varrido_em = inicio_varredura
+            checkpoint.save()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\n{lidas} mensagem(ns) lida(s): {len(total.faturas_processadas)} fatura(s) criada(s), '
+            f'{len(total.avisos)} aviso(s), {len(total.faturas_com_erro)} erro(s)'
+        ))
+
+    def _itens(self, lote):
+        for _, msg_id, msg in lote:
+            yield from iter_pdf_items(msg, msg_id)
+
+    def _processar_lote(self, checkpoint, lote, total):
+        """Extrai e registra os anexos de um lote e só então avança o ponto de retomada."""
+        close_old_connections()
+        if self.customer:
+            resultados = process_batch(self.customer, self._itens(lote), max_workers=self.workers)
+        else:
+            resultados = ((tipo, payload) for tipo, payload, _ in process_inbox(
+                self.user, self._itens(lote), max_workers=self.workers
+            ))
+
+        anexos = criadas = sem_vaga = 0
+        for tipo, payload in resultados:
+            total.add(tipo, payload)
+            anexos += 1
+            if 'retry_after' in payload:
+                sem_vaga += 1
+            if tipo == PROCESSADA:
+                criadas += 1
+                self.stdout.write(self.style.SUCCESS(
+                    f"  ✓ {payload['arquivo']}: UC {payload['uc']}, {payload['mes_referencia'].strftime('%m/%Y')}"
+                ))
+            else:
+                motivo = payload.get('mensagem') or payload.get('erro', '')
+                self.stdout.write(f"  - {payload['arquivo']}: {motivo}")
+
+        if sem_vaga:
+            # Não avança o ponto de retomada: os anexos já importados do lote viram avisos de duplicata
+            raise CommandError(
+                f'{sem_vaga} anexo(s) sem vaga de extração; rode o comando de novo para retomar deste lote'
+            )
+
+        if self.formato == 'maildir':
+            # Lote só com mensagens movidas de outra pasta: a chave salva não recua
+            checkpoint.posicao = max(checkpoint.posicao, lote[-1][0])
+        else:
+            checkpoint.posicao = lote[-1][0]
+        checkpoint.mensagens += len(lote)
+        checkpoint.anexos += anexos
+        checkpoint.faturas_criadas += criadas
+        checkpoint.save()
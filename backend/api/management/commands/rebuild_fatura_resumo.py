@@ -0,0 +1,30 @@
+# backend/api/management/commands/rebuild_fatura_resumo.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Fatura, FaturaResumoMensal
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o resumo mensal (FaturaResumoMensal) a partir das faturas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cliente', type=int, help='Reconstrói apenas o resumo deste cliente (ID)')
+
+    def handle(self, *args, **options):
+        faturas = Fatura.objects.select_related('unidade_consumidora')
+        resumos = FaturaResumoMensal.objects.all()
+        if options['cliente']:
+            faturas = faturas.filter(unidade_consumidora__customer_id=options['cliente'])
+            resumos = resumos.filter(customer_id=options['cliente'])
+
+        with transaction.atomic():
+            removidos, _ = resumos.delete()
+            total = 0
+            for fatura in faturas.iterator(chunk_size=500):
+                FaturaResumoMensal.sincronizar(fatura, criar=True)
+                total += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Resumo reconstruído: {total} fatura(s) ({removidos} linha(s) antiga(s) removida(s))'
+        ))
@@ -0,0 +1,108 @@
+# backend/api/management/commands/run_fatura_worker.py
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.jobs import Worker
+from api.limiter import FILAS
+from api.worker import run_worker_process
+
+
+def _filas(valor):
+    filas = [fila.strip() for fila in valor.split(',') if fila.strip()]
+    invalidas = set(filas) - set(FILAS)
+    if invalidas:
+        raise CommandError(f"Fila(s) desconhecida(s): {', '.join(sorted(invalidas))} (use {', '.join(FILAS)})")
+    return filas
+
+
+def _layout(processos=None, filas=None):
+    """Filas atendidas por cada processo worker.
+
+    ``--processos``/``--filas`` definem um único grupo; sem eles, vale a
+    divisão de ``TASK_WORKER_POOLS`` (``{"fila,fila": processos}``).
+    """
+    if processos or filas:
+        filas = _filas(filas) if filas else list(FILAS)
+        pools = [(filas, max(1, processos or 1))]
+    else:
+        pools = [(_filas(filas), quantidade) for filas, quantidade in settings.TASK_WORKER_POOLS.items() if quantidade > 0]
+    # Um filho por processo, cada um com as filas que atende
+    return [filas for filas, quantidade in pools for _ in range(quantidade)]
+
+
+class Command(BaseCommand):
+    help = 'Executa os workers da fila de tarefas de faturas (importações e reextrações)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processos',
+            type=int,
+            help='Número de processos worker; sem esta opção, usa a divisão de TASK_WORKER_POOLS'
+        )
+        parser.add_argument(
+            '--filas',
+            help=f'Filas atendidas pelos processos, separadas por vírgula (padrão: {",".join(FILAS)})'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=settings.TASK_POLL_INTERVAL,
+            help='Segundos entre consultas quando a fila está vazia'
+        )
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo']
+        layout = _layout(options['processos'], options['filas'])
+        if not layout:
+            raise CommandError('Nenhum processo worker configurado (TASK_WORKER_POOLS)')
+
+        if len(layout) == 1:
+            worker = Worker(poll_interval=intervalo, filas=layout[0])
+            signal.signal(signal.SIGTERM, lambda *_: worker.parar.set())
+            signal.signal(signal.SIGINT, lambda *_: worker.parar.set())
+            self.stdout.write(f'Worker {worker.id} aguardando tarefas ({", ".join(layout[0])})...')
+            worker.run()
+            return
+
+        # spawn: cada filho abre as próprias conexões, sem herdar as do pai
+        connections.close_all()
+        contexto = multiprocessing.get_context('spawn')
+        self.parar = False
+
+        def iniciar(filas):
+            processo = contexto.Process(target=run_worker_process, args=(intervalo, filas), daemon=False)
+            processo.start()
+            return processo
+
+        def encerrar(signum, frame):
+            self.parar = True
+
+        signal.signal(signal.SIGTERM, encerrar)
+        signal.signal(signal.SIGINT, encerrar)
+
+        filhos = [iniciar(filas) for filas in layout]
+        for processo, filas in zip(filhos, layout):
+            self.stdout.write(f'Worker {processo.pid} iniciado ({", ".join(filas)})')
+
+        while not self.parar:
+            time.sleep(1)
+            if self.parar:
+                break  # os filhos recebem o mesmo sinal do grupo de processos
+            for indice, processo in enumerate(filhos):
+                if not processo.is_alive():
+                    self.stdout.write(self.style.WARNING(
+                        f'Worker {processo.pid} terminou (código {processo.exitcode}); reiniciando'
+                    ))
+                    filhos[indice] = iniciar(layout[indice])
+
+        self.stdout.write(self.style.WARNING('Encerrando workers após as tarefas em andamento...'))
+        for processo in filhos:
+            processo.terminate()  # SIGTERM: o worker termina o job atual e sai
+        for processo in filhos:
+            processo.join()
+        self.stdout.write(self.style.SUCCESS('Workers encerrados'))
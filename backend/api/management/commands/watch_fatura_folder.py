@@ -0,0 +1,223 @@
+# backend/api/management/commands/watch_fatura_folder.py
+import hashlib
+import os
+import shutil
+import signal
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.extraction import AVISO, CHUNK_SIZE, PROCESSADA, ItemLote, process_batch
+from api.models import Customer
+from api.routing import process_inbox
+
+# Avisos que não exigem ação: o arquivo já está no sistema
+AVISOS_CONCLUIDOS = {'arquivo_duplicado', 'fatura_duplicada'}
+
+
+def _sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(CHUNK_SIZE), b''):
+            hasher.update(bloco)
+    return hasher.hexdigest()
+
+
+def _destino_livre(pasta, nome):
+    """Caminho em ``pasta`` para ``nome`` sem sobrescrever arquivos existentes."""
+    destino = os.path.join(pasta, nome)
+    base, ext = os.path.splitext(nome)
+    contador = 1
+    while os.path.exists(destino):
+        destino = os.path.join(pasta, f"{base}_{contador}{ext}")
+        contador += 1
+    return destino
+
+
+class Command(BaseCommand):
+    help = 'Monitora uma pasta e importa automaticamente os PDFs de faturas que chegarem nela'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pasta', help='Pasta monitorada (scanner, scripts de download)')
+        parser.add_argument(
+            '--usuario',
+            required=True,
+            help='Usuário dono da carteira; os PDFs são roteados entre os clientes dele pela UC/CPF'
+        )
+        parser.add_argument(
+            '--cliente',
+            type=int,
+            help='ID do cliente: envia todos os PDFs para ele em vez de rotear'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos entre varreduras da pasta (padrão: 2)'
+        )
+        parser.add_argument(
+            '--estabilidade',
+            type=float,
+            default=5.0,
+            help='Segundos sem alteração de tamanho/mtime para considerar o arquivo completo (padrão: 5)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Extrações simultâneas (padrão: 2)'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=50,
+            help='Máximo de arquivos processados por varredura (padrão: 50)'
+        )
+        parser.add_argument('--pasta-processados', help='Destino dos PDFs importados (padrão: <pasta>/processados)')
+        parser.add_argument('--pasta-falhas', help='Destino dos PDFs com erro (padrão: <pasta>/falhas)')
+        parser.add_argument(
+            '--uma-vez',
+            action='store_true',
+            help='Faz uma única varredura e encerra'
+        )
+
+    def handle(self, *args, **options):
+        self.pasta = os.path.abspath(options['pasta'])
+        if not os.path.isdir(self.pasta):
+            raise CommandError(f'Pasta não encontrada: {self.pasta}')
+
+        try:
+            self.user = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"Usuário '{options['usuario']}' não encontrado")
+
+        self.customer = None
+        if options['cliente']:
+            try:
+                self.customer = Customer.objects.get(pk=options['cliente'], user=self.user)
+            except Customer.DoesNotExist:
+                raise CommandError(f"Cliente {options['cliente']} não encontrado para o usuário")
+
+        self.pasta_processados = options['pasta_processados'] or os.path.join(self.pasta, 'processados')
+        self.pasta_falhas = options['pasta_falhas'] or os.path.join(self.pasta, 'falhas')
+        os.makedirs(self.pasta_processados, exist_ok=True)
+        os.makedirs(self.pasta_falhas, exist_ok=True)
+
+        self.estabilidade = options['estabilidade']
+        self.workers = options['workers']
+        self.lote = options['lote']
+        # caminho -> (tamanho, mtime_ns) na última varredura
+        self.vistos = {}
+
+        self.parar = False
+        signal.signal(signal.SIGTERM, self._sinal_parada)
+        signal.signal(signal.SIGINT, self._sinal_parada)
+
+        destino = f'cliente {self.customer.nome}' if self.customer else f'carteira de {self.user.username}'
+        self.stdout.write(f'Monitorando {self.pasta} ({destino})')
+
+        if options['uma_vez']:
+            # A varredura única precisa de uma observação anterior para comparar
+            self._arquivos_prontos()
+            time.sleep(options['intervalo'])
+
+        while not self.parar:
+            close_old_connections()
+            prontos = self._arquivos_prontos()
+            if prontos:
+                self._processar(prontos)
+            if options['uma_vez']:
+                break
+            if not prontos:
+                time.sleep(options['intervalo'])
+
+        self.stdout.write(self.style.SUCCESS('Monitoramento encerrado'))
+
+    def _sinal_parada(self, signum, frame):
+        self.stdout.write(self.style.WARNING('Encerrando após o lote atual...'))
+        self.parar = True
+
+    def _arquivos_prontos(self):
+        """Varre a pasta e devolve os PDFs estáveis (escrita concluída).
+
+        Um arquivo está pronto quando foi visto com o mesmo tamanho/mtime em
+        duas varreduras seguidas e não é modificado há ``--estabilidade``
+        segundos. Só a idade do mtime não basta: cópias que preservam o mtime
+        original (``cp -p``, rsync, unzip) chegam com ele já antigo.
+        """
+        presentes = set()
+        prontos = []
+        with os.scandir(self.pasta) as entradas:
+            for entrada in entradas:
+                if entrada.name.startswith(('.', '~')) or not entrada.name.lower().endswith('.pdf'):
+                    continue
+                try:
+                    if not entrada.is_file(follow_symlinks=False):
+                        continue
+                    info = entrada.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+
+                presentes.add(entrada.path)
+                estado = (info.st_size, info.st_mtime_ns)
+                anterior = self.vistos.get(entrada.path)
+                self.vistos[entrada.path] = estado
+                if anterior != estado:
+                    continue  # primeira observação ou ainda sendo escrito
+                modificado_ha = time.time() - info.st_mtime_ns / 1e9
+                if modificado_ha >= self.estabilidade and info.st_size > 0:
+                    prontos.append(entrada.path)
+
+        # Esquece arquivos que sumiram (movidos por outra pessoa)
+        for caminho in list(self.vistos):
+            if caminho not in presentes:
+                del self.vistos[caminho]
+
+        return sorted(prontos)[:self.lote]
+
+    def _processar(self, caminhos):
+        itens = []
+        for caminho in caminhos:
+            try:
+                itens.append(ItemLote(os.path.basename(caminho), pdf_path=caminho, sha256=_sha256(caminho)))
+            except OSError as e:
+                itens.append(ItemLote(os.path.basename(caminho), erro=f"Erro ao ler o arquivo: {e}"))
+
+        if self.customer:
+            resultados = process_batch(self.customer, itens, max_workers=self.workers)
+        else:
+            resultados = ((tipo, payload) for tipo, payload, _ in process_inbox(self.user, itens, max_workers=self.workers))
+
+        for caminho, (tipo, payload) in zip(caminhos, resultados):
+            nome = os.path.basename(caminho)
+            if 'retry_after' in payload:
+                # Sem vaga de extração: o arquivo fica na pasta para a próxima varredura
+                self.vistos.pop(caminho, None)
+                self.stdout.write(self.style.WARNING(f"  … {nome}: {payload['erro']}"))
+                continue
+            concluido = tipo == PROCESSADA or (tipo == AVISO and payload.get('tipo') in AVISOS_CONCLUIDOS)
+            pasta = self.pasta_processados if concluido else self.pasta_falhas
+            destino = _destino_livre(pasta, nome)
+            try:
+                shutil.move(caminho, destino)
+                movido = True
+            except OSError as e:
+                movido = False
+                self.stdout.write(self.style.ERROR(f'  {nome}: não foi possível mover ({e})'))
+            self.vistos.pop(caminho, None)
+
+            if tipo == PROCESSADA:
+                self.stdout.write(self.style.SUCCESS(
+                    f"  ✓ {nome}: UC {payload['uc']}, {payload['mes_referencia'].strftime('%m/%Y')}"
+                ))
+            elif concluido:
+                self.stdout.write(self.style.WARNING(f"  = {nome}: {payload['mensagem']}"))
+            else:
+                motivo = payload.get('mensagem') or payload.get('erro', '')
+                if movido:
+                    # Ao lado do PDF na pasta de falhas; sem o PDF, o .motivo.txt ficaria órfão
+                    with open(destino + '.motivo.txt', 'w', encoding='utf-8') as arquivo_motivo:
+                        arquivo_motivo.write(motivo + '\n')
+                self.stdout.write(self.style.ERROR(f'  ✗ {nome}: {motivo}'))
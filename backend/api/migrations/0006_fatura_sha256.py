@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_faturaupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatura',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
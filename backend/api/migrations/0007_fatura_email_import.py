@@ -0,0 +1,31 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_fatura_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaturaEmailImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origem', models.CharField(max_length=500, unique=True)),
+                ('posicao', models.CharField(blank=True, default='', max_length=255)),
+                ('mensagens', models.PositiveIntegerField(default=0)),
+                ('anexos', models.PositiveIntegerField(default=0)),
+                ('faturas_criadas', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='email_message_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_fatura_email_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faturatask',
+            name='fatura',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='api.fatura'),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='tipo',
+            field=models.CharField(choices=[('IMPORTACAO', 'Importação da distribuidora'), ('REEXTRACAO', 'Reextração de dados do PDF')], default='IMPORTACAO', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='worker',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='faturatask',
+            index=models.Index(fields=['status', 'id'], name='faturatask_fila_idx'),
+        ),
+    ]
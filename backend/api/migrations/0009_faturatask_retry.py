@@ -0,0 +1,43 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_faturatask_job_queue'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='faturatask',
+            name='faturatask_fila_idx',
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='next_run_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='faturatask',
+            index=models.Index(fields=['status', 'next_run_at'], name='faturatask_fila_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_faturatask_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faturatask',
+            name='fila',
+            field=models.CharField(choices=[('interativa', 'Interativa'), ('lote', 'Lote de upload'), ('backfill', 'Backfill')], default='lote', max_length=20),
+        ),
+    ]
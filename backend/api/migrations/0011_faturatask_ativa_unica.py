@@ -0,0 +1,35 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:29
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def encerrar_duplicadas(apps, schema_editor):
+    """Mantém só o job ativo mais antigo de cada UC/mês/tipo antes de criar a restrição."""
+    FaturaTask = apps.get_model('api', 'FaturaTask')
+    vistos = set()
+    ativas = FaturaTask.objects.filter(status__in=['PENDING', 'IN_PROGRESS']).order_by('id')
+    for task in ativas.iterator():
+        chave = (task.unidade_consumidora_id, task.mes_referencia, task.tipo)
+        if chave in vistos:
+            FaturaTask.objects.filter(pk=task.pk).update(
+                status='FAILURE',
+                completed_at=timezone.now(),
+                error_message='Tarefa duplicada encerrada ao ativar a deduplicação'
+            )
+        vistos.add(chave)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_faturatask_fila'),
+    ]
+
+    operations = [
+        migrations.RunPython(encerrar_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='faturatask',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['PENDING', 'IN_PROGRESS'])), fields=('unidade_consumidora', 'mes_referencia', 'tipo'), name='faturatask_ativa_unica'),
+        ),
+    ]
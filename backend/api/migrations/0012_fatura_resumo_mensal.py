@@ -0,0 +1,58 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def popular_resumo(apps, schema_editor):
+    Fatura = apps.get_model('api', 'Fatura')
+    FaturaResumoMensal = apps.get_model('api', 'FaturaResumoMensal')
+    faturas = Fatura.objects.select_related('unidade_consumidora').iterator(chunk_size=500)
+    FaturaResumoMensal.objects.bulk_create(
+        (
+            FaturaResumoMensal(
+                customer_id=fatura.unidade_consumidora.customer_id,
+                unidade_consumidora_id=fatura.unidade_consumidora_id,
+                fatura_id=fatura.id,
+                ano=fatura.mes_referencia.year,
+                mes=fatura.mes_referencia.month,
+                valor=fatura.valor,
+                vencimento=fatura.vencimento,
+                arquivo=fatura.arquivo.name or '',
+                downloaded_at=fatura.downloaded_at,
+            )
+            for fatura in faturas
+        ),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_faturatask_ativa_unica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaturaResumoMensal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('valor', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('vencimento', models.DateField(blank=True, null=True)),
+                ('arquivo', models.FileField(blank=True, max_length=255, upload_to='')),
+                ('downloaded_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_mensais', to='api.customer')),
+                ('fatura', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='resumo', to='api.fatura')),
+                ('unidade_consumidora', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_mensais', to='api.unidadeconsumidora')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'ano', 'mes'], name='resumo_cliente_ano_idx')],
+                'constraints': [models.UniqueConstraint(fields=('unidade_consumidora', 'ano', 'mes'), name='resumo_uc_mes_unico')],
+            },
+        ),
+        migrations.RunPython(popular_resumo, migrations.RunPython.noop),
+    ]
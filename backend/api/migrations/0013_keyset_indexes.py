@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_fatura_resumo_mensal'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['user', '-created_at', 'id'], name='customer_user_recentes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='faturalog',
+            index=models.Index(fields=['fatura', '-timestamp', 'id'], name='faturalog_fatura_recentes_idx'),
+        ),
+    ]
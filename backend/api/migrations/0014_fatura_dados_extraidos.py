@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatura',
+            name='dados_extraidos',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
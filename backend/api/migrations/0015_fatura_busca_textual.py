@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-19 15:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_fatura_dados_extraidos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatura',
+            name='texto',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='busca',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('texto', config='portuguese'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='fatura',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busca'], name='fatura_busca_gin'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_fatura_busca_textual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faturaemailimport',
+            name='varrido_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
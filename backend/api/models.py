@@ -1,10 +1,13 @@
 # backend/api/models.py
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.text import get_valid_filename
 import os
 from django.contrib.auth.models import User
 import calendar
+import uuid
 from datetime import date
 
 def fatura_upload_path(instance, filename):
@@ -49,6 +52,9 @@ class Customer(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', 'id'], name='customer_user_recentes_idx'),
+        ]
 
 
 class UnidadeConsumidora(models.Model):
@@ -73,6 +79,12 @@ class UnidadeConsumidora(models.Model):
         """UC é ativa se a data de fim de vigência não estiver definida."""
         return self.data_vigencia_fim is None
     
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # UC transferida de cliente: o resumo mensal acompanha
+            self.resumos_mensais.exclude(customer_id=self.customer_id).update(customer_id=self.customer_id)
+    
     def __str__(self):
         status = "Ativa" if self.is_active else "Inativa"
         return f"{self.codigo} - {self.customer.nome} ({status})"
@@ -88,6 +100,18 @@ class UnidadeConsumidora(models.Model):
             )
         ]
 
+class FaturaManager(models.Manager):
+    """Deixa de fora o texto bruto do PDF e o tsvector, que só a busca textual usa.
+
+    Os dois chegam a dezenas de KB por fatura e nenhuma tela os lê na
+    instância; a busca filtra e anota por ``busca``/``texto`` no banco, o
+    que o ``defer`` não impede.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('texto', 'busca')
+
+
 class Fatura(models.Model):
     unidade_consumidora = models.ForeignKey(UnidadeConsumidora, on_delete=models.CASCADE, related_name='faturas')
     mes_referencia = models.DateField()  # Sempre primeiro dia do mês
@@ -99,12 +123,57 @@ class Fatura(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     task_id = models.CharField(max_length=255, null=True, blank=True)
     file = models.FileField(upload_to=fatura_upload_path, max_length=500)
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    email_message_id = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    # Saída completa do extrator (consumo, leituras, preços...). A exportação CSV/XLSX
+    # tira daqui as colunas além de valor e vencimento, sem reabrir os PDFs; preenchido
+    # no cadastro e na reextração (que serve de backfill para faturas antigas)
+    dados_extraidos = models.JSONField(default=dict, blank=True)
+    # Texto bruto do PDF e seu tsvector (gerado pelo banco) para a busca textual
+    texto = models.TextField(blank=True, default='')
+    busca = models.GeneratedField(
+        expression=SearchVector('texto', config='portuguese'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = FaturaManager()
+
+    # Campos copiados para FaturaResumoMensal
+    CAMPOS_RESUMO = {'unidade_consumidora', 'mes_referencia', 'arquivo', 'valor', 'vencimento', 'downloaded_at'}
 
     def save(self, *args, **kwargs):
-        """Garante que mes_referencia seja sempre o primeiro dia do mês"""
+        """Garante que mes_referencia seja sempre o primeiro dia do mês
+        e atualiza o resumo mensal na mesma transação"""
         if self.mes_referencia:
             self.mes_referencia = self.mes_referencia.replace(day=1)
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        criando = self._state.adding
+        with transaction.atomic():
+            # Lidos aqui (e não num pre_save) para servir ao resumo e à invalidação do cache
+            self._customer_id, self._customer_anterior = self._clientes()
+            super().save(*args, **kwargs)
+            if update_fields is None or self.CAMPOS_RESUMO.intersection(update_fields):
+                FaturaResumoMensal.sincronizar(self, customer_id=self._customer_id, criar=criando)
+
+    def _clientes(self):
+        """``(cliente atual, cliente antes desta gravação)`` com no máximo uma consulta.
+
+        Se a UC não mudou, o cliente da linha gravada é também o atual; com a
+        UC já carregada (``create(unidade_consumidora=uc)``), nem é preciso ler.
+        """
+        uc_anterior = customer_anterior = None
+        if self.pk and not self._state.adding:
+            uc_anterior, customer_anterior = Fatura.objects.filter(pk=self.pk).values_list(
+                'unidade_consumidora_id', 'unidade_consumidora__customer_id'
+            ).first() or (None, None)
+        if self._meta.get_field('unidade_consumidora').is_cached(self):
+            return self.unidade_consumidora.customer_id, customer_anterior
+        if uc_anterior == self.unidade_consumidora_id:
+            return customer_anterior, customer_anterior
+        return UnidadeConsumidora.objects.filter(pk=self.unidade_consumidora_id).values_list(
+            'customer_id', flat=True
+        ).first(), customer_anterior
 
     @property
     def mes_referencia_formatado(self):
@@ -153,19 +222,111 @@ class Fatura(models.Model):
     class Meta:
         ordering = ['-mes_referencia']
         unique_together = ('unidade_consumidora', 'mes_referencia')
+        indexes = [
+            GinIndex(fields=['busca'], name='fatura_busca_gin'),
+        ]
+
+class FaturaResumoMensal(models.Model):
+    """Resumo por cliente/UC/mês lido pelos painéis em vez de varrer ``Fatura``.
+
+    Mantido por ``Fatura.save`` (criação, edição, troca de UC ou de mês) na
+    mesma transação; a exclusão da fatura remove a linha em cascata. Para
+    reconstruir: ``manage.py rebuild_fatura_resumo``.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='resumos_mensais')
+    unidade_consumidora = models.ForeignKey(UnidadeConsumidora, on_delete=models.CASCADE, related_name='resumos_mensais')
+    fatura = models.OneToOneField(Fatura, on_delete=models.CASCADE, related_name='resumo')
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    valor = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    vencimento = models.DateField(null=True, blank=True)
+    arquivo = models.FileField(max_length=255, blank=True)
+    downloaded_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['unidade_consumidora', 'ano', 'mes'], name='resumo_uc_mes_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['customer', 'ano', 'mes'], name='resumo_cliente_ano_idx'),
+        ]
+
+    @classmethod
+    def sincronizar(cls, fatura, customer_id=None, criar=False):
+        """Cria/atualiza a linha do resumo a partir da fatura.
+
+        ``customer_id`` evita carregar a UC quando quem chama já o conhece;
+        ``criar`` indica fatura recém-inserida (ainda sem linha no resumo).
+        Roda na transação que gravou a fatura, com a linha dela bloqueada,
+        então não há corrida entre o UPDATE e o INSERT.
+        """
+        valores = {
+            'customer_id': fatura.unidade_consumidora.customer_id if customer_id is None else customer_id,
+            'unidade_consumidora_id': fatura.unidade_consumidora_id,
+            'ano': fatura.mes_referencia.year,
+            'mes': fatura.mes_referencia.month,
+            'valor': fatura.valor,
+            'vencimento': fatura.vencimento,
+            'arquivo': fatura.arquivo.name if fatura.arquivo else '',
+            'downloaded_at': fatura.downloaded_at,
+        }
+        if not criar and cls.objects.filter(fatura=fatura).update(updated_at=timezone.now(), **valores):
+            return
+        cls.objects.create(fatura=fatura, **valores)
+
+    def __str__(self):
+        return f"Resumo {self.unidade_consumidora_id} - {self.mes:02d}/{self.ano}"
 
 class FaturaTask(models.Model):
+    """Job da fila de tarefas em background (ver ``api/jobs.py``)."""
     STATUS_CHOICES = [
         ('PENDING', 'Pendente'),
         ('IN_PROGRESS', 'Em Progresso'),
         ('SUCCESS', 'Sucesso'),
         ('FAILURE', 'Falha'),
     ]
+    TIPO_CHOICES = [
+        ('IMPORTACAO', 'Importação da distribuidora'),
+        ('REEXTRACAO', 'Reextração de dados do PDF'),
+    ]
+    # Filas de prioridade (mesmos nomes das filas do limitador de extrações)
+    FILA_CHOICES = [
+        ('interativa', 'Interativa'),
+        ('lote', 'Lote de upload'),
+        ('backfill', 'Backfill'),
+    ]
     unidade_consumidora = models.ForeignKey(UnidadeConsumidora, on_delete=models.CASCADE, related_name='fatura_tasks')
     mes_referencia = models.DateField()
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, default='IMPORTACAO')
+    fila = models.CharField(max_length=20, choices=FILA_CHOICES, default='lote')
+    fatura = models.ForeignKey('Fatura', on_delete=models.CASCADE, related_name='tasks', null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    # Linha do tempo: enfileirada, liberada para rodar (muda a cada retentativa),
+    # início e fim da última tentativa
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_run_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
     error_message = models.TextField(blank=True, null=True)
+    # Execução: worker que detém o job e prazo da concessão (renovado pelo heartbeat)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_run_at'], name='faturatask_fila_idx'),
+        ]
+        constraints = [
+            # No máximo um job ativo por UC/mês/tipo: reenvios reaproveitam o existente
+            models.UniqueConstraint(
+                fields=['unidade_consumidora', 'mes_referencia', 'tipo'],
+                condition=models.Q(status__in=['PENDING', 'IN_PROGRESS']),
+                name='faturatask_ativa_unica'
+            ),
+        ]
 
     def __str__(self):
         return f"Task {self.id} for UC {self.unidade_consumidora.codigo} - {self.status}"
@@ -179,4 +340,52 @@ class FaturaLog(models.Model):
     message = models.TextField()
 
     def __str__(self):
-        return f"[{self.timestamp}] [{self.level}] {self.message}"
\ No newline at end of file
+        return f"[{self.timestamp}] [{self.level}] {self.message}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fatura', '-timestamp', 'id'], name='faturalog_fatura_recentes_idx'),
+        ]
+
+class FaturaUpload(models.Model):
+    """Upload retomável (estilo tus) montado em blocos num arquivo de staging."""
+    STATUS_CHOICES = [
+        ('RECEBENDO', 'Recebendo'),
+        ('CONCLUIDO', 'Concluído'),
+        ('CANCELADO', 'Cancelado'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fatura_uploads')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='fatura_uploads')
+    nome_arquivo = models.CharField(max_length=255)
+    tamanho = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RECEBENDO')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.tamanho
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.offset}/{self.tamanho} bytes) - {self.status}"
+
+
+class FaturaEmailImport(models.Model):
+    """Ponto de retomada da importação de faturas de uma caixa postal local (mbox/maildir)."""
+    origem = models.CharField(max_length=500, unique=True)
+    # mbox: offset em bytes após a última mensagem; maildir: chave da última mensagem
+    posicao = models.CharField(max_length=255, blank=True, default='')
+    # maildir: início da última leitura completa; mensagens movidas para a pasta
+    # depois disso são lidas mesmo com chave anterior à posicao
+    varrido_em = models.DateTimeField(null=True, blank=True)
+    mensagens = models.PositiveIntegerField(default=0)
+    anexos = models.PositiveIntegerField(default=0)
+    faturas_criadas = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.origem} ({self.mensagens} mensagens, {self.faturas_criadas} faturas)"
@@ -0,0 +1,99 @@
+# backend/api/pagination.py
+"""Paginação por cursor (keyset) para as listagens das views funcionais.
+
+A página seguinte é buscada por ``WHERE (chave) após (última chave vista)``
+em vez de ``OFFSET``, então o custo de cada página não cresce com o tamanho
+da carteira. É opcional: sem ``cursor`` nem ``page_size`` na query string a
+view devolve a lista completa, como o frontend espera hoje.
+"""
+import base64
+import binascii
+import json
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+MAX_PAGE_SIZE = 100
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _codificar(valores):
+    texto = json.dumps(valores, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def _decodificar(cursor, campos):
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        valores = json.loads(texto)
+        if not isinstance(valores, list) or len(valores) != len(campos):
+            raise ValueError
+        return [campo.to_python(valor) for campo, valor in zip(campos, valores)]
+    except (ValueError, TypeError, binascii.Error, ValidationError) as e:
+        raise CursorInvalido("Cursor inválido") from e
+
+
+def _apos(ordenacao, valores):
+    """Filtro das linhas posteriores a ``valores`` na ``ordenacao`` (ex.: ``-mes_referencia, id``)."""
+    condicao = Q()
+    iguais = Q()
+    for nome, valor in zip(ordenacao, valores):
+        campo = nome.lstrip('-')
+        lookup = 'lt' if nome.startswith('-') else 'gt'
+        condicao |= iguais & Q(**{f'{campo}__{lookup}': valor})
+        iguais &= Q(**{campo: valor})
+    return condicao
+
+
+def wants_pagination(request):
+    return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+
+def keyset_response(request, queryset, ordenacao, serializar):
+    """Resposta paginada por cursor, ou a lista completa se o cliente não pediu página.
+
+    ``ordenacao`` deve terminar em um campo único (ex.: ``('-created_at', 'id')``);
+    ``serializar`` recebe a lista de objetos da página e devolve os dados; o
+    queryset também pode ser um ``values()`` que inclua os campos da ordenação.
+    """
+    queryset = queryset.order_by(*ordenacao)
+    if not wants_pagination(request):
+        return Response(serializar(queryset))
+
+    try:
+        page_size = int(request.query_params.get('page_size') or settings.REST_FRAMEWORK['PAGE_SIZE'])
+    except ValueError:
+        return Response({"error": "page_size inválido"}, status=status.HTTP_400_BAD_REQUEST)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+
+    campos = [queryset.model._meta.get_field(nome.lstrip('-')) for nome in ordenacao]
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        try:
+            queryset = queryset.filter(_apos(ordenacao, _decodificar(cursor, campos)))
+        except CursorInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    itens = list(queryset[:page_size + 1])
+    proximo = None
+    if len(itens) > page_size:
+        itens = itens[:page_size]
+        ultimo = itens[-1]
+        if isinstance(ultimo, dict):  # queryset de values()
+            ultimo = SimpleNamespace(**ultimo)
+        proximo = _codificar([campo.value_to_string(ultimo) for campo in campos])
+
+    return Response({
+        "next": replace_query_param(request.build_absolute_uri(), 'cursor', proximo) if proximo else None,
+        "next_cursor": proximo,
+        "page_size": page_size,
+        "results": serializar(itens),
+    })
@@ -0,0 +1,144 @@
+# backend/api/pdf_validation.py
+"""Validação estrutural rápida de PDFs, antes de qualquer extração.
+
+Lê apenas o início e o fim do arquivo e a tabela xref, sem interpretar o
+conteúdo das páginas: imagens renomeadas, páginas HTML de erro do portal da
+distribuidora, PDFs truncados ou criptografados são recusados em
+milissegundos, sem ocupar uma vaga de extração.
+"""
+import os
+import re
+
+from django.conf import settings
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+HEAD_SIZE = 1024  # a especificação admite o cabeçalho %PDF- no primeiro KB
+TAIL_SIZE = 4096  # região lida em torno do último startxref
+TAIL_MAX = 1024 * 1024  # portal anexa HTML após o %%EOF; busca até 1MB do fim
+
+ASSINATURAS = [
+    (b'\x89PNG', "uma imagem PNG"),
+    (b'\xff\xd8\xff', "uma imagem JPEG"),
+    (b'GIF8', "uma imagem GIF"),
+    (b'II*\x00', "uma imagem TIFF"),
+    (b'MM\x00*', "uma imagem TIFF"),
+    (b'PK\x03\x04', "um arquivo ZIP"),
+]
+
+RE_STARTXREF = re.compile(rb'startxref\s+(\d+)')
+RE_XREF = re.compile(rb'\s*(xref|\d+\s+\d+\s+obj)')
+
+
+class PdfInvalido(Exception):
+    """O arquivo enviado não é um PDF utilizável."""
+
+
+def _tipo_real(head):
+    """Descreve o conteúdo de um arquivo sem a assinatura %PDF-."""
+    inicio = head.lstrip().lower()
+    if inicio.startswith((b'<!doctype', b'<html', b'<?xml', b'<head', b'<body')):
+        return "uma página HTML (possível página de erro do portal da distribuidora)"
+    for assinatura, descricao in ASSINATURAS:
+        if head.startswith(assinatura):
+            return descricao
+    return None
+
+
+def _ler_final(arquivo, tamanho):
+    """Lê o trecho final do PDF, terminando no último ``%%EOF``.
+
+    Alguns PDFs baixados do portal da distribuidora trazem lixo (HTML) após o
+    ``%%EOF``; os leitores o ignoram, então a busca volta até ``TAIL_MAX``.
+    """
+    fim = tamanho
+    limite = max(0, tamanho - TAIL_MAX)
+    while fim > limite:
+        inicio = max(limite, fim - TAIL_SIZE)
+        arquivo.seek(inicio)
+        # Sobreposição para não partir o marcador entre dois blocos
+        bloco = arquivo.read(fim - inicio + 8)
+        posicao = bloco.rfind(b'%%EOF')
+        if posicao >= 0:
+            fim_eof = inicio + posicao + 5
+            arquivo.seek(max(0, fim_eof - TAIL_SIZE))
+            return arquivo.read(fim_eof - max(0, fim_eof - TAIL_SIZE))
+        fim = inicio
+    return None
+
+
+def _contar_paginas(arquivo):
+    try:
+        # fallback=False: sem varredura do arquivo inteiro se a xref estiver quebrada
+        documento = PDFDocument(PDFParser(arquivo), fallback=False)
+        paginas = resolve1(documento.catalog.get('Pages'))
+        return int(resolve1(paginas.get('Count')))
+    except Exception:
+        raise PdfInvalido("Estrutura do PDF inválida (catálogo de páginas ilegível)")
+
+
+def _validar(arquivo, tamanho, max_size, max_pages):
+    if tamanho == 0:
+        raise PdfInvalido("Arquivo vazio")
+    if tamanho > max_size:
+        raise PdfInvalido(f"Arquivo excede o limite de {max_size // (1024 * 1024)} MB")
+
+    arquivo.seek(0)
+    head = arquivo.read(HEAD_SIZE)
+    inicio_pdf = head.find(b'%PDF-')
+    if inicio_pdf < 0:
+        tipo = _tipo_real(head)
+        if tipo:
+            raise PdfInvalido(f"O arquivo é {tipo}, não um PDF")
+        raise PdfInvalido("Arquivo não é um PDF (assinatura %PDF- ausente)")
+
+    tail = _ler_final(arquivo, tamanho)
+    if tail is None:
+        raise PdfInvalido("PDF incompleto ou corrompido (marcador %%EOF ausente)")
+
+    offsets = RE_STARTXREF.findall(tail)
+    if not offsets:
+        raise PdfInvalido("PDF corrompido (startxref ausente)")
+    offset_xref = inicio_pdf + int(offsets[-1])
+    if offset_xref >= tamanho:
+        raise PdfInvalido("PDF corrompido (startxref aponta para fora do arquivo)")
+
+    arquivo.seek(offset_xref)
+    inicio_xref = arquivo.read(HEAD_SIZE)
+    if not RE_XREF.match(inicio_xref):
+        raise PdfInvalido("PDF corrompido (tabela xref não encontrada)")
+
+    # Dicionário do trailer: no fim (xref clássica), no stream da xref ou, em
+    # PDFs linearizados, no início do arquivo
+    if b'/Encrypt' in tail or b'/Encrypt' in inicio_xref or b'/Encrypt' in head:
+        raise PdfInvalido("PDF protegido por senha ou criptografado não é suportado")
+
+    arquivo.seek(0)
+    paginas = _contar_paginas(arquivo)
+    if paginas < 1:
+        raise PdfInvalido("PDF sem páginas")
+    if paginas > max_pages:
+        raise PdfInvalido(f"PDF tem {paginas} páginas (limite de {max_pages})")
+    return paginas
+
+
+def validate_pdf(origem, max_size=None, max_pages=None):
+    """Valida a estrutura de um PDF (caminho ou arquivo binário com seek).
+
+    Retorna o número de páginas ou levanta ``PdfInvalido`` com o motivo.
+    A posição de leitura de arquivos abertos é restaurada ao final.
+    """
+    max_size = max_size or settings.PDF_MAX_SIZE
+    max_pages = max_pages or settings.PDF_MAX_PAGES
+
+    if isinstance(origem, (str, os.PathLike)):
+        with open(origem, 'rb') as arquivo:
+            return _validar(arquivo, os.path.getsize(origem), max_size, max_pages)
+
+    posicao = origem.tell()
+    try:
+        origem.seek(0, os.SEEK_END)
+        return _validar(origem, origem.tell(), max_size, max_pages)
+    finally:
+        origem.seek(posicao)
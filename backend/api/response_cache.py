@@ -0,0 +1,109 @@
+# backend/api/response_cache.py
+"""Cache das respostas de leitura por cliente (faturas, grade anual, UCs).
+
+Cada cliente tem uma "geração" guardada no próprio cache; a chave de cada
+resposta inclui a geração, então invalidar um cliente é só trocar a geração
+(``api/signals.py`` faz isso a cada gravação ou exclusão de Fatura, UC ou
+Customer) e as entradas antigas expiram sozinhas.
+
+O backend é o alias ``respostas`` de ``CACHES``: arquivo por padrão, para que
+a invalidação feita pelos workers da fila valha também para os processos da
+API; memória local só serve com um único processo; Redis é opcional.
+"""
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+CACHE_ALIAS = 'respostas'
+
+_lock = threading.Lock()
+_contadores = {}
+_invalidacoes = 0
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _geracao(customer_id):
+    chave = f'geracao:{customer_id}'
+    geracao = _cache().get(chave)
+    if geracao is None:
+        _cache().add(chave, uuid.uuid4().hex, timeout=None)
+        geracao = _cache().get(chave)
+    return geracao
+
+
+def _chave(request, nome, customer_id, partes):
+    # Host entra na chave porque as URLs dos PDFs são absolutas
+    parametros = sorted(request.query_params.lists())
+    assinatura = repr((request.build_absolute_uri(request.path), parametros, partes))
+    digest = hashlib.sha1(assinatura.encode()).hexdigest()
+    return f'resposta:{nome}:{customer_id}:{_geracao(customer_id)}:{digest}'
+
+
+def _contar(nome, campo):
+    with _lock:
+        contador = _contadores.setdefault(nome, {'hits': 0, 'misses': 0})
+        contador[campo] += 1
+
+
+def cached_response(request, nome, customer_id, gerar, *partes):
+    """Devolve a resposta guardada ou chama ``gerar()`` e guarda o resultado.
+
+    A chave combina ``nome`` da view, cliente, sua geração atual, a query
+    string e ``partes`` extras (ex.: o ano efetivo da grade). Só respostas
+    200 são guardadas.
+    """
+    chave = _chave(request, nome, customer_id, partes)
+    dados = _cache().get(chave)
+    if dados is not None:
+        _contar(nome, 'hits')
+        return Response(dados)
+
+    _contar(nome, 'misses')
+    response = gerar()
+    if response.status_code == 200:
+        _cache().set(chave, response.data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return response
+
+
+def invalidate_customer(*customer_ids):
+    """Descarta as respostas guardadas dos clientes.
+
+    Invalida já (leituras na mesma transação) e de novo após o commit, para
+    que uma leitura concorrente não guarde o estado anterior ao commit.
+    """
+    global _invalidacoes
+    for customer_id in {c for c in customer_ids if c is not None}:
+        chave = f'geracao:{customer_id}'
+        _cache().set(chave, uuid.uuid4().hex, timeout=None)
+        transaction.on_commit(lambda chave=chave: _cache().set(chave, uuid.uuid4().hex, timeout=None))
+        with _lock:
+            _invalidacoes += 1
+
+
+def stats():
+    """Acertos e faltas por view deste processo."""
+    with _lock:
+        views = {}
+        for nome, contador in _contadores.items():
+            total = contador['hits'] + contador['misses']
+            views[nome] = {
+                **contador,
+                'taxa_acerto': round(contador['hits'] / total, 3) if total else None,
+            }
+        hits = sum(c['hits'] for c in _contadores.values())
+        total = hits + sum(c['misses'] for c in _contadores.values())
+        return {
+            'backend': settings.CACHES[CACHE_ALIAS]['BACKEND'].rsplit('.', 1)[-1],
+            'timeout': settings.RESPONSE_CACHE_TIMEOUT,
+            'taxa_acerto': round(hits / total, 3) if total else None,
+            'invalidacoes': _invalidacoes,
+            'views': views,
+        }
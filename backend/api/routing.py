@@ -0,0 +1,137 @@
+# backend/api/routing.py
+"""Caixa de entrada do usuário: roteia PDFs para o cliente certo pela UC e pelo CPF."""
+import re
+from collections import defaultdict, namedtuple
+
+from .extraction import (
+    AVISO, ERRO, extract_in_order, mark_duplicates, parse_mes_referencia,
+    register_item, validate_items
+)
+from .models import Customer, Fatura, UnidadeConsumidora
+
+# customer é None quando a fatura não pôde ser roteada; motivo explica o porquê
+Rota = namedtuple('Rota', ['customer', 'uc_id', 'criterio', 'motivo', 'sugeridos'])
+
+
+def somente_digitos(valor):
+    return re.sub(r'\D', '', valor or '')
+
+
+class IndiceRoteamento:
+    """Índice em memória das UCs e CPFs de todos os clientes do usuário.
+
+    Montado uma única vez por lote na thread da requisição; as threads de
+    extração só o consultam (``sera_armazenada``), sem acesso ao banco.
+    """
+
+    def __init__(self, user):
+        self.clientes = {c.id: c for c in Customer.objects.filter(user=user)}
+
+        # codigo -> {customer_id: uc_id}; a UC mais recente do cliente prevalece
+        self.ucs = defaultdict(dict)
+        ucs = UnidadeConsumidora.objects.filter(
+            customer__user=user
+        ).order_by('created_at').values_list('id', 'codigo', 'customer_id')
+        for uc_id, codigo, customer_id in ucs:
+            self.ucs[codigo][customer_id] = uc_id
+
+        self.cpfs = defaultdict(set)
+        for cliente in self.clientes.values():
+            for cpf in (cliente.cpf, cliente.cpf_titular):
+                if somente_digitos(cpf):
+                    self.cpfs[somente_digitos(cpf)].add(cliente.id)
+
+        self.existentes = set(
+            Fatura.objects.filter(
+                unidade_consumidora__customer__user=user
+            ).values_list('unidade_consumidora_id', 'mes_referencia')
+        )
+
+    def rotear(self, dados):
+        """Escolhe o cliente da fatura: pela UC e, se houver empate, pelo CPF."""
+        por_uc = self.ucs.get(dados.get('unidade_consumidora') or '', {})
+        por_cpf = self.cpfs.get(somente_digitos(dados.get('cpf_cnpj')), set())
+
+        if len(por_uc) == 1:
+            customer_id, uc_id = next(iter(por_uc.items()))
+            criterio = 'uc_cpf' if customer_id in por_cpf else 'uc'
+            return Rota(self.clientes[customer_id], uc_id, criterio, None, [])
+
+        if por_uc:
+            desempate = set(por_uc) & por_cpf
+            if len(desempate) == 1:
+                customer_id = desempate.pop()
+                return Rota(self.clientes[customer_id], por_uc[customer_id], 'uc_cpf', None, [])
+            return Rota(None, None, None, 'uc_ambigua', sorted(por_uc))
+
+        if por_cpf:
+            return Rota(None, None, None, 'uc_nao_cadastrada', sorted(por_cpf))
+        return Rota(None, None, None, 'sem_cliente', [])
+
+    def sera_armazenada(self, dados):
+        rota = self.rotear(dados)
+        if rota.customer is None:
+            return False
+        return (rota.uc_id, parse_mes_referencia(dados.get('mes_referencia'))) not in self.existentes
+
+
+MENSAGENS_NAO_ROTEADA = {
+    'uc_ambigua': "A UC {uc} está cadastrada em mais de um cliente e o CPF não desempata.",
+    'uc_nao_cadastrada': "A UC {uc} não está cadastrada; o CPF {cpf} pertence a cliente(s) da sua carteira.",
+    'sem_cliente': "Nenhum cliente da sua carteira tem a UC {uc} ou o CPF {cpf}.",
+}
+
+
+def _aviso_nao_roteada(indice, item, rota):
+    uc_codigo = item.dados.get('unidade_consumidora')
+    cpf = item.dados.get('cpf_cnpj')
+    return AVISO, {
+        "tipo": "nao_roteada",
+        "arquivo": item.nome,
+        "uc_codigo": uc_codigo,
+        "cpf_cnpj": cpf,
+        "motivo": rota.motivo,
+        "clientes_sugeridos": [
+            {"id": cid, "nome": indice.clientes[cid].nome} for cid in rota.sugeridos
+        ],
+        "mensagem": MENSAGENS_NAO_ROTEADA[rota.motivo].format(uc=uc_codigo or '-', cpf=cpf or '-')
+    }
+
+
+def _entrada_relatorio(nome, tipo, rota):
+    entrada = {"arquivo": nome, "resultado": tipo, "roteada": bool(rota and rota.customer)}
+    if rota and rota.customer:
+        entrada.update({
+            "cliente_id": rota.customer.id,
+            "cliente_nome": rota.customer.nome,
+            "criterio": rota.criterio,
+        })
+    elif rota:
+        entrada["motivo"] = rota.motivo
+    return entrada
+
+
+def process_inbox(user, itens, max_workers=None):
+    """Extrai, roteia e registra PDFs de vários clientes em uma única passada.
+
+    Gera ``(tipo, payload, entrada_relatorio)`` na ordem de envio. Arquivos
+    que não pertencem a nenhum cliente (ou já cadastrados) são descartados
+    pelo probe, sem extração completa.
+    """
+    indice = IndiceRoteamento(user)
+    itens = mark_duplicates(user, validate_items(itens))
+    for item in extract_in_order(itens, max_workers=max_workers, triagem=indice):
+        rota = None
+        if item.resultado:
+            tipo, payload = register_item(None, item)
+        elif item.dados.get('status') == 'error':
+            item.cleanup()
+            tipo, payload = ERRO, {"arquivo": item.nome, "erro": item.dados.get('erro', 'Erro na extração')}
+        else:
+            rota = indice.rotear(item.dados)
+            if rota.customer is None:
+                item.cleanup()
+                tipo, payload = _aviso_nao_roteada(indice, item, rota)
+            else:
+                tipo, payload = register_item(rota.customer, item)
+        yield tipo, payload, _entrada_relatorio(item.nome, tipo, rota)
@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
@@ -24,12 +26,107 @@ class FaturaSerializer(serializers.ModelSerializer):
             'mes_nome_completo', 'arquivo', 'arquivo_url', 'valor', 'vencimento', 
             'downloaded_at', 'created_at', 'updated_at'
         ]
+
+    @classmethod
+    def otimizar_queryset(cls, queryset):
+        """Traz o código da UC no mesmo SELECT e só as colunas que a listagem usa"""
+        return queryset.select_related('unidade_consumidora').only(
+            'id', 'unidade_consumidora__codigo', 'mes_referencia', 'arquivo', 'valor',
+            'vencimento', 'downloaded_at', 'created_at', 'updated_at'
+        )
     
     def get_arquivo_url(self, obj):
         if obj.arquivo:
             return obj.arquivo.url
         return None
 
+
+class CamposInvalidos(ValueError):
+    pass
+
+
+def _propriedade_do_mes(nome):
+    """Calcula uma propriedade ``mes_*`` da Fatura só a partir da data, sem instanciar o modelo."""
+    propriedade = getattr(Fatura, nome).fget
+    return lambda mes_referencia: propriedade(SimpleNamespace(mes_referencia=mes_referencia))
+
+
+class FaturaValoresSerializer:
+    """Listagem enxuta de faturas (``?fields=`` ou ``?compact=1``) a partir de ``values()``.
+
+    Sem instâncias do modelo nem campos do DRF ligados a cada linha: cada campo
+    pedido vira uma coluna do SELECT e, quando precisa, uma conversão. A
+    formatação (datas, decimais, URLs) é a mesma do ``FaturaSerializer``.
+    """
+    # campo da API -> coluna do values()
+    COLUNAS = {
+        'id': 'id',
+        'unidade_consumidora': 'unidade_consumidora',
+        'unidade_consumidora_codigo': 'unidade_consumidora__codigo',
+        'mes_referencia': 'mes_referencia',
+        'mes_referencia_formatado': 'mes_referencia',
+        'mes_referencia_texto': 'mes_referencia',
+        'mes_nome_completo': 'mes_referencia',
+        'arquivo': 'arquivo',
+        'arquivo_url': 'arquivo',
+        'valor': 'valor',
+        'vencimento': 'vencimento',
+        'downloaded_at': 'downloaded_at',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }
+    # Sem as strings derivadas do mês, a URL absoluta duplicada e os carimbos de auditoria
+    COMPACTOS = (
+        'id', 'unidade_consumidora', 'unidade_consumidora_codigo', 'mes_referencia',
+        'arquivo_url', 'valor', 'vencimento', 'downloaded_at',
+    )
+
+    def __init__(self, campos, request):
+        self.campos = campos
+        storage = Fatura._meta.get_field('arquivo').storage
+        formatos = FaturaSerializer(context={'request': request}).fields
+        conversoes = {
+            'arquivo': lambda nome: request.build_absolute_uri(storage.url(nome)) if nome else None,
+            'arquivo_url': lambda nome: storage.url(nome) if nome else None,
+            **{nome: _propriedade_do_mes(nome)
+               for nome in ('mes_referencia_formatado', 'mes_referencia_texto', 'mes_nome_completo')},
+            **{nome: formatos[nome].to_representation
+               for nome in ('mes_referencia', 'valor', 'vencimento', 'downloaded_at', 'created_at', 'updated_at')},
+        }
+        self._saida = [(campo, self.COLUNAS[campo], conversoes.get(campo)) for campo in campos]
+
+    @classmethod
+    def campos_solicitados(cls, query_params):
+        """Campos de ``?fields=a,b`` ou o conjunto de ``?compact=1``; ``None`` = representação completa."""
+        if 'fields' in query_params:
+            campos = list(dict.fromkeys(c.strip() for c in query_params['fields'].split(',') if c.strip()))
+            desconhecidos = [campo for campo in campos if campo not in cls.COLUNAS]
+            if desconhecidos or not campos:
+                raise CamposInvalidos(
+                    f"Campos inválidos: {', '.join(desconhecidos) or '(nenhum)'}. "
+                    f"Disponíveis: {', '.join(cls.COLUNAS)}"
+                )
+            return campos
+        if query_params.get('compact', '').lower() in ('1', 'true'):
+            return list(cls.COMPACTOS)
+        return None
+
+    def queryset(self, queryset, ordenacao=()):
+        """``values()`` com as colunas pedidas mais as da ordenação (usadas pelo cursor)."""
+        colunas = {coluna for _, coluna, _ in self._saida}
+        colunas.update(nome.lstrip('-') for nome in ordenacao)
+        return queryset.values(*colunas)
+
+    def serializar(self, linhas):
+        saida = self._saida
+        return [
+            {
+                campo: conversao(linha[coluna]) if conversao and linha[coluna] is not None else linha[coluna]
+                for campo, coluna, conversao in saida
+            }
+            for linha in linhas
+        ]
+
 # backend/api/serializers.py - CORREÇÃO do FaturaTaskSerializer
 
 class FaturaTaskSerializer(serializers.ModelSerializer):
@@ -37,9 +134,18 @@ class FaturaTaskSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = FaturaTask
-        # ✅ CORREÇÃO: Remover 'created_at' e 'updated_at' que não existem na tabela
         fields = ['id', 'unidade_consumidora', 'unidade_consumidora_codigo', 
-                  'mes_referencia', 'status', 'completed_at', 'error_message']
+                  'mes_referencia', 'tipo', 'fila', 'fatura', 'status', 'attempts', 'created_at',
+                  'next_run_at', 'started_at', 'completed_at', 'error_message']
+
+    @classmethod
+    def otimizar_queryset(cls, queryset):
+        """Traz o código da UC no mesmo SELECT e só as colunas que a listagem usa"""
+        return queryset.select_related('unidade_consumidora').only(
+            'id', 'unidade_consumidora__codigo', 'mes_referencia', 'tipo', 'fila', 'fatura',
+            'status', 'attempts', 'created_at', 'next_run_at', 'started_at', 'completed_at',
+            'error_message'
+        )
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,54 @@
+# backend/api/signals.py
+"""Invalidação do cache de respostas (``api/response_cache.py``) nas escritas.
+
+Toda gravação ou exclusão de Fatura, UC ou Customer invalida o cliente
+afetado; se a fatura ou a UC trocou de cliente, o anterior também. No caso
+da fatura, os dois clientes são lidos por ``Fatura.save``.
+Atualizações em massa (``QuerySet.update``) não disparam sinais e não passam
+por aqui.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Customer, Fatura, UnidadeConsumidora
+from .response_cache import invalidate_customer
+
+
+def _cliente_da_uc(uc_id):
+    return UnidadeConsumidora.objects.filter(pk=uc_id).values_list('customer_id', flat=True).first()
+
+
+@receiver(post_save, sender=Fatura)
+def invalidar_fatura_salva(sender, instance, raw=False, **kwargs):
+    # Cliente atual e anterior já lidos por ``Fatura.save`` (sem consulta extra aqui)
+    if not raw:
+        invalidate_customer(instance._customer_id, instance._customer_anterior)
+
+
+@receiver(post_delete, sender=Fatura)
+def invalidar_fatura_excluida(sender, instance, **kwargs):
+    invalidate_customer(_cliente_da_uc(instance.unidade_consumidora_id))
+
+
+@receiver(pre_save, sender=UnidadeConsumidora)
+def guardar_cliente_anterior_uc(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._customer_anterior = _cliente_da_uc(instance.pk)
+
+
+@receiver(post_save, sender=UnidadeConsumidora)
+def invalidar_uc_salva(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_customer(instance.customer_id, getattr(instance, '_customer_anterior', None))
+
+
+@receiver(post_delete, sender=UnidadeConsumidora)
+def invalidar_uc_excluida(sender, instance, **kwargs):
+    invalidate_customer(instance.customer_id)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidar_customer(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_customer(instance.pk)
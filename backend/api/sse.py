@@ -0,0 +1,38 @@
+# backend/api/sse.py
+"""Utilitários para respostas Server-Sent Events (text/event-stream)."""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+
+def sse_event(evento, dados, event_id=None):
+    """Formata um evento SSE com ``dados`` serializados em JSON."""
+    linhas = []
+    if event_id is not None:
+        linhas.append(f"id: {event_id}")
+    linhas.append(f"event: {evento}")
+    linhas.append(f"data: {json.dumps(dados, cls=DjangoJSONEncoder, ensure_ascii=False)}")
+    return "\n".join(linhas) + "\n\n"
+
+
+def sse_response(eventos):
+    """Envolve um gerador de eventos numa resposta sem buffer intermediário."""
+    response = StreamingHttpResponse(eventos, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Impede o nginx de acumular a resposta antes de repassá-la ao cliente
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Permite negociar ``Accept: text/event-stream``; erros viram um evento 'erro'."""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return sse_event('erro', data).encode(self.charset)
@@ -1,3 +1,1514 @@
-from django.test import TestCase
+import base64
+import fcntl
+import hashlib
+import io
+from importlib import import_module
+import json
+import os
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from email.message import EmailMessage
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchQuery
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.apps import apps
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .archives import ArquivoCompactadoInvalido, iter_archive_members
+from .extraction import CHUNK_SIZE, ERRO, ItemLote, _extrair, parse_mes_referencia, register_fatura
+from .jobs import (
+    ErroPermanente, Heartbeat, Worker, claim_next, enqueue, finish, heartbeat, latency_metrics, reextrair_fatura
+)
+from .management.commands.run_fatura_worker import _layout as layout_workers
+from .management.commands.watch_fatura_folder import Command as WatchFaturaFolder
+from .limiter import (
+    FILA_BACKFILL, FILA_INTERATIVA, FILA_LOTE, CapacidadeEsgotada, ExtractionLimiter, extraction_slot
+)
+from .models import (
+    Customer, Fatura, FaturaEmailImport, FaturaResumoMensal, FaturaTask, FaturaUpload, UnidadeConsumidora
+)
+from .pdf_validation import PdfInvalido, validate_pdf
+from .routing import IndiceRoteamento
+from . import uploads
+
+# Cache de respostas em memória nos testes, isolado do cache em disco da instância
+_cache_testes = override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'respostas': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'respostas-testes'},
+})
+
+
+def setUpModule():
+    _cache_testes.enable()
+
+
+def tearDownModule():
+    _cache_testes.disable()
+
+
+class FaturasPorAnoQueryCountTest(TestCase):
+    """A grade anual deve custar um número fixo de consultas, independente de UCs e faturas.
+
+    Cliente, validadores do GET condicional (2), UCs, resumo do ano e anos disponíveis.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('grade', 'grade@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/customers/{self.customer.id}/faturas/por-ano/'
+
+    def _criar_ucs(self, quantidade, inicio=0):
+        for indice in range(inicio, inicio + quantidade):
+            uc = UnidadeConsumidora.objects.create(
+                customer=self.customer, codigo=f'{1000 + indice}', endereco=f'Endereço {indice}'
+            )
+            for mes in (1, 5, 12):
+                Fatura.objects.create(
+                    unidade_consumidora=uc, mes_referencia=date(2025, mes, 1),
+                    valor='100.00', vencimento=date(2025, mes, 10)
+                )
+
+    def test_consultas_constantes(self):
+        self._criar_ucs(2)
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url, {'ano': 2025})
+        self.assertEqual(response.status_code, 200)
+
+        self._criar_ucs(20, inicio=2)
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url, {'ano': 2025})
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data['total_ucs'], 22)
+        self.assertEqual(len(data['faturas_por_mes']['5']['ucs']), 22)
+        self.assertIsNotNone(data['faturas_por_mes']['5']['ucs'][0]['fatura'])
+        self.assertIsNone(data['faturas_por_mes']['6']['ucs'][0]['fatura'])
+        self.assertEqual(data['anos_disponiveis'], [2025])
+
+    def test_304_sem_montar_a_grade(self):
+        self._criar_ucs(3)
+        response = self.client.get(self.url, {'ano': 2025})
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # Só o cliente e os dois agregados dos validadores
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'ano': 2025}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.assertNotEqual(self.client.get(self.url, {'ano': 2024})['ETag'], etag)
+
+        fatura = Fatura.objects.filter(unidade_consumidora__customer=self.customer).first()
+        fatura.valor = '150.00'
+        fatura.save()
+        response = self.client.get(self.url, {'ano': 2025}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        Fatura.objects.filter(pk=fatura.pk).delete()
+        etag_apos_edicao = response['ETag']
+        response = self.client.get(self.url, {'ano': 2025}, HTTP_IF_NONE_MATCH=etag_apos_edicao)
+        self.assertEqual(response.status_code, 200)
+
+    def test_ano_invalido(self):
+        for ano in ('abc', '2025.5', '100000'):
+            with self.subTest(ano), self.assertNumQueries(1):
+                response = self.client.get(self.url, {'ano': ano})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ano': '02025'}).json()['ano_atual'], 2025)
+
+
+class FaturaResumoMensalTest(TestCase):
+    """O resumo mensal acompanha criação, edição, troca de UC/mês e exclusão das faturas."""
+
+    def setUp(self):
+        user = User.objects.create_user('resumo', 'resumo@example.com', 'senha')
+        self.customer = Customer.objects.create(user=user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.outro = Customer.objects.create(user=user, nome='Outro', cpf='11111111111', endereco='Rua B')
+        self.uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo='1', endereco='A')
+        self.uc2 = UnidadeConsumidora.objects.create(customer=self.customer, codigo='2', endereco='B')
+
+    def test_resumo_acompanha_fatura(self):
+        fatura = Fatura.objects.create(unidade_consumidora=self.uc, mes_referencia=date(2025, 3, 15), valor='10.00')
+        resumo = FaturaResumoMensal.objects.get(fatura=fatura)
+        self.assertEqual((resumo.customer_id, resumo.ano, resumo.mes), (self.customer.id, 2025, 3))
+
+        fatura.valor = '12.50'
+        fatura.mes_referencia = date(2025, 4, 1)
+        fatura.unidade_consumidora = self.uc2
+        fatura.save()
+        resumo.refresh_from_db()
+        self.assertEqual((resumo.unidade_consumidora_id, resumo.mes, str(resumo.valor)), (self.uc2.id, 4, '12.50'))
+        self.assertEqual(FaturaResumoMensal.objects.count(), 1)
+
+        self.uc2.customer = self.outro
+        self.uc2.save()
+        resumo.refresh_from_db()
+        self.assertEqual(resumo.customer_id, self.outro.id)
+
+        Fatura.objects.filter(pk=fatura.pk).delete()
+        self.assertFalse(FaturaResumoMensal.objects.exists())
+
+
+class ResponseCacheTest(TestCase):
+    """Leituras repetidas saem do cache; gravações do cliente invalidam as respostas dele."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('cache', 'cache@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo='1', endereco='A')
+        self.fatura = Fatura.objects.create(
+            unidade_consumidora=self.uc, mes_referencia=date(2025, 5, 1), valor='100.00'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/customers/{self.customer.id}/faturas/por-ano/'
+
+    def test_hit_e_invalidacao(self):
+        self.client.get(self.url, {'ano': 2025})
+        # Cliente e validadores do GET condicional; a grade vem do cache
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'ano': 2025})
+        self.assertEqual(response.json()['faturas_por_mes']['5']['ucs'][0]['fatura']['valor'], '100.00')
+
+        self.fatura.valor = '150.00'
+        self.fatura.save()
+        response = self.client.get(self.url, {'ano': 2025})
+        self.assertEqual(response.json()['faturas_por_mes']['5']['ucs'][0]['fatura']['valor'], '150.00')
+
+        UnidadeConsumidora.objects.create(customer=self.customer, codigo='2', endereco='B')
+        ucs = self.client.get(f'/api/customers/{self.customer.id}/ucs/').json()
+        self.assertEqual(len(ucs), 2)
+
+
+class ListagemQueryCountTest(TestCase):
+    """Listagens de faturas e tarefas não podem fazer uma consulta por linha (código da UC)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('listagem', 'listagem@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        for indice in range(15):
+            uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo=f'{indice}', endereco='A')
+            for mes in (1, 2):
+                Fatura.objects.create(unidade_consumidora=uc, mes_referencia=date(2025, mes, 1), valor='10.00')
+                FaturaTask.objects.create(unidade_consumidora=uc, mes_referencia=date(2025, mes, 1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_get_faturas(self):
+        url = f'/api/customers/{self.customer.id}/faturas/'
+        # Cliente, dois validadores do GET condicional e a listagem
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()), 30)
+        self.assertEqual(response.json()[0]['unidade_consumidora_codigo'], '0')
+
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'page_size': 20})
+        self.assertEqual(len(response.json()['results']), 20)
+
+    def test_get_fatura_tasks(self):
+        url = f'/api/customers/{self.customer.id}/faturas/tasks/'
+        # Cliente, validador do GET condicional e a listagem
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'page_size': 30})
+        self.assertEqual(len(response.json()['results']), 30)
+        self.assertTrue(all(task['unidade_consumidora_codigo'] for task in response.json()['results']))
+
+
+class FaturaCamposTest(TestCase):
+    """``?fields=`` e ``?compact=1`` devolvem os mesmos valores da representação completa."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('campos', 'campos@example.com', 'senha')
+        customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        uc = UnidadeConsumidora.objects.create(customer=customer, codigo='77', endereco='A')
+        for mes in (1, 2, 3):
+            Fatura.objects.create(
+                unidade_consumidora=uc, mes_referencia=date(2025, mes, 1), valor='0.00' if mes == 1 else '10.50',
+                vencimento=date(2025, mes, 10), arquivo=f'faturas/2025/0{mes}/77.pdf'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/customers/{customer.id}/faturas/'
+
+    def test_campos_e_modo_compacto(self):
+        completa = self.client.get(self.url).json()
+
+        response = self.client.get(self.url, {'fields': 'id,valor,arquivo,mes_nome_completo,created_at'})
+        self.assertEqual(response.json(), [
+            {campo: fatura[campo] for campo in ('id', 'valor', 'arquivo', 'mes_nome_completo', 'created_at')}
+            for fatura in completa
+        ])
+
+        compacta = self.client.get(self.url, {'compact': '1', 'page_size': 2}).json()
+        self.assertEqual(compacta['results'][0], {
+            campo: completa[0][campo] for campo in compacta['results'][0]
+        })
+        self.assertNotIn('mes_referencia_texto', compacta['results'][0])
+        proxima = self.client.get(self.url, {'compact': '1', 'page_size': 2, 'cursor': compacta['next_cursor']})
+        self.assertEqual([f['id'] for f in proxima.json()['results']], [completa[2]['id']])
+
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,senha'}).status_code, 400)
+
+
+class ExportacaoFaturasTest(TestCase):
+    """Planilhas da carteira: colunas da fatura mais os dados extraídos, em CSV e XLSX."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('export', 'export@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='01234567890', endereco='Rua A')
+        uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo='0042', endereco='A')
+        for mes in (1, 2):
+            Fatura.objects.create(
+                unidade_consumidora=uc, mes_referencia=date(2025, mes, 1), valor='166.07',
+                vencimento=date(2025, mes, 27), dados_extraidos={'consumo_kwh': '1168.00', 'nome_cliente': 'A & B'}
+            )
+        Fatura.objects.create(unidade_consumidora=uc, mes_referencia=date(2024, 12, 1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/customers/{self.customer.id}/faturas/export/'
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'ano': 2025})
+        self.assertTrue(response.streaming)
+        linhas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(linhas), 3)
+        cabecalho, primeira = linhas[0].split(';'), linhas[1].split(';')
+        self.assertEqual(primeira[cabecalho.index('UC')], '0042')
+        self.assertEqual(primeira[cabecalho.index('Mês de referência')], '01/2025')
+        self.assertEqual(primeira[cabecalho.index('Valor (R$)')], '166,07')
+        self.assertEqual(primeira[cabecalho.index('Consumo (kWh)')], '1168,00')
+
+    def test_xlsx(self):
+        response = self.client.get('/api/faturas/export/', {'formato': 'xlsx'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as pacote:
+            aba = ElementTree.fromstring(pacote.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        linhas = aba.findall('.//s:row', ns)
+        self.assertEqual(len(linhas), 4)
+        celulas = linhas[2].findall('s:c', ns)
+        self.assertEqual(celulas[1].find('.//s:t', ns).text, '01234567890')
+        self.assertEqual(celulas[5].find('s:v', ns).text, '166.07')
+
+        self.assertEqual(self.client.get(self.url, {'formato': 'pdf'}).status_code, 400)
+
+    def test_colunas_vem_do_cadastro(self):
+        uc = self.customer.unidades_consumidoras.get()
+        dados = {'unidade_consumidora': '0042', 'mes_referencia': 'MAR/2025', 'valor_total': '99.90',
+                 'consumo_kwh': '321.00', 'texto': 'FATURA'}
+        with mock.patch('api.extraction.check_fatura', return_value=(uc, date(2025, 3, 1), None)):
+            register_fatura(self.customer, 'marco.pdf', '', dados)
+
+        linhas = b''.join(self.client.get(self.url, {'ano': 2025}).streaming_content).decode('utf-8-sig').splitlines()
+        cabecalho, ultima = linhas[0].split(';'), linhas[-1].split(';')
+        self.assertEqual(ultima[cabecalho.index('Mês de referência')], '03/2025')
+        self.assertEqual(ultima[cabecalho.index('Consumo (kWh)')], '321,00')
+
+
+class DownloadFaturasZipTest(TestCase):
+    """O ZIP traz os PDFs filtrados, sem compressão, e lista os que sumiram do disco."""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user('zip', 'zip@example.com', 'senha')
+        customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        uc = UnidadeConsumidora.objects.create(customer=customer, codigo='55', endereco='A')
+        os.makedirs(os.path.join(self.media.name, 'faturas'))
+        for mes in (1, 2, 3):
+            nome = f'faturas/55_{mes}.pdf'
+            if mes != 2:
+                with open(os.path.join(self.media.name, nome), 'wb') as arquivo:
+                    arquivo.write(b'%PDF-1.4 ' + bytes([mes]) * 1000)
+            Fatura.objects.create(unidade_consumidora=uc, mes_referencia=date(2025, mes, 1), arquivo=nome)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/customers/{customer.id}/faturas/download/'
+
+    def test_zip(self):
+        response = self.client.get(self.url, {'de': '2025-02', 'ate': '2025-03'})
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as pacote:
+            self.assertEqual(pacote.namelist(), ['UC_55/2025-03.pdf', 'ARQUIVOS_AUSENTES.txt'])
+            self.assertEqual(pacote.getinfo('UC_55/2025-03.pdf').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(pacote.read('UC_55/2025-03.pdf'), b'%PDF-1.4 ' + bytes([3]) * 1000)
+            self.assertEqual(pacote.read('ARQUIVOS_AUSENTES.txt'), b'UC_55/2025-02.pdf\n')
+
+        self.assertEqual(self.client.get(self.url, {'ano': 2024}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'de': '02/2025'}).status_code, 400)
+
+
+class BuscaFaturasTest(TestCase):
+    """Busca textual: só faturas dos clientes do usuário, a mais relevante primeiro."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('busca', 'busca@example.com', 'senha')
+        customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        uc = UnidadeConsumidora.objects.create(customer=customer, codigo='10', endereco='A')
+        self.vermelha = Fatura.objects.create(
+            unidade_consumidora=uc, mes_referencia=date(2025, 1, 1),
+            texto='ADC BANDEIRA VERMELHA PATAMAR 1 ADC BANDEIRA VERMELHA UC geradora 13232162'
+        )
+        self.amarela = Fatura.objects.create(
+            unidade_consumidora=uc, mes_referencia=date(2025, 2, 1),
+            texto='ADC BANDEIRA AMARELA consumo faturado bandeira vermelha no mês anterior'
+        )
+        outro = User.objects.create_user('outro', 'outro@example.com', 'senha')
+        alheia = Customer.objects.create(user=outro, nome='Outro', cpf='11111111111', endereco='Rua B')
+        Fatura.objects.create(
+            unidade_consumidora=UnidadeConsumidora.objects.create(customer=alheia, codigo='20', endereco='B'),
+            mes_referencia=date(2025, 1, 1), texto='ADC BANDEIRA VERMELHA'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_busca(self):
+        resultados = self.client.get('/api/faturas/search/', {'q': 'bandeira vermelha'}).json()
+        self.assertEqual([r['id'] for r in resultados], [self.vermelha.id, self.amarela.id])
+        self.assertIn('<b>', resultados[0]['trecho'])
+
+        resultados = self.client.get('/api/faturas/search/', {'q': '"UC geradora" 13232162'}).json()
+        self.assertEqual([r['id'] for r in resultados], [self.vermelha.id])
+
+        self.assertEqual(self.client.get('/api/faturas/search/', {'q': ' '}).status_code, 400)
+
+
+class ExtractionLimiterReservasTest(TestCase):
+    """As reservas das filas nunca ocupam todas as vagas do host."""
+
+    def test_sobra_vaga_compartilhada(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            limiter = ExtractionLimiter(1, 1, 4, 1, lock_dir, reservas={FILA_INTERATIVA: 1})
+            self.assertEqual((limiter.reservas[FILA_INTERATIVA], limiter.compartilhadas), (0, 1))
+            with limiter.slot(FILA_BACKFILL, timeout=1):
+                pass
+
+            limiter = ExtractionLimiter(1, 3, 4, 1, lock_dir, reservas={FILA_INTERATIVA: 1, FILA_BACKFILL: 2})
+            self.assertEqual((limiter.reservas[FILA_INTERATIVA], limiter.reservas[FILA_BACKFILL]), (1, 1))
+            self.assertEqual(limiter.compartilhadas, 1)
+
+
+class ExtractionLimiterFilasTest(TestCase):
+    """Prioridade entre as filas de extração: ceder a vez, envelhecimento e limite da interativa."""
+
+    def setUp(self):
+        self.lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.lock_dir.cleanup)
+
+    def _aguardando(self, limiter, fila):
+        """Simula outro processo esperando vaga em ``fila`` (segura o LOCK_SH de espera)."""
+        fd = os.open(limiter._espera_path(fila), os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        self.addCleanup(os.close, fd)
+
+    def test_cede_a_vez_para_fila_prioritaria(self):
+        limiter = ExtractionLimiter(4, 1, 4, 1, self.lock_dir.name, espera_max_prioridade=60)
+        self._aguardando(limiter, FILA_INTERATIVA)
+
+        # A vaga compartilhada está livre, mas a interativa espera por ela
+        for fila in (FILA_LOTE, FILA_BACKFILL):
+            with self.assertRaises(CapacidadeEsgotada) as erro:
+                with limiter.slot(fila, timeout=0.3):
+                    pass
+            self.assertEqual((erro.exception.fila, erro.exception.aguardando), (fila, 0))
+        with limiter.slot(FILA_INTERATIVA, timeout=0.3):
+            self.assertEqual(limiter.host_slots_in_use(), 1)
+
+    def test_fila_envelhecida_nao_cede_mais(self):
+        limiter = ExtractionLimiter(4, 1, 4, 1, self.lock_dir.name, espera_max_prioridade=0.2)
+        self._aguardando(limiter, FILA_INTERATIVA)
+
+        with limiter.slot(FILA_BACKFILL, timeout=2):
+            pass
+        self.assertGreaterEqual(limiter.filas[FILA_BACKFILL].espera_max, 0.2)
+
+    def test_interativa_limitada_sem_vagas_do_host(self):
+        limiter = ExtractionLimiter(4, 0, 4, 1, self.lock_dir.name, reservas={FILA_INTERATIVA: 1})
+        with limiter.slot(FILA_INTERATIVA, timeout=0.1):
+            with self.assertRaises(CapacidadeEsgotada):
+                with limiter.slot(FILA_INTERATIVA, timeout=0.1):
+                    pass
+            # Os lotes continuam com o semáforo do processo
+            with limiter.slot(FILA_LOTE, timeout=0.1):
+                pass
+        with limiter.slot(FILA_INTERATIVA, timeout=0.1):
+            pass
+
+
+class PrioridadeTarefasTest(TestCase):
+    """``claim_next`` atende as filas por prioridade, mas jobs envelhecidos passam na frente."""
+
+    def setUp(self):
+        self.uc = _criar_uc('prioridade')
+
+    def _task(self, mes, fila, liberada_ha):
+        return FaturaTask.objects.create(
+            unidade_consumidora=self.uc, mes_referencia=date(2025, mes, 1), tipo='IMPORTACAO', fila=fila,
+            next_run_at=timezone.now() - timedelta(seconds=liberada_ha)
+        )
+
+    @override_settings(TASK_LANE_MAX_WAIT=300)
+    def test_ordem_das_filas(self):
+        backfill = self._task(1, FILA_BACKFILL, 120)
+        lote = self._task(2, FILA_LOTE, 60)
+        interativa = self._task(3, FILA_INTERATIVA, 1)
+        interativa_antiga = self._task(4, FILA_INTERATIVA, 30)
+
+        ordem = [claim_next('w1').pk for _ in range(4)]
+        self.assertEqual(ordem, [interativa_antiga.pk, interativa.pk, lote.pk, backfill.pk])
+
+    @override_settings(TASK_LANE_MAX_WAIT=300)
+    def test_job_envelhecido_passa_na_frente(self):
+        interativa = self._task(1, FILA_INTERATIVA, 1)
+        backfill = self._task(2, FILA_BACKFILL, 301)
+
+        self.assertEqual(claim_next('w1').pk, backfill.pk)
+        self.assertEqual(claim_next('w1').pk, interativa.pk)
+
+    def test_worker_dedicado(self):
+        self._task(1, FILA_INTERATIVA, 1)
+        lote = self._task(2, FILA_LOTE, 1)
+        self.assertEqual(claim_next('w1', filas=[FILA_LOTE, FILA_BACKFILL]).pk, lote.pk)
+        self.assertIsNone(claim_next('w1', filas=[FILA_BACKFILL]))
+
+
+class ArquivoCompactadoLimiteTest(TestCase):
+    """Limite de membros: ZIP recusado antes do primeiro membro, tar devolve o resultado parcial."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('pacote', 'pacote@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/customers/{self.customer.id}/faturas/upload-archive/'
+
+    def _zip(self, nomes):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as pacote:
+            for nome in nomes:
+                pacote.writestr(nome, 'x')
+        buffer.seek(0)
+        return buffer
+
+    def _tar(self, nomes):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as pacote:
+            for nome in nomes:
+                info = tarfile.TarInfo(nome)
+                info.size = 1
+                pacote.addfile(info, io.BytesIO(b'x'))
+        buffer.seek(0)
+        return buffer
+
+    @mock.patch('api.archives.ARCHIVE_MAX_MEMBERS', 2)
+    def test_zip_recusado_antes_do_primeiro_membro(self):
+        membros = iter_archive_members(self._zip(['a.txt', 'b.txt', 'c.txt', '__MACOSX/d.txt']))
+        with self.assertRaises(ArquivoCompactadoInvalido):
+            next(membros)
+
+        # Membros ignorados não contam para o limite
+        membros = list(iter_archive_members(self._zip(['a.txt', 'b.txt', '__MACOSX/c.txt'])))
+        self.assertEqual([nome for nome, _ in membros], ['a.txt', 'b.txt'])
+
+    @mock.patch('api.archives.ARCHIVE_MAX_MEMBERS', 2)
+    def test_tar_alem_do_limite_devolve_parcial(self):
+        arquivo = self._tar(['a.txt', 'b.txt', 'c.txt'])
+        arquivo.name = 'faturas.tar.gz'
+        response = self.client.post(self.url, {'arquivo': arquivo}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        erros = response.json()['faturas_com_erro']
+        self.assertEqual([erro['arquivo'] for erro in erros], ['a.txt', 'b.txt', 'faturas.tar.gz'])
+        self.assertIn('c.txt', erros[-1]['erro'])
+
+    def test_arquivo_invalido_sem_membros_continua_400(self):
+        arquivo = io.BytesIO(b'nao e um pacote')
+        arquivo.name = 'faturas.zip'
+        response = self.client.post(self.url, {'arquivo': arquivo}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class UploadRetomavelTest(TestCase):
+    """Upload em blocos (tus): o offset salvo sobrevive a PATCHes interrompidos."""
+
+    def setUp(self):
+        self.staging = tempfile.TemporaryDirectory()
+        configuracao = override_settings(UPLOAD_STAGING_DIR=self.staging.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.addCleanup(self.staging.cleanup)
+
+        self.user = User.objects.create_user('tus', 'tus@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _criar(self, tamanho, nome='fatura.pdf'):
+        response = self.client.post(
+            f'/api/customers/{self.customer.id}/faturas/uploads/',
+            HTTP_UPLOAD_LENGTH=str(tamanho),
+            HTTP_UPLOAD_METADATA='filename ' + base64.b64encode(nome.encode()).decode(),
+        )
+        self.assertEqual(response.status_code, 201)
+        return f"/api/faturas/uploads/{response.json()['id']}/"
+
+    def _patch(self, url, corpo, offset):
+        return self.client.generic(
+            'PATCH', url, corpo, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def _sha256_final(self, url):
+        return FaturaUpload.objects.get(pk=url.rstrip('/').rsplit('/', 1)[1]).sha256
+
+    def test_estado_do_hash_limitado(self):
+        with mock.patch('api.uploads.HASHERS_MAX', 2):
+            urls = [self._criar(10, f'{indice}.pdf') for indice in range(3)]
+            for url in urls:
+                self._patch(url, b'x' * 5, 0)
+            self.assertEqual(len(uploads._hashers), 2)
+
+            # O estado descartado (ou de outro worker) é refeito a partir do staging
+            self.assertEqual(self._patch(urls[0], b'y' * 5, 5).status_code, 201)
+        self.assertEqual(self._sha256_final(urls[0]), hashlib.sha256(b'x' * 5 + b'y' * 5).hexdigest())
+
+    def test_estado_do_hash_expira(self):
+        url = self._criar(10)
+        self._patch(url, b'x' * 5, 0)
+        with mock.patch('api.uploads.HASHERS_MAX_IDADE', 0):
+            outro = self._criar(10, 'outro.pdf')
+            self._patch(outro, b'z' * 5, 0)
+            self.assertEqual(list(uploads._hashers), [FaturaUpload.objects.get(nome_arquivo='outro.pdf').id])
+            self._patch(url, b'y' * 5, 5)
+        self.assertEqual(self._sha256_final(url), hashlib.sha256(b'x' * 5 + b'y' * 5).hexdigest())
+
+    def test_corpo_excedente_mantem_offset_gravado(self):
+        url = self._criar(CHUNK_SIZE + 10)
+        response = self._patch(url, b'x' * (2 * CHUNK_SIZE), 0)
+        self.assertEqual(response.status_code, 413)
+
+        # O primeiro bloco foi gravado e o offset dele confirmado
+        self.assertEqual(self.client.head(url)['Upload-Offset'], str(CHUNK_SIZE))
+        response = self._patch(url, b'x' * 10, CHUNK_SIZE)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Upload-Offset'], str(CHUNK_SIZE + 10))
+        self.assertEqual(len(response.json()['faturas_com_erro']), 1)  # não é um PDF
+
+    def test_429_no_ultimo_bloco_e_patch_vazio(self):
+        url = self._criar(10)
+        limitador = mock.Mock()
+        limitador.check_admission.side_effect = [CapacidadeEsgotada(FILA_LOTE, 5, 3), None]
+        with mock.patch('api.views.get_limiter', return_value=limitador):
+            response = self._patch(url, b'x' * 10, 0)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '3')
+            self.assertEqual(
+                {chave: response.json()[chave] for chave in ('fila', 'aguardando', 'retry_after')},
+                {'fila': FILA_LOTE, 'aguardando': 5, 'retry_after': 3}
+            )
+            self.assertEqual(response['Upload-Offset'], '10')
+            self.assertEqual(self.client.head(url)['Upload-Offset'], '10')
+
+            # Após o Retry-After o cliente repete o PATCH com corpo vazio no offset final
+            response = self._patch(url, b'', 10)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['faturas_com_erro']), 1)  # não é um PDF
+        self.assertEqual(self.client.head(url).status_code, 404)  # concluído
+
+
+class CapacidadeEsgotadaLoteTest(TestCase):
+    """Falta de vaga durante a extração de um lote vira erro com Retry-After, não erro de extração."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('lote', 'lote@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch('api.extraction.run_extraction', side_effect=CapacidadeEsgotada(FILA_LOTE, 3, 7))
+    def test_arquivo_recusado_com_retry_after(self, _):
+        caminho = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'media', 'faturas', '2025', '02', 'None.pdf')
+        with open(caminho, 'rb') as pdf:
+            response = self.client.post(
+                f'/api/customers/{self.customer.id}/faturas/upload-with-extraction/',
+                {'faturas': [pdf]}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Retry-After'], '7')
+        erro, = response.json()['faturas_com_erro']
+        self.assertEqual(erro['retry_after'], 7)
+        self.assertFalse(Fatura.objects.exists())
+
+
+class WatchFaturaFolderTest(TestCase):
+    """Monitor de pasta: só processa arquivos estáveis e só grava o motivo junto do PDF movido."""
+
+    def setUp(self):
+        self.pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(self.pasta.cleanup)
+        self.comando = WatchFaturaFolder(stdout=io.StringIO())
+        self.comando.pasta = self.pasta.name
+        self.comando.pasta_falhas = os.path.join(self.pasta.name, 'falhas')
+        self.comando.pasta_processados = os.path.join(self.pasta.name, 'processados')
+        os.makedirs(self.comando.pasta_falhas)
+        os.makedirs(self.comando.pasta_processados)
+        self.comando.vistos = {}
+        self.comando.estabilidade = 5
+        self.comando.lote = 50
+        self.comando.workers = 1
+        self.comando.customer = mock.Mock()
+
+    def _pdf(self, nome, conteudo=b'%PDF-1.4'):
+        caminho = os.path.join(self.pasta.name, nome)
+        with open(caminho, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        # mtime antigo, como numa cópia que preserva a data original
+        os.utime(caminho, (0, 0))
+        return caminho
+
+    def test_exige_duas_observacoes_iguais(self):
+        caminho = self._pdf('a.pdf')
+        self.assertEqual(self.comando._arquivos_prontos(), [])
+        self.assertEqual(self.comando._arquivos_prontos(), [caminho])
+
+        with open(caminho, 'ab') as arquivo:
+            arquivo.write(b'mais')
+        os.utime(caminho, (0, 0))
+        self.assertEqual(self.comando._arquivos_prontos(), [])
+        self.assertEqual(self.comando._arquivos_prontos(), [caminho])
+
+    def test_motivo_so_apos_mover(self):
+        caminho = self._pdf('b.pdf')
+        erro = [(ERRO, {'arquivo': 'b.pdf', 'erro': 'PDF inválido'})]
+        modulo = 'api.management.commands.watch_fatura_folder'
+        with mock.patch(f'{modulo}.process_batch', return_value=erro), \
+                mock.patch(f'{modulo}.shutil.move', side_effect=OSError('arquivo em uso')):
+            self.comando._processar([caminho])
+        self.assertTrue(os.path.exists(caminho))
+        self.assertEqual(os.listdir(self.comando.pasta_falhas), [])
+
+        with mock.patch(f'{modulo}.process_batch', return_value=erro):
+            self.comando._processar([caminho])
+        self.assertEqual(sorted(os.listdir(self.comando.pasta_falhas)), ['b.pdf', 'b.pdf.motivo.txt'])
+
+
+def _criar_uc(username):
+    user = User.objects.create_user(username, f'{username}@example.com', 'senha')
+    customer = Customer.objects.create(user=user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+    return UnidadeConsumidora.objects.create(customer=customer, codigo='1', endereco='A')
+
+
+class ConcessaoTarefasTest(TestCase):
+    """Concessões dos jobs: reassumir quando o worker morre e renovar por heartbeat."""
+
+    def setUp(self):
+        self.uc = _criar_uc('concessao')
+
+    def _task(self, mes, **campos):
+        return FaturaTask.objects.create(
+            unidade_consumidora=self.uc, mes_referencia=date(2025, mes, 1), tipo='IMPORTACAO', **campos
+        )
+
+    def test_reassume_concessao_vencida(self):
+        agora = timezone.now()
+        task = self._task(1, status='IN_PROGRESS', worker='morto', attempts=1,
+                          lease_expires_at=agora - timedelta(seconds=1))
+        self._task(2, status='IN_PROGRESS', worker='vivo', attempts=1,
+                   lease_expires_at=agora + timedelta(minutes=5))
+
+        reassumida = claim_next('novo')
+        self.assertEqual(reassumida.pk, task.pk)
+        self.assertEqual((reassumida.worker, reassumida.attempts), ('novo', 2))
+        self.assertGreater(reassumida.lease_expires_at, agora)
+        self.assertIsNone(claim_next('novo'))
+
+        # O worker antigo não consegue mais concluir nem renovar
+        self.assertFalse(finish(task, 'morto', True))
+        self.assertFalse(heartbeat(task, 'morto'))
+        self.assertTrue(finish(reassumida, 'novo', True))
+        self.assertEqual(FaturaTask.objects.get(pk=task.pk).status, 'SUCCESS')
+
+    @override_settings(TASK_MAX_ATTEMPTS=3)
+    def test_concessao_vencida_sem_tentativas_falha(self):
+        task = self._task(1, status='IN_PROGRESS', worker='morto', attempts=3,
+                          lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(claim_next('novo'))
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'FAILURE')
+        self.assertIn('3 tentativa(s)', task.error_message)
+
+    def test_heartbeat_renova_concessao(self):
+        self._task(1)
+        task = claim_next('w1')
+        FaturaTask.objects.filter(pk=task.pk).update(lease_expires_at=timezone.now())
+
+        self.assertTrue(heartbeat(task, 'w1'))
+        task.refresh_from_db()
+        self.assertGreater(task.lease_expires_at, timezone.now() + timedelta(seconds=60))
+        self.assertFalse(heartbeat(task, 'w2'))
+
+
+class ClaimConcorrenteTest(TransactionTestCase):
+    """``SKIP LOCKED`` e o heartbeat em thread precisam de transações reais, em conexões separadas."""
+
+    def setUp(self):
+        self.uc = _criar_uc('concorrente')
+        self.tasks = [
+            FaturaTask.objects.create(
+                unidade_consumidora=self.uc, mes_referencia=date(2025, mes, 1), tipo='IMPORTACAO',
+                next_run_at=timezone.now() - timedelta(seconds=10 - mes)
+            )
+            for mes in (1, 2)
+        ]
+
+    def test_pula_job_travado(self):
+        travado = threading.Event()
+        liberar = threading.Event()
+
+        def outro_worker():
+            try:
+                with transaction.atomic():
+                    FaturaTask.objects.select_for_update().get(pk=self.tasks[0].pk)
+                    travado.set()
+                    liberar.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=outro_worker)
+        thread.start()
+        try:
+            self.assertTrue(travado.wait(10))
+            # O primeiro da fila está travado por outra transação: pula sem esperar
+            self.assertEqual(claim_next('w1').pk, self.tasks[1].pk)
+            self.assertIsNone(claim_next('w2'))
+        finally:
+            liberar.set()
+            thread.join()
+        self.assertEqual(claim_next('w2').pk, self.tasks[0].pk)
+
+    @override_settings(TASK_HEARTBEAT_SECONDS=0.05)
+    def test_thread_de_heartbeat(self):
+        task = claim_next('w1')
+        FaturaTask.objects.filter(pk=task.pk).update(lease_expires_at=timezone.now())
+        with Heartbeat(task, 'w1'):
+            threading.Event().wait(0.3)
+        task.refresh_from_db()
+        self.assertGreater(task.lease_expires_at, timezone.now() + timedelta(seconds=60))
+
+
+class LayoutWorkersTest(TestCase):
+    """Divisão dos processos de ``run_fatura_worker`` entre as filas."""
+
+    @override_settings(TASK_WORKER_POOLS={'interativa': 1, 'interativa,lote,backfill': 2, 'backfill': 0})
+    def test_pools_do_settings(self):
+        self.assertEqual(layout_workers(), [
+            ['interativa'],
+            ['interativa', 'lote', 'backfill'],
+            ['interativa', 'lote', 'backfill'],
+        ])
+
+    def test_opcoes_da_linha_de_comando(self):
+        self.assertEqual(layout_workers(processos=2, filas=' lote, backfill '), [['lote', 'backfill']] * 2)
+        self.assertEqual(layout_workers(filas='interativa'), [['interativa']])
+        self.assertEqual(layout_workers(processos=3), [['interativa', 'lote', 'backfill']] * 3)
+        with self.assertRaises(CommandError):
+            layout_workers(filas='lote,urgente')
+
+
+@override_settings(TASK_MAX_ATTEMPTS=3, TASK_RETRY_BASE_SECONDS=30, TASK_RETRY_MAX_SECONDS=3600)
+class RetentativasTest(TestCase):
+    """Falhas transitórias voltam com backoff até ``TASK_MAX_ATTEMPTS``; ``ErroPermanente`` não volta."""
+
+    def setUp(self):
+        self.uc = _criar_uc('retentativa')
+        self.task = FaturaTask.objects.create(
+            unidade_consumidora=self.uc, mes_referencia=date(2025, 1, 1), tipo='IMPORTACAO'
+        )
+        self.worker = Worker(worker_id='w1')
+
+    def _executar(self, erro):
+        # Libera a retentativa agendada e executa o job com um handler que falha
+        FaturaTask.objects.filter(pk=self.task.pk).update(next_run_at=timezone.now())
+        task = claim_next('w1')
+        self.assertEqual(task.pk, self.task.pk)
+        with mock.patch.dict('api.jobs.HANDLERS', {'IMPORTACAO': mock.Mock(side_effect=erro)}), \
+                self.assertLogs('api.jobs', level='ERROR'):
+            self.worker.execute(task)
+        self.task.refresh_from_db()
+        return task
+
+    def test_retentativa_com_backoff_ate_o_limite(self):
+        for tentativa, teto in ((1, 30), (2, 60)):
+            inicio = timezone.now()
+            self._executar(RuntimeError('OCR travou'))
+            self.assertEqual((self.task.status, self.task.attempts, self.task.worker), ('PENDING', tentativa, ''))
+            self.assertEqual(self.task.error_message, 'OCR travou')
+            espera = (self.task.next_run_at - inicio).total_seconds()
+            self.assertTrue(teto / 2 <= espera <= teto + 1, espera)
+            self.assertIsNone(claim_next('w1'))  # agendada para o futuro
+
+        self._executar(RuntimeError('OCR travou'))
+        self.assertEqual((self.task.status, self.task.attempts), ('FAILURE', 3))
+        self.assertIsNone(self.task.lease_expires_at)
+        self.assertEqual(self.task.logs.filter(level='WARNING').count(), 2)
+
+    def test_erro_permanente_nao_retenta(self):
+        self._executar(ErroPermanente('Arquivo ausente'))
+        self.assertEqual((self.task.status, self.task.attempts), ('FAILURE', 1))
+        self.assertEqual(self.task.error_message, 'Arquivo ausente')
+        self.assertEqual(self.task.logs.get().level, 'ERROR')
+
+
+class LatenciaTarefasTest(TestCase):
+    """Percentis de espera/execução agregados no banco, pela última tentativa de cada job."""
+
+    def test_percentis_por_cliente_e_tipo(self):
+        uc = _criar_uc('latencia')
+        base = timezone.now() - timedelta(hours=1)
+        for indice, (espera, execucao, status, tentativas) in enumerate([
+            (1, 10, 'SUCCESS', 1), (2, 20, 'SUCCESS', 1), (3, 30, 'FAILURE', 3), (-1, 40, 'SUCCESS', 1),
+        ]):
+            FaturaTask.objects.create(
+                unidade_consumidora=uc, mes_referencia=date(2025, indice + 1, 1), tipo='REEXTRACAO',
+                status=status, attempts=tentativas, next_run_at=base,
+                started_at=base + timedelta(seconds=espera),
+                completed_at=base + timedelta(seconds=espera + execucao),
+            )
+        FaturaTask.objects.create(unidade_consumidora=uc, mes_referencia=date(2025, 9, 1), tipo='REEXTRACAO')
+
+        grupo, = latency_metrics(FaturaTask.objects.all())
+        self.assertEqual((grupo['tipo'], grupo['total'], grupo['falhas']), ('REEXTRACAO', 4, 1))
+        self.assertEqual(grupo['tentativas_media'], 1.5)
+        # Espera negativa (relógios) conta como zero
+        self.assertEqual(grupo['espera_fila_s'], {'p50': 1.0, 'p90': 3.0, 'p99': 3.0})
+        self.assertEqual(grupo['execucao_s'], {'p50': 20.0, 'p90': 40.0, 'p99': 40.0})
+
+
+class EnfileiramentoTest(TestCase):
+    """``enqueue`` devolve ``(task, criada)`` e reaproveita o job ativo da mesma UC/mês/tipo."""
+
+    def setUp(self):
+        self.uc = _criar_uc('enqueue')
+        self.mes = date(2025, 3, 15)
+
+    def test_reaproveita_job_ativo(self):
+        task, criada = enqueue(self.uc, self.mes, 'IMPORTACAO')
+        self.assertTrue(criada)
+        self.assertEqual((task.mes_referencia, task.status, task.fila), (date(2025, 3, 1), 'PENDING', FILA_LOTE))
+
+        self.assertEqual(enqueue(self.uc, date(2025, 3, 1), 'IMPORTACAO'), (task, False))
+        self.assertTrue(enqueue(self.uc, self.mes, 'REEXTRACAO')[1])
+
+        # Em andamento ainda é ativo; concluído libera um novo job
+        claim_next('w1')
+        self.assertEqual(enqueue(self.uc, self.mes, 'IMPORTACAO'), (task, False))
+        FaturaTask.objects.filter(pk=task.pk).update(status='SUCCESS')
+        nova, criada = enqueue(self.uc, self.mes, 'IMPORTACAO')
+        self.assertTrue(criada)
+        self.assertNotEqual(nova.pk, task.pk)
+
+    def test_importacao_exige_backend(self):
+        client = APIClient()
+        client.force_authenticate(self.uc.customer.user)
+        url = f'/api/customers/{self.uc.customer.id}/faturas/import/'
+
+        with override_settings(FATURA_IMPORT_BACKEND=None):
+            response = client.post(url, {'mes_referencia': '03/2025'}, format='json')
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('FATURA_IMPORT_BACKEND', response.data['error'])
+        self.assertFalse(FaturaTask.objects.exists())
+
+        with override_settings(FATURA_IMPORT_BACKEND='exemplo.baixar_fatura'):
+            response = client.post(url, {'mes_referencia': '03/2025'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(FaturaTask.objects.get().tipo, 'IMPORTACAO')
+
+    def test_promove_fila_do_job_pendente(self):
+        task, _ = enqueue(self.uc, self.mes, 'IMPORTACAO', fila=FILA_BACKFILL)
+        promovida, criada = enqueue(self.uc, self.mes, 'IMPORTACAO', fila=FILA_INTERATIVA)
+        self.assertFalse(criada)
+        self.assertEqual(promovida.fila, FILA_INTERATIVA)
+        task.refresh_from_db()
+        self.assertEqual(task.fila, FILA_INTERATIVA)
+
+        # Nunca rebaixa
+        self.assertEqual(enqueue(self.uc, self.mes, 'IMPORTACAO', fila=FILA_LOTE)[0].fila, FILA_INTERATIVA)
+
+        # Job já em andamento não muda de fila
+        em_andamento, _ = enqueue(self.uc, self.mes, 'REEXTRACAO', fila=FILA_BACKFILL)
+        claim_next('w1', filas=[FILA_BACKFILL])
+        self.assertEqual(enqueue(self.uc, self.mes, 'REEXTRACAO', fila=FILA_INTERATIVA)[0].fila, FILA_BACKFILL)
+        em_andamento.refresh_from_db()
+        self.assertEqual(em_andamento.fila, FILA_BACKFILL)
+
+    def test_promocao_muda_o_etag_das_tarefas(self):
+        user = self.uc.customer.user
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/api/customers/{self.uc.customer_id}/faturas/tasks/'
+        enqueue(self.uc, self.mes, 'IMPORTACAO')
+        etag = client.get(url)['ETag']
+
+        enqueue(self.uc, self.mes, 'IMPORTACAO', fila=FILA_INTERATIVA)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['fila'], FILA_INTERATIVA)
+
+    def test_job_concluido_entre_insert_e_consulta(self):
+        criar = FaturaTask.objects.create
+        corrida = mock.Mock(side_effect=[IntegrityError('faturatask_ativa_unica'), criar])
+
+        def create(**campos):
+            efeito = corrida()
+            return efeito(**campos)
+
+        with mock.patch.object(FaturaTask.objects, 'create', side_effect=create):
+            task, criada = enqueue(self.uc, self.mes, 'IMPORTACAO')
+        self.assertTrue(criada)
+        self.assertEqual(corrida.call_count, 2)
+
+        with mock.patch.object(FaturaTask.objects, 'create', side_effect=IntegrityError('faturatask_ativa_unica')):
+            with self.assertRaises(RuntimeError):
+                enqueue(self.uc, self.mes, 'REEXTRACAO')
+
+    def test_migracao_encerra_duplicadas(self):
+        restricao, = [c for c in FaturaTask._meta.constraints if c.name == 'faturatask_ativa_unica']
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(FaturaTask, restricao)
+
+        campos = dict(unidade_consumidora=self.uc, mes_referencia=date(2025, 3, 1), tipo='IMPORTACAO')
+        mais_antiga = FaturaTask.objects.create(status='IN_PROGRESS', **campos)
+        duplicadas = [FaturaTask.objects.create(status='PENDING', **campos) for _ in range(2)]
+        concluida = FaturaTask.objects.create(status='SUCCESS', **campos)
+        outra = FaturaTask.objects.create(status='PENDING', **dict(campos, tipo='REEXTRACAO'))
+
+        migracao = import_module('api.migrations.0011_faturatask_ativa_unica')
+        migracao.encerrar_duplicadas(apps, None)
+
+        status = dict(FaturaTask.objects.values_list('pk', 'status'))
+        self.assertEqual(status[mais_antiga.pk], 'IN_PROGRESS')
+        self.assertEqual([status[task.pk] for task in duplicadas], ['FAILURE', 'FAILURE'])
+        self.assertEqual((status[concluida.pk], status[outra.pk]), ('SUCCESS', 'PENDING'))
+        self.assertEqual(
+            FaturaTask.objects.filter(error_message__contains='duplicada').count(), 2
+        )
+
+        # Sem duplicadas ativas, a restrição volta a ser criada (checa as FKs adiadas antes do DDL)
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        with connection.schema_editor() as editor:
+            editor.add_constraint(FaturaTask, restricao)
+
+
+class FaturaSaveConsultasTest(TestCase):
+    """Gravar uma fatura (resumo mensal e invalidação do cache incluídos) custa poucas consultas."""
+
+    def setUp(self):
+        self.uc = _criar_uc('gravacao')
+
+    def test_consultas_por_gravacao(self):
+        # Savepoint, INSERT da fatura, INSERT do resumo, liberação do savepoint
+        with self.assertNumQueries(4):
+            fatura = Fatura.objects.create(unidade_consumidora=self.uc, mes_referencia=date(2025, 1, 1), valor='1.00')
+
+        fatura = Fatura.objects.get(pk=fatura.pk)
+        fatura.valor = '2.00'
+        # + cliente anterior (a UC não mudou, então é também o atual); UPDATE no resumo
+        with self.assertNumQueries(5):
+            fatura.save()
+        self.assertEqual(str(FaturaResumoMensal.objects.get(fatura=fatura).valor), '2.00')
+
+    def test_troca_de_uc_invalida_os_dois_clientes(self):
+        fatura = Fatura.objects.create(unidade_consumidora=self.uc, mes_referencia=date(2025, 1, 1))
+        cliente = Customer.objects.create(user=self.uc.customer.user, nome='Outro', cpf='11111111111', endereco='B')
+        outra = UnidadeConsumidora.objects.create(customer=cliente, codigo='2', endereco='B')
+        fatura = Fatura.objects.get(pk=fatura.pk)
+        fatura.unidade_consumidora_id = outra.pk
+        with mock.patch('api.signals.invalidate_customer') as invalidar:
+            fatura.save()
+        invalidar.assert_called_once_with(outra.customer_id, self.uc.customer_id)
+        self.assertEqual(FaturaResumoMensal.objects.get(fatura=fatura).customer_id, outra.customer_id)
+
+
+class FaturaTextoAdiadoTest(TestCase):
+    """O texto bruto e o tsvector só saem do banco quando pedidos."""
+
+    def setUp(self):
+        self.uc = _criar_uc('adiado')
+        self.fatura = Fatura.objects.create(
+            unidade_consumidora=self.uc, mes_referencia=date(2025, 1, 1), arquivo='faturas/2025/01/a.pdf',
+            texto='energia ativa ' * 2000
+        )
+
+    def test_buscas_sem_texto(self):
+        with CaptureQueriesContext(connection) as consultas:
+            fatura = Fatura.objects.get(pk=self.fatura.pk)
+            list(self.uc.faturas.all())
+        self.assertFalse(any('"texto"' in c['sql'] or '"busca"' in c['sql'] for c in consultas.captured_queries))
+        self.assertEqual(fatura.get_deferred_fields(), {'texto', 'busca'})
+
+        # Gravar a instância não apaga o texto que não foi carregado
+        fatura.valor = '2.00'
+        fatura.save()
+        self.assertTrue(Fatura.objects.filter(pk=fatura.pk, busca=SearchQuery('energia', config='portuguese')).exists())
+
+    @mock.patch('api.jobs.run_extraction', return_value={
+        'status': 'success', 'valor_total': '5.00', 'texto': 'bandeira tarifária vermelha'
+    })
+    def test_reextracao_troca_o_texto(self, _):
+        task, _ = enqueue(self.uc, self.fatura.mes_referencia, 'REEXTRACAO', fatura=self.fatura)
+        with CaptureQueriesContext(connection) as consultas:
+            reextrair_fatura(task)
+        self.assertFalse(any('"busca"' in c['sql'] for c in consultas.captured_queries))
+
+        self.assertEqual(Fatura.objects.values_list('texto', flat=True).get(), 'bandeira tarifária vermelha')
+        self.assertTrue(Fatura.objects.filter(busca=SearchQuery('vermelha', config='portuguese')).exists())
+
+
+def _pdf(paginas=1, trailer=b'', marca=b''):
+    """PDF mínimo e estruturalmente válido; ``marca`` muda o conteúdo (e o SHA-256)."""
+    objetos = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % (3 + i) for i in range(paginas)), paginas
+        ),
+    ] + [b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>'] * paginas
+    conteudo = b'%PDF-1.4\n%' + marca + b'\n'
+    offsets = []
+    for numero, objeto in enumerate(objetos, 1):
+        offsets.append(len(conteudo))
+        conteudo += b'%d 0 obj\n%s\nendobj\n' % (numero, objeto)
+    xref = len(conteudo)
+    conteudo += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+    conteudo += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    conteudo += b'trailer\n<< /Size %d /Root 1 0 R %s>>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objetos) + 1, trailer, xref
+    )
+    return conteudo
+
+
+@override_settings(PDF_MAX_SIZE=1024 * 1024, PDF_MAX_PAGES=2)
+class ValidacaoPdfTest(TestCase):
+    """Arquivos que não são PDFs utilizáveis são recusados antes de ocupar uma vaga de extração."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('validacao', 'validacao@example.com', 'senha')
+        self.customer = Customer.objects.create(user=self.user, nome='Cliente', cpf='00000000000', endereco='Rua A')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.casos = [
+            ('truncado.pdf', _pdf()[:-40], "marcador %%EOF ausente"),
+            ('sem_startxref.pdf', _pdf().replace(b'startxref', b'startref'), "startxref ausente"),
+            ('criptografado.pdf', _pdf(trailer=b'/Encrypt 9 0 R '), "criptografado"),
+            ('pagina.pdf', b'<!DOCTYPE html><html><body>Sessao expirada</body></html>', "página HTML"),
+            ('longo.pdf', _pdf(paginas=3), "3 páginas (limite de 2)"),
+            ('grande.pdf', _pdf(marca=b'x' * (1024 * 1024)), "limite de 1 MB"),
+        ]
+
+    def test_validate_pdf(self):
+        self.assertEqual(validate_pdf(io.BytesIO(_pdf(paginas=2))), 2)
+        for nome, conteudo, motivo in self.casos:
+            with self.subTest(nome), self.assertRaisesMessage(PdfInvalido, motivo):
+                validate_pdf(io.BytesIO(conteudo))
+
+    @mock.patch('api.extraction.run_extraction')
+    def test_upload_devolve_erro_por_arquivo(self, run_extraction):
+        arquivos = [SimpleUploadedFile(nome, conteudo) for nome, conteudo, _ in self.casos]
+        response = self.client.post(
+            f'/api/customers/{self.customer.id}/faturas/upload-with-extraction/',
+            {'faturas': arquivos}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201)
+        erros = response.json()['faturas_com_erro']
+        self.assertEqual([erro['arquivo'] for erro in erros], [nome for nome, _, _ in self.casos])
+        for erro, (_, _, motivo) in zip(erros, self.casos):
+            self.assertIn(motivo, erro['erro'])
+        run_extraction.assert_not_called()
+        self.assertFalse(Fatura.objects.exists())
+
+
+def _media_temporaria(teste):
+    """Grava os PDFs das faturas criadas pelo teste num MEDIA_ROOT descartável."""
+    media = tempfile.TemporaryDirectory()
+    teste.addCleanup(media.cleanup)
+    configuracao = override_settings(MEDIA_ROOT=media.name)
+    configuracao.enable()
+    teste.addCleanup(configuracao.disable)
+
+
+def _extracao_por_marca(dados_por_marca):
+    """``run_extraction`` falso: devolve os dados associados à ``marca`` do PDF gerado por ``_pdf``."""
+    def run_extraction(pdf_path, fila=FILA_LOTE, continuar=None):
+        with open(pdf_path, 'rb') as pdf:
+            marca = pdf.read().split(b'\n')[1][1:].decode()
+        dados = {'status': 'success', 'mes_referencia': 'JAN/2025', 'valor_total': '10.00', **dados_por_marca[marca]}
+        if continuar is not None and not continuar(dados):
+            return {**dados, 'modo': 'probe'}
+        return dados
+    return run_extraction
+
+
+class RoteamentoCaixaEntradaTest(TestCase):
+    """Caixa de entrada: roteia pela UC, desempata pelo CPF e nunca usa clientes de outro usuário."""
+
+    def setUp(self):
+        _media_temporaria(self)
+        self.user = User.objects.create_user('caixa', 'caixa@example.com', 'senha')
+        self.ana = Customer.objects.create(user=self.user, nome='Ana', cpf='111.111.111-11', endereco='Rua A')
+        self.bruno = Customer.objects.create(
+            user=self.user, nome='Bruno', cpf='22222222222', cpf_titular='33333333333', endereco='Rua B'
+        )
+        UnidadeConsumidora.objects.create(customer=self.ana, codigo='100', endereco='A')
+        UnidadeConsumidora.objects.create(customer=self.bruno, codigo='200', endereco='B')
+        # Mesma UC em dois clientes do usuário (ex.: imóvel alugado)
+        UnidadeConsumidora.objects.create(customer=self.ana, codigo='300', endereco='A')
+        UnidadeConsumidora.objects.create(customer=self.bruno, codigo='300', endereco='B')
+
+        outro = User.objects.create_user('outro', 'outro@example.com', 'senha')
+        self.estranho = Customer.objects.create(user=outro, nome='Estranho', cpf='99999999999', endereco='Rua Z')
+        UnidadeConsumidora.objects.create(customer=self.estranho, codigo='100', endereco='Z')
+        UnidadeConsumidora.objects.create(customer=self.estranho, codigo='900', endereco='Z')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rotear(self):
+        indice = IndiceRoteamento(self.user)
+        casos = [
+            ({'unidade_consumidora': '100'}, self.ana, 'uc', None, []),
+            ({'unidade_consumidora': '100', 'cpf_cnpj': '11111111111'}, self.ana, 'uc_cpf', None, []),
+            ({'unidade_consumidora': '300', 'cpf_cnpj': '333.333.333-33'}, self.bruno, 'uc_cpf', None, []),
+            ({'unidade_consumidora': '300'}, None, None, 'uc_ambigua', sorted([self.ana.id, self.bruno.id])),
+            ({'unidade_consumidora': '555', 'cpf_cnpj': '222.222.222-22'}, None, None, 'uc_nao_cadastrada',
+             [self.bruno.id]),
+            ({'unidade_consumidora': '900', 'cpf_cnpj': '99999999999'}, None, None, 'sem_cliente', []),
+        ]
+        for dados, customer, criterio, motivo, sugeridos in casos:
+            with self.subTest(dados):
+                rota = indice.rotear(dados)
+                self.assertEqual((rota.customer, rota.criterio, rota.motivo, rota.sugeridos),
+                                 (customer, criterio, motivo, sugeridos))
+
+    def test_upload_inbox(self):
+        dados = {
+            'ana': {'unidade_consumidora': '100'},
+            'bruno': {'unidade_consumidora': '300', 'cpf_cnpj': '22222222222'},
+            'ambigua': {'unidade_consumidora': '300'},
+            'estranho': {'unidade_consumidora': '900', 'cpf_cnpj': '99999999999'},
+        }
+        arquivos = [SimpleUploadedFile(f'{marca}.pdf', _pdf(marca=marca.encode())) for marca in dados]
+        with mock.patch('api.extraction.run_extraction', side_effect=_extracao_por_marca(dados)):
+            response = self.client.post('/api/faturas/inbox/', {'faturas': arquivos}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        corpo = response.json()
+
+        self.assertEqual(
+            [(e['arquivo'], e['roteada'], e.get('cliente_id'), e.get('motivo')) for e in corpo['roteamento']],
+            [('ana.pdf', True, self.ana.id, None), ('bruno.pdf', True, self.bruno.id, None),
+             ('ambigua.pdf', False, None, 'uc_ambigua'), ('estranho.pdf', False, None, 'sem_cliente')]
+        )
+        self.assertEqual(corpo['total_nao_roteadas'], 2)
+        self.assertEqual(
+            sorted((c['cliente_id'], c['processadas']) for c in corpo['por_cliente']),
+            sorted([(self.ana.id, 1), (self.bruno.id, 1)])
+        )
+        self.assertEqual(
+            [a['tipo'] for a in corpo['avisos']], ['nao_roteada', 'nao_roteada']
+        )
+        self.assertEqual(
+            dict(Fatura.objects.values_list('unidade_consumidora__customer', 'unidade_consumidora__codigo')),
+            {self.ana.id: '100', self.bruno.id: '300'}
+        )
+        self.assertFalse(Fatura.objects.filter(unidade_consumidora__customer=self.estranho).exists())
+
+
+def _email(marca, remetente='faturas@distribuidora.com.br'):
+    mensagem = EmailMessage()
+    mensagem['From'] = remetente
+    mensagem['Subject'] = f'Fatura {marca}'
+    mensagem['Message-ID'] = f'<{marca}@distribuidora.com.br>'
+    mensagem.set_content('Segue a fatura em anexo.')
+    mensagem.add_attachment(_pdf(marca=marca.encode()), maintype='application', subtype='pdf',
+                            filename=f'{marca}.pdf')
+    return mensagem.as_bytes()
+
+
+class ImportacaoEmailsTest(TestCase):
+    """Importação de mbox/maildir: retoma de onde parou e nunca perde o lote sem vaga de extração."""
+
+    DADOS = {marca: {'unidade_consumidora': '1', 'mes_referencia': f'{marca}/2025'}
+             for marca in ('JAN', 'FEV', 'MAR', 'ABR')}
+
+    def setUp(self):
+        _media_temporaria(self)
+        self.pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(self.pasta.cleanup)
+        self.uc = _criar_uc('emails')
+        extracao = mock.patch('api.extraction.run_extraction', side_effect=_extracao_por_marca(self.DADOS))
+        self.run_extraction = extracao.start()
+        self.addCleanup(extracao.stop)
+        # Fecharia a conexão da transação do teste
+        conexoes = mock.patch('api.management.commands.import_fatura_emails.close_old_connections')
+        conexoes.start()
+        self.addCleanup(conexoes.stop)
+
+    def _importar(self, origem, **opcoes):
+        saida = io.StringIO()
+        call_command('import_fatura_emails', origem, usuario=self.uc.customer.user.username,
+                     cliente=self.uc.customer.id, stdout=saida, **opcoes)
+        return saida.getvalue()
+
+    def _mbox(self, *marcas):
+        caminho = os.path.join(self.pasta.name, 'faturas.mbox')
+        with open(caminho, 'ab') as mbox:
+            for marca in marcas:
+                mbox.write(b'From faturas@distribuidora.com.br Mon Jan  6 10:00:00 2025\n' + _email(marca) + b'\n')
+        return caminho
+
+    def _maildir(self, subpasta, nome, marca):
+        pasta = os.path.join(self.pasta.name, 'maildir', subpasta)
+        os.makedirs(pasta, exist_ok=True)
+        with open(os.path.join(pasta, nome), 'wb') as arquivo:
+            arquivo.write(_email(marca))
+        return os.path.dirname(pasta)
+
+    def test_mbox_retoma_do_offset(self):
+        origem = self._mbox('JAN', 'FEV')
+        self.assertIn('2 mensagem(ns) lida(s): 2 fatura(s) criada(s)', self._importar(origem))
+        self.assertEqual(FaturaEmailImport.objects.get().posicao, str(os.path.getsize(origem)))
+
+        self.run_extraction.reset_mock()
+        self.assertIn('0 mensagem(ns) lida(s)', self._importar(origem))
+        self.run_extraction.assert_not_called()
+
+        self._mbox('MAR')
+        self.assertIn('1 mensagem(ns) lida(s): 1 fatura(s) criada(s)', self._importar(origem))
+
+        # Do início: relê tudo, mas os anexos já importados são duplicatas
+        self.assertIn('3 mensagem(ns) lida(s): 0 fatura(s) criada(s), 3 aviso(s)',
+                      self._importar(origem, do_inicio=True))
+        self.assertEqual(Fatura.objects.count(), 3)
+        self.assertEqual(set(Fatura.objects.values_list('email_message_id', flat=True)),
+                         {'<JAN@distribuidora.com.br>', '<FEV@distribuidora.com.br>', '<MAR@distribuidora.com.br>'})
+
+    @mock.patch('api.mailboxes.MARGEM_CTIME', 0)
+    def test_maildir_filtra_pela_chave(self):
+        self._maildir('new', '1700000200.M2P1.host', 'FEV')
+        self._maildir('cur', '1700000100.M1P1.host:2,S', 'JAN')
+        origem = self._maildir('new', '1700000300.M3P1.host', 'MAR')
+        self.assertIn('3 mensagem(ns) lida(s): 3 fatura(s) criada(s)', self._importar(origem))
+        self.assertEqual(FaturaEmailImport.objects.get().posicao, '1700000300.M3P1.host')
+        self.assertIn('0 mensagem(ns) lida(s)', self._importar(origem))
+
+        # Movida de outra pasta: chave anterior à salva, mas chegou depois da última leitura.
+        # A que foi lida no cliente de e-mail (new -> cur, com flag) volta, mas como duplicata.
+        time.sleep(0.05)  # ctime posterior ao início da importação anterior
+        self._maildir('cur', '1600000000.M0P1.host:2,S', 'ABR')
+        os.rename(os.path.join(origem, 'new', '1700000300.M3P1.host'),
+                  os.path.join(origem, 'cur', '1700000300.M3P1.host:2,S'))
+        self.assertIn('2 mensagem(ns) lida(s): 1 fatura(s) criada(s), 1 aviso(s)', self._importar(origem))
+        self.assertEqual(FaturaEmailImport.objects.get().posicao, '1700000300.M3P1.host')
+        self.assertIn('0 mensagem(ns) lida(s)', self._importar(origem))
+
+        self.assertIn('4 mensagem(ns) lida(s): 0 fatura(s) criada(s)', self._importar(origem, do_inicio=True))
+        self.assertEqual(Fatura.objects.count(), 4)
+
+    def test_sem_vaga_mantem_o_checkpoint(self):
+        origem = self._mbox('JAN', 'FEV')
+        with mock.patch('api.extraction.run_extraction', side_effect=CapacidadeEsgotada(FILA_LOTE, 3, 7)), \
+                self.assertLogs('api.extraction', level='WARNING'):
+            with self.assertRaisesMessage(CommandError, 'sem vaga de extração'):
+                self._importar(origem)
+        checkpoint = FaturaEmailImport.objects.get()
+        self.assertEqual((checkpoint.posicao, checkpoint.mensagens), ('', 0))
+        self.assertFalse(Fatura.objects.exists())
+
+        self.assertIn('2 mensagem(ns) lida(s): 2 fatura(s) criada(s)', self._importar(origem))
+
+
+class TriagemExtracaoTest(TestCase):
+    """Probe e extração completa rodam num único subprocesso, ocupando uma única vaga."""
+
+    FATURA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'media', 'faturas', '2025', '02', 'None.pdf')
+
+    def setUp(self):
+        popen = mock.patch('api.extraction.subprocess.Popen', wraps=subprocess.Popen)
+        self.popen = popen.start()
+        self.addCleanup(popen.stop)
+        slot = mock.patch('api.extraction.extraction_slot', wraps=extraction_slot)
+        self.slot = slot.start()
+        self.addCleanup(slot.stop)
+
+    def _extrair(self, caminho, armazenar):
+        triagem = mock.Mock()
+        triagem.sera_armazenada.return_value = armazenar
+        item = ItemLote('fatura.pdf', pdf_path=caminho)
+        _extrair(item, triagem)
+        self.assertEqual((self.popen.call_count, self.slot.call_count), (1, 1))
+        return item, triagem
+
+    def test_somente_probe(self):
+        item, triagem = self._extrair(self.FATURA, armazenar=False)
+        self.assertTrue(item.somente_probe)
+        self.assertEqual(item.dados['modo'], 'probe')
+        self.assertEqual((item.dados['unidade_consumidora'], item.dados['mes_referencia']), ('1340008741', 'FEV/2025'))
+        self.assertNotIn('texto', item.dados)
+        triagem.sera_armazenada.assert_called_once()
+
+    def test_extracao_completa_apos_o_probe(self):
+        item, _ = self._extrair(self.FATURA, armazenar=True)
+        self.assertFalse(item.somente_probe)
+        self.assertNotIn('modo', item.dados)
+        self.assertEqual(item.dados['status'], 'success')
+        self.assertTrue(item.dados['texto'])
+
+    def test_probe_inconclusivo_segue_para_a_extracao_completa(self):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf:
+            pdf.write(_pdf())  # sem texto na primeira página
+            pdf.flush()
+            item, triagem = self._extrair(pdf.name, armazenar=False)
+        triagem.sera_armazenada.assert_not_called()
+        self.assertFalse(item.somente_probe)
+        self.assertEqual(item.dados, {
+            'arquivo_processado': os.path.basename(pdf.name), 'status': 'error',
+            'erro': 'Não foi possível extrair texto do PDF'
+        })
+
+
+class ArquivoDuplicadoTest(TestCase):
+    """Reenvio de um PDF idêntico (mesmo SHA-256) é descartado antes da extração, sem cruzar usuários."""
+
+    DADOS = {'JAN': {'unidade_consumidora': '1'}, 'FEV': {'unidade_consumidora': '1', 'mes_referencia': 'FEV/2025'}}
+
+    def setUp(self):
+        _media_temporaria(self)
+        self.uc = _criar_uc('duplicado')
+        extracao = mock.patch('api.extraction.run_extraction', side_effect=_extracao_por_marca(self.DADOS))
+        self.run_extraction = extracao.start()
+        self.addCleanup(extracao.stop)
+
+    def _enviar(self, customer, *arquivos):
+        client = APIClient()
+        client.force_authenticate(customer.user)
+        response = client.post(
+            f'/api/customers/{customer.id}/faturas/upload-with-extraction/',
+            {'faturas': [SimpleUploadedFile(nome, conteudo) for nome, conteudo in arquivos]}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_reenvio_identico(self):
+        conteudo = _pdf(marca=b'JAN')
+        self.assertEqual(len(self._enviar(self.uc.customer, ('janeiro.pdf', conteudo))['faturas_processadas']), 1)
+        fatura = Fatura.objects.get()
+        self.assertEqual(fatura.sha256, hashlib.sha256(conteudo).hexdigest())
+
+        self.run_extraction.reset_mock()
+        corpo = self._enviar(self.uc.customer, ('janeiro (1).pdf', conteudo))
+        aviso, = corpo['avisos']
+        self.assertEqual((aviso['tipo'], aviso['fatura_existente_id']), ('arquivo_duplicado', fatura.id))
+        self.run_extraction.assert_not_called()
+        self.assertEqual(Fatura.objects.count(), 1)
+
+    def test_duplicata_no_mesmo_lote(self):
+        corpo = self._enviar(
+            self.uc.customer, ('a.pdf', _pdf(marca=b'JAN')), ('b.pdf', _pdf(marca=b'JAN')), ('c.pdf', _pdf(marca=b'FEV'))
+        )
+        self.assertEqual([f['arquivo'] for f in corpo['faturas_processadas']], ['a.pdf', 'c.pdf'])
+        aviso, = corpo['avisos']
+        self.assertEqual((aviso['tipo'], aviso['arquivo'], aviso['arquivo_original']), ('arquivo_duplicado', 'b.pdf', 'a.pdf'))
+        self.assertEqual(self.run_extraction.call_count, 2)
+
+    def test_sem_vazamento_entre_usuarios(self):
+        conteudo = _pdf(marca=b'JAN')
+        self._enviar(self.uc.customer, ('janeiro.pdf', conteudo))
+
+        outro = User.objects.create_user('outro', 'outro@example.com', 'senha')
+        customer = Customer.objects.create(user=outro, nome='Outro', cpf='11111111111', endereco='Rua B')
+        UnidadeConsumidora.objects.create(customer=customer, codigo='1', endereco='B')
+        corpo = self._enviar(customer, ('janeiro.pdf', conteudo))
+        self.assertEqual((len(corpo['faturas_processadas']), corpo['avisos']), (1, []))
+        self.assertEqual(Fatura.objects.filter(sha256=hashlib.sha256(conteudo).hexdigest()).count(), 2)
+
+
+class UploadStreamTest(TestCase):
+    """Upload com extração via SSE: um evento por arquivo, na ordem de envio, e o resumo no fim."""
+
+    DADOS = {'JAN': {'unidade_consumidora': '1'}, 'FEV': {'unidade_consumidora': '999'}}
+
+    def setUp(self):
+        _media_temporaria(self)
+        self.uc = _criar_uc('stream')
+        self.client = APIClient()
+        self.client.force_authenticate(self.uc.customer.user)
+
+    @mock.patch('api.extraction.run_extraction')
+    def test_eventos(self, run_extraction):
+        run_extraction.side_effect = _extracao_por_marca(self.DADOS)
+        response = self.client.post(
+            f'/api/customers/{self.uc.customer.id}/faturas/upload-with-extraction/stream/',
+            {'faturas': [SimpleUploadedFile('janeiro.pdf', _pdf(marca=b'JAN')),
+                         SimpleUploadedFile('fevereiro.pdf', _pdf(marca=b'FEV'))]},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        # Cada bloco enviado é um evento completo, terminado por uma linha em branco
+        blocos = [bloco.decode() for bloco in response.streaming_content]
+        eventos = []
+        for bloco in blocos:
+            self.assertTrue(bloco.endswith('\n\n'))
+            campos = dict(linha.split(': ', 1) for linha in bloco[:-2].split('\n'))
+            eventos.append((campos.get('id'), campos['event'], json.loads(campos['data'])))
+
+        self.assertEqual([(id_, evento) for id_, evento, _ in eventos],
+                         [(None, 'inicio'), ('0', 'processada'), ('1', 'aviso'), (None, 'fim')])
+        self.assertEqual(eventos[0][2], {'total_enviadas': 2})
+        self.assertEqual([dados['arquivo'] for _, _, dados in eventos[1:3]], ['janeiro.pdf', 'fevereiro.pdf'])
+        self.assertEqual(eventos[2][2]['tipo'], 'uc_nao_encontrada')
+        self.assertEqual(eventos[3][2], {
+            'message': '1 fatura(s) processada(s) com sucesso', 'total_processadas': 1,
+            'total_avisos': 1, 'total_erros': 0, 'total_enviadas': 2
+        })
+
+
+class MesReferenciaTest(TestCase):
+    """Mês de referência das faturas: abreviações em português (e as inglesas de antes)."""
+
+    def test_parse_mes_referencia(self):
+        casos = {
+            'JAN/2025': date(2025, 1, 1), 'FEV/2025': date(2025, 2, 1), 'MAI/2024': date(2024, 5, 1),
+            'ago/2024': date(2024, 8, 1), ' DEZ/2023 ': date(2023, 12, 1), 'Setembro/2024': date(2024, 9, 1),
+            'FEB/2025': date(2025, 2, 1), 'MAY/2024': date(2024, 5, 1), 'OCT/2024': date(2024, 10, 1),
+        }
+        for valor, esperado in casos.items():
+            with self.subTest(valor):
+                self.assertEqual(parse_mes_referencia(valor), esperado)
+
+        mes_atual = timezone.now().date().replace(day=1)
+        for valor in (None, '', 'XYZ/2025', '02/2025', 'JAN-2025', 'JAN/20x5'):
+            with self.subTest(valor):
+                self.assertEqual(parse_mes_referencia(valor), mes_atual)
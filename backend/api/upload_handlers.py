@@ -0,0 +1,26 @@
+# backend/api/upload_handlers.py
+"""Upload handlers customizados."""
+import hashlib
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Grava cada arquivo direto em disco calculando o SHA-256 durante o stream.
+
+    O digest fica disponível em ``arquivo.sha256`` e permite detectar
+    reenvios de um PDF idêntico antes de qualquer extração ou armazenamento.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        arquivo = super().file_complete(file_size)
+        arquivo.sha256 = self.hasher.hexdigest()
+        return arquivo
@@ -0,0 +1,154 @@
+# backend/api/uploads.py
+"""Uploads retomáveis em blocos (protocolo inspirado no tus 1.0).
+
+Cada ``FaturaUpload`` corresponde a um arquivo de staging que cresce a cada
+PATCH. O SHA-256 é calculado de forma incremental enquanto os blocos chegam;
+se outro processo recebeu os blocos anteriores (ou o estado foi descartado
+do cache do processo), o hash é reconstruído lendo o staging até o offset atual.
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .archives import process_archive
+from .extraction import CHUNK_SIZE, ItemLote, ResultadoLote, process_batch
+
+TUS_VERSION = '1.0.0'
+
+# upload_id -> (offset, hasher, guardado_em) dos uploads recebidos por este
+# processo, do mais antigo ao mais recente. Uploads abandonados (ou que seguiram
+# em outro worker) saem por idade ou pelo limite de tamanho.
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+HASHERS_MAX = 64
+HASHERS_MAX_IDADE = 15 * 60  # segundos
+
+
+class OffsetInvalido(Exception):
+    """O Upload-Offset enviado não corresponde ao offset atual do upload."""
+
+
+class TamanhoExcedido(Exception):
+    """O corpo recebido ultrapassa o tamanho declarado do upload."""
+
+
+def parse_upload_metadata(header):
+    """Decodifica o header ``Upload-Metadata`` (pares ``chave base64``)."""
+    metadata = {}
+    for par in filter(None, (p.strip() for p in (header or '').split(','))):
+        chave, _, valor = par.partition(' ')
+        try:
+            metadata[chave] = base64.b64decode(valor).decode('utf-8') if valor else ''
+        except (ValueError, UnicodeDecodeError):
+            continue
+    return metadata
+
+
+def staging_path(upload):
+    return os.path.join(settings.UPLOAD_STAGING_DIR, f"{upload.id}.part")
+
+
+def create_staging_file(upload):
+    os.makedirs(settings.UPLOAD_STAGING_DIR, exist_ok=True)
+    open(staging_path(upload), 'wb').close()
+
+
+def discard_staging_file(upload):
+    with _hashers_lock:
+        _hashers.pop(upload.id, None)
+    path = staging_path(upload)
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def _guardar_hasher(upload, hasher):
+    """Guarda o estado do hash para o próximo PATCH, descartando os mais antigos."""
+    agora = time.monotonic()
+    with _hashers_lock:
+        while _hashers:
+            upload_id, (_, _, guardado_em) = next(iter(_hashers.items()))
+            if agora - guardado_em < HASHERS_MAX_IDADE:
+                break
+            del _hashers[upload_id]
+        _hashers[upload.id] = (upload.offset, hasher, agora)
+        while len(_hashers) > HASHERS_MAX:
+            _hashers.popitem(last=False)
+
+
+def _hasher_for(upload):
+    """Retorna o hasher posicionado no offset atual do upload."""
+    with _hashers_lock:
+        cached = _hashers.pop(upload.id, None)
+    if cached and cached[0] == upload.offset and time.monotonic() - cached[2] < HASHERS_MAX_IDADE:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    restante = upload.offset
+    with open(staging_path(upload), 'rb') as staging:
+        while restante > 0:
+            bloco = staging.read(min(CHUNK_SIZE, restante))
+            if not bloco:
+                break
+            hasher.update(bloco)
+            restante -= len(bloco)
+    return hasher
+
+
+def append_chunk(upload, stream, upload_offset):
+    """Anexa o corpo de ``stream`` ao staging a partir de ``upload_offset``.
+
+    O offset é salvo com os bytes efetivamente gravados mesmo se a conexão
+    cair no meio do bloco ou o corpo exceder o tamanho declarado, para que o
+    cliente possa retomar. Deve ser chamado com a linha do upload bloqueada
+    (``select_for_update``); em caso de exceção o chamador precisa confirmar
+    a transação antes de propagá-la, senão o offset salvo é desfeito.
+    """
+    if upload_offset != upload.offset:
+        raise OffsetInvalido(f"Offset esperado {upload.offset}, recebido {upload_offset}")
+
+    hasher = _hasher_for(upload)
+    try:
+        with open(staging_path(upload), 'r+b') as staging:
+            # Descarta bytes além do offset confirmado (ex.: escrita interrompida)
+            staging.seek(upload.offset)
+            staging.truncate()
+            while True:
+                bloco = stream.read(CHUNK_SIZE)
+                if not bloco:
+                    break
+                if upload.offset + len(bloco) > upload.tamanho:
+                    raise TamanhoExcedido("Corpo excede o Upload-Length declarado")
+                staging.write(bloco)
+                hasher.update(bloco)
+                upload.offset += len(bloco)
+    finally:
+        if upload.is_complete:
+            upload.sha256 = hasher.hexdigest()
+        else:
+            _guardar_hasher(upload, hasher)
+        upload.save(update_fields=['offset', 'sha256', 'updated_at'])
+
+    return upload.offset
+
+
+def process_completed_upload(upload):
+    """Envia o arquivo montado ao pipeline de extração.
+
+    PDFs são processados diretamente a partir do staging; ZIP/tar.gz passam
+    pelo mesmo fluxo de ``upload_faturas_archive``. Retorna
+    ``(resultado, total_enviadas)``.
+    """
+    path = staging_path(upload)
+    if upload.nome_arquivo.lower().endswith('.pdf'):
+        resultado = ResultadoLote()
+        item = ItemLote(upload.nome_arquivo, pdf_path=path, sha256=upload.sha256)
+        for tipo, payload in process_batch(upload.customer, [item]):
+            resultado.add(tipo, payload)
+        return resultado, 1
+    with open(path, 'rb') as staging:
+        return process_archive(upload.customer, staging)
@@ -19,22 +19,39 @@ urlpatterns = [
     
     # Rotas de faturas melhoradas
     path('customers/<int:customer_id>/faturas/', views.get_faturas, name='get_faturas'),
+    path('customers/<int:customer_id>/faturas/export/', views.export_faturas, name='export_faturas'),
+    path('customers/<int:customer_id>/faturas/download/', views.download_faturas_zip, name='download_faturas_zip'),
     path('customers/<int:customer_id>/faturas/por-ano/', views.get_faturas_por_ano, name='get_faturas_por_ano'),
     path('customers/<int:customer_id>/faturas/import/', views.start_fatura_import, name='start_fatura_import'),
     path('customers/<int:customer_id>/faturas/tasks/', views.get_fatura_tasks, name='get_fatura_tasks'),
+    path('faturas/tasks/metrics/', views.get_fatura_task_metrics, name='get_fatura_task_metrics'),
+    path('faturas/export/', views.export_carteira, name='export_carteira'),
+    path('faturas/search/', views.search_faturas, name='search_faturas'),
     path('faturas/<int:fatura_id>/logs/', views.get_fatura_logs, name='get_fatura_logs'),
     
     # Upload de faturas
     path('customers/<int:customer_id>/faturas/upload/', views.upload_faturas, name='upload_faturas'),
     path('customers/<int:customer_id>/faturas/upload-with-extraction/', 
          views.upload_faturas_with_extraction, name='upload_faturas_with_extraction'),
+    path('customers/<int:customer_id>/faturas/upload-with-extraction/stream/', 
+         views.upload_faturas_with_extraction_stream, name='upload_faturas_with_extraction_stream'),
+    path('faturas/inbox/', views.upload_faturas_inbox, name='upload_faturas_inbox'),
+    path('customers/<int:customer_id>/faturas/upload-archive/', 
+         views.upload_faturas_archive, name='upload_faturas_archive'),
+    path('customers/<int:customer_id>/faturas/uploads/', 
+         views.create_fatura_upload, name='create_fatura_upload'),
+    path('faturas/uploads/<uuid:upload_id>/', 
+         views.fatura_upload_detail, name='fatura_upload_detail'),
     path('customers/<int:customer_id>/faturas/force-upload/', 
          views.force_upload_fatura, name='force_upload_fatura'),
     
     # ✅ NOVA: Rota para editar fatura
     path('faturas/<int:fatura_id>/edit/', views.edit_fatura, name='edit_fatura'),
+    path('faturas/<int:fatura_id>/reextract/', views.reextract_fatura, name='reextract_fatura'),
     
     # Extração de dados de fatura
     path('extract-fatura-data/', views.extract_fatura_data, name='extract_fatura_data'),
     path('faturas/extract_data/', views.extract_fatura_data_view, name='extract_fatura_data_view'),
+    path('extraction/status/', views.extraction_status, name='extraction_status'),
+    path('cache/status/', views.response_cache_status, name='response_cache_status'),
 ]
\ No newline at end of file
@@ -1,10 +1,12 @@
 # backend/api/
+import logging
 import sys
 
 from rest_framework import status, generics, permissions
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from .models import Customer, UnidadeConsumidora, FaturaTask, Fatura
+from .models import Customer, UnidadeConsumidora, FaturaTask, Fatura, FaturaResumoMensal, FaturaUpload
 from rest_framework import serializers
 from django.utils import timezone
 from django.db import transaction
@@ -14,11 +16,15 @@ from django.db import transaction
 import threading
 import subprocess
 import tempfile
+import tarfile
+import zipfile
+import io
 import json
 import os
 from django.conf import settings
-from django.db.models import Q
-from datetime import datetime, date
+from django.db.models import F, Q
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from datetime import datetime, date, timedelta
 import calendar
 
 # Imports para autenticação
@@ -29,19 +35,44 @@ from django.utils.encoding import force_bytes, force_str
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import send_mail
 from django.urls import reverse
-from .serializers import FaturaLogSerializer, FaturaSerializer, FaturaTaskSerializer, UserSerializer, MyTokenObtainPairSerializer
-from django.http import HttpResponseRedirect, JsonResponse
+from .serializers import (
+    CamposInvalidos, FaturaLogSerializer, FaturaSerializer, FaturaTaskSerializer, FaturaValoresSerializer,
+    UserSerializer, MyTokenObtainPairSerializer,
+)
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 
 # Imports para extração de dados de fatura
 from scripts.extract_fatura_data import process_single_pdf
+from .extraction import (
+    ResultadoLote, duplicate_aviso, find_duplicate, items_from_uploads, process_batch
+)
+from .sse import EventStreamRenderer, sse_event, sse_response
+from .pdf_validation import PdfInvalido, validate_pdf
+from .limiter import FILA_INTERATIVA, CapacidadeEsgotada, extraction_slot, get_limiter
+from .archives import ArquivoCompactadoInvalido, process_archive
+from .routing import process_inbox
+from .jobs import enqueue, lane_metrics, latency_metrics
+from .pagination import MAX_PAGE_SIZE, keyset_response, wants_pagination
+from .exports import FormatoInvalido, export_response
+from .zipstream import stream_files
+from .conditional import conditional_response, faturas_validators, grade_validators, tasks_validators
+from .response_cache import cached_response, stats as response_cache_stats
+from .uploads import (
+    TUS_VERSION, OffsetInvalido, TamanhoExcedido, append_chunk, create_staging_file,
+    discard_staging_file, parse_upload_metadata, process_completed_upload,
+)
+
+logger = logging.getLogger(__name__)
+
 
 @api_view(['GET'])
 def get_fatura_logs(request, fatura_id):
     try:
         fatura = Fatura.objects.get(pk=fatura_id)
-        logs = fatura.logs.all().order_by('-timestamp')
-        serializer = FaturaLogSerializer(logs, many=True)
-        return Response(serializer.data)
+        return keyset_response(
+            request, fatura.logs.all(), ('-timestamp', 'id'),
+            lambda logs: FaturaLogSerializer(logs, many=True).data
+        )
     except Fatura.DoesNotExist:
         return Response({'error': 'Fatura not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -136,9 +167,10 @@ class UnidadeConsumidoraSerializer(serializers.ModelSerializer):
 def customer_list(request):
     user = request.user
     if request.method == 'GET':
-        customers = Customer.objects.filter(user=user)
-        serializer = CustomerSerializer(customers, many=True)
-        return Response(serializer.data)
+        return keyset_response(
+            request, Customer.objects.filter(user=user), ('-created_at', 'id'),
+            lambda customers: CustomerSerializer(customers, many=True).data
+        )
 
     elif request.method == 'POST':
         serializer = CustomerSerializer(data=request.data)
@@ -178,8 +210,10 @@ def uc_list(request, customer_id):
     
     if request.method == 'GET':
         ucs = UnidadeConsumidora.objects.filter(customer=customer)
-        serializer = UnidadeConsumidoraSerializer(ucs, many=True)
-        return Response(serializer.data)
+        return cached_response(
+            request, 'ucs', customer.id,
+            lambda: Response(UnidadeConsumidoraSerializer(ucs, many=True).data)
+        )
     
     elif request.method == 'POST':
         data = request.data.copy()
@@ -236,31 +270,6 @@ def uc_toggle_status(request, customer_id, uc_id):
     serializer = UnidadeConsumidoraSerializer(uc)
     return Response(serializer.data)
 
-# Views para faturas
-class FaturaSerializer(serializers.ModelSerializer):
-    arquivo_url = serializers.SerializerMethodField()
-    unidade_consumidora_codigo = serializers.CharField(source='unidade_consumidora.codigo', read_only=True)
-
-    class Meta:
-        model = Fatura
-        fields = ['id', 'unidade_consumidora', 'unidade_consumidora_codigo', 'mes_referencia', 'arquivo', 
-                  'arquivo_url', 'valor', 'vencimento', 'downloaded_at']
-    
-    def get_arquivo_url(self, obj):
-        if obj.arquivo:
-            # Corrigido para retornar a URL relativa correta
-            return obj.arquivo.url
-        return None
-
-
-class FaturaTaskSerializer(serializers.ModelSerializer):
-    unidade_consumidora_codigo = serializers.CharField(source='unidade_consumidora.codigo', read_only=True)
-    
-    class Meta:
-        model = FaturaTask
-        fields = ['id', 'unidade_consumidora', 'unidade_consumidora_codigo', 
-                  'status', 'created_at', 'completed_at', 'error_message']
-
 
 # backend/api/views.py - Adicione no início das views problemáticas:
 
@@ -275,15 +284,21 @@ def get_fatura_tasks(request, customer_id):
         customer = Customer.objects.get(pk=customer_id, user=request.user)
         print(f"DEBUG: Customer encontrado: {customer.nome}")
         
-        # ✅ CORREÇÃO: Usar ordem por ID ao invés de created_at
-        tasks = FaturaTask.objects.filter(
-            unidade_consumidora__customer=customer
-        ).order_by('-id')[:10]  # ✅ CORREÇÃO: Ordenar por ID decrescente
+        tasks = FaturaTaskSerializer.otimizar_queryset(
+            FaturaTask.objects.filter(unidade_consumidora__customer=customer)
+        )
         
-        print(f"DEBUG: Encontradas {tasks.count()} tasks")
+        def gerar():
+            if wants_pagination(request):
+                return keyset_response(
+                    request, tasks, ('-created_at', 'id'),
+                    lambda pagina: FaturaTaskSerializer(pagina, many=True).data
+                )
+            # Sem paginação: as 10 mais recentes, como a tela de importação espera
+            serializer = FaturaTaskSerializer(tasks.order_by('-id')[:10], many=True)
+            return Response(serializer.data)
         
-        serializer = FaturaTaskSerializer(tasks, many=True)
-        return Response(serializer.data)
+        return conditional_response(request, tasks_validators(customer), gerar)
         
     except Customer.DoesNotExist:
         print(f"DEBUG: Customer {customer_id} não encontrado para user {request.user}")
@@ -293,6 +308,37 @@ def get_fatura_tasks(request, customer_id):
         return Response({"error": f"Erro interno: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
+@api_view(['GET'])
+def get_fatura_task_metrics(request):
+    """Percentis de espera na fila e de execução das tarefas, por cliente e tipo,
+    e profundidade/latência de cada fila de prioridade
+    
+    Parâmetros: ``dias`` (janela pela conclusão, padrão 7) e ``customer_id``.
+    """
+    try:
+        dias = int(request.query_params.get('dias', 7))
+        customer_id = int(request.query_params['customer_id']) if request.query_params.get('customer_id') else None
+    except ValueError:
+        return Response({"error": "Parâmetros inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    desde = timezone.now() - timedelta(days=dias)
+    tasks = FaturaTask.objects.filter(
+        unidade_consumidora__customer__user=request.user,
+        completed_at__gte=desde
+    )
+    if customer_id:
+        tasks = tasks.filter(unidade_consumidora__customer_id=customer_id)
+    
+    fila = FaturaTask.objects.filter(unidade_consumidora__customer__user=request.user)
+    return Response({
+        "dias": dias,
+        "pendentes": fila.filter(status='PENDING').count(),
+        "em_andamento": fila.filter(status='IN_PROGRESS').count(),
+        "filas": lane_metrics(fila, desde),
+        "grupos": latency_metrics(tasks),
+    })
+
+
 @api_view(['GET'])
 def get_faturas(request, customer_id):
     """Retorna as faturas baixadas do cliente"""
@@ -301,12 +347,29 @@ def get_faturas(request, customer_id):
         customer = Customer.objects.get(pk=customer_id, user=request.user)
         
         # Buscar faturas relacionadas às UCs deste customer
-        faturas = Fatura.objects.filter(
-            unidade_consumidora__customer=customer
-        ).order_by('-mes_referencia')
+        faturas = Fatura.objects.filter(unidade_consumidora__customer=customer)
+        ordenacao = ('-mes_referencia', 'id')
         
-        serializer = FaturaSerializer(faturas, many=True, context={'request': request})
-        return Response(serializer.data)
+        # ?fields=a,b ou ?compact=1: só as colunas pedidas, via values()
+        try:
+            campos = FaturaValoresSerializer.campos_solicitados(request.query_params)
+        except CamposInvalidos as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if campos is None:
+            faturas = FaturaSerializer.otimizar_queryset(faturas)
+            serializar = lambda pagina: FaturaSerializer(pagina, many=True, context={'request': request}).data
+        else:
+            enxuto = FaturaValoresSerializer(campos, request)
+            faturas = enxuto.queryset(faturas, ordenacao)
+            serializar = enxuto.serializar
+        
+        return conditional_response(
+            request, faturas_validators(customer),
+            lambda: cached_response(request, 'faturas', customer.id, lambda: keyset_response(
+                request, faturas, ordenacao, serializar
+            ))
+        )
         
     except Customer.DoesNotExist:
         return Response(
@@ -320,17 +383,251 @@ def get_faturas(request, customer_id):
         )
     
 
+def _exportar(request, faturas, nome_base):
+    """Aplica o filtro ``?ano=`` e devolve a planilha no ``?formato=`` pedido (csv ou xlsx)"""
+    ano = request.query_params.get('ano')
+    if ano:
+        if not ano.isdigit():
+            return Response({"error": "Ano inválido"}, status=status.HTTP_400_BAD_REQUEST)
+        faturas = faturas.filter(mes_referencia__year=int(ano))
+        nome_base = f"{nome_base}_{ano}"
+    try:
+        return export_response(faturas, request.query_params.get('formato', 'csv'), nome_base)
+    except FormatoInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+def export_faturas(request, customer_id):
+    """Planilha (CSV ou XLSX) com as faturas do cliente e os dados extraídos, enviada em streaming"""
+    try:
+        customer = Customer.objects.get(pk=customer_id, user=request.user)
+    except Customer.DoesNotExist:
+        return Response({"error": "Cliente não encontrado"}, status=status.HTTP_404_NOT_FOUND)
+    
+    return _exportar(
+        request, Fatura.objects.filter(unidade_consumidora__customer=customer), f"faturas_cliente_{customer.id}"
+    )
+
+
+@api_view(['GET'])
+def export_carteira(request):
+    """Planilha com as faturas de todos os clientes do usuário, enviada em streaming"""
+    return _exportar(
+        request, Fatura.objects.filter(unidade_consumidora__customer__user=request.user), "faturas_carteira"
+    )
+
+
+def _mes_do_parametro(valor):
+    """'AAAA-MM' -> primeiro dia do mês; ValueError se inválido"""
+    return datetime.strptime(valor, '%Y-%m').date()
+
+
+@api_view(['GET'])
+def download_faturas_zip(request, customer_id):
+    """ZIP com os PDFs das faturas do cliente, montado e enviado em streaming.
+    
+    Filtros opcionais: ``uc`` (ID, pode repetir), ``ano`` e o intervalo ``de``/``ate`` (AAAA-MM).
+    """
+    try:
+        customer = Customer.objects.get(pk=customer_id, user=request.user)
+    except Customer.DoesNotExist:
+        return Response({"error": "Cliente não encontrado"}, status=status.HTTP_404_NOT_FOUND)
+    
+    faturas = Fatura.objects.filter(unidade_consumidora__customer=customer).exclude(arquivo='')
+    nome_zip = f"faturas_cliente_{customer.id}"
+    try:
+        ucs = [int(uc) for uc in request.query_params.getlist('uc')]
+        if ucs:
+            faturas = faturas.filter(unidade_consumidora_id__in=ucs)
+        if request.query_params.get('ano'):
+            ano = int(request.query_params['ano'])
+            faturas = faturas.filter(mes_referencia__year=ano)
+            nome_zip += f"_{ano}"
+        if request.query_params.get('de'):
+            faturas = faturas.filter(mes_referencia__gte=_mes_do_parametro(request.query_params['de']))
+        if request.query_params.get('ate'):
+            faturas = faturas.filter(mes_referencia__lte=_mes_do_parametro(request.query_params['ate']))
+    except ValueError:
+        return Response(
+            {"error": "Filtros inválidos: uc e ano são números; de/ate no formato AAAA-MM"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not faturas.exists():
+        return Response({"error": "Nenhuma fatura com arquivo para os filtros informados"},
+                        status=status.HTTP_404_NOT_FOUND)
+    
+    storage = Fatura._meta.get_field('arquivo').storage
+    linhas = faturas.order_by('unidade_consumidora__codigo', 'mes_referencia').values_list(
+        'unidade_consumidora__codigo', 'mes_referencia', 'arquivo'
+    ).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    arquivos = (
+        (f"UC_{codigo}/{mes.strftime('%Y-%m')}.pdf", storage.path(arquivo))
+        for codigo, mes, arquivo in linhas
+    )
+    
+    response = StreamingHttpResponse(stream_files(arquivos), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{nome_zip}.zip"'
+    return response
+
+
 @api_view(['POST'])
 def start_fatura_import(request, customer_id):
-    # Aqui você implementará a lógica para iniciar a importação de faturas.
-    # Por enquanto, podemos retornar uma mensagem de sucesso.
+    """Enfileira a importação das faturas do cliente (uma tarefa por UC ativa)
+    
+    O download roda fora da requisição, nos workers (``run_fatura_worker``).
+    Aceita ``mes_referencia`` no formato MM/AAAA; o padrão é o mês atual.
+    Reenvios (clique duplo, retentativa do cliente) devolvem as tarefas já
+    ativas para a UC/mês, marcadas com ``duplicada``, sem enfileirar de novo.
+    """
     try:
-        customer = Customer.objects.get(pk=customer_id)
-        # Exemplo: iniciar uma task em background (não implementado aqui)
-        print(f"Iniciando importação para o cliente: {customer.nome}")
-        return Response({"message": "Importação de faturas iniciada com sucesso."}, status=status.HTTP_200_OK)
+        customer = Customer.objects.get(pk=customer_id, user=request.user)
     except Customer.DoesNotExist:
         return Response({"error": "Cliente não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+    
+    # Sem backend de download toda tarefa falharia na primeira tentativa do worker
+    if not settings.FATURA_IMPORT_BACKEND:
+        return Response(
+            {"error": "Importação automática não configurada: defina FATURA_IMPORT_BACKEND no servidor."},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    
+    mes_referencia = timezone.now().date().replace(day=1)
+    if request.data.get('mes_referencia'):
+        try:
+            mes, ano = request.data['mes_referencia'].split('/')
+            mes_referencia = date(int(ano), int(mes), 1)
+        except (ValueError, AttributeError):
+            return Response({"error": "Formato de data inválido (use MM/AAAA)"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    ucs = customer.unidades_consumidoras.filter(data_vigencia_fim__isnull=True)
+    tasks = [enqueue(uc, mes_referencia, 'IMPORTACAO') for uc in ucs]
+    novas = sum(1 for _, criada in tasks if criada)
+    logger.info("Importação enfileirada para o cliente %s: %s nova(s), %s já na fila", customer.nome, novas, len(tasks) - novas)
+    
+    return Response({
+        "message": f"{novas} tarefa(s) de importação enfileirada(s); {len(tasks) - novas} já estava(m) na fila.",
+        "tasks": [
+            {
+                "id": task.id,
+                "unidade_consumidora_codigo": task.unidade_consumidora.codigo,
+                "mes_referencia": task.mes_referencia.strftime('%m/%Y'),
+                "status": task.status,
+                "duplicada": not criada,
+            }
+            for task, criada in tasks
+        ]
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['POST'])
+def reextract_fatura(request, fatura_id):
+    """Enfileira a reextração dos dados (valor, vencimento) a partir do PDF armazenado"""
+    try:
+        fatura = Fatura.objects.select_related('unidade_consumidora').get(
+            pk=fatura_id, unidade_consumidora__customer__user=request.user
+        )
+    except Fatura.DoesNotExist:
+        return Response({"error": "Fatura não encontrada"}, status=status.HTTP_404_NOT_FOUND)
+    
+    # Pedida pelo usuário na tela: fila interativa, à frente de lotes e backfill
+    task, criada = enqueue(fatura.unidade_consumidora, fatura.mes_referencia, 'REEXTRACAO',
+                           fatura=fatura, fila=FILA_INTERATIVA)
+    return Response({
+        "message": "Reextração enfileirada" if criada else "Reextração já estava na fila",
+        "task_id": task.id,
+        "status": task.status,
+        "duplicada": not criada,
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def _capacidade_esgotada_response(erro, response_class=Response):
+    """Resposta 429 padrão quando o limitador de extrações está cheio"""
+    data = {
+        "error": "Capacidade de extração esgotada. Tente novamente em instantes.",
+        "fila": erro.fila,
+        "aguardando": erro.aguardando,
+        "retry_after": erro.retry_after,
+    }
+    if response_class is JsonResponse:
+        response = JsonResponse(data, status=429)
+    else:
+        response = Response(data, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(erro.retry_after)
+    return response
+
+
+def _retry_after_lote(response, resultado):
+    """Sinaliza quando reenviar os arquivos do lote recusados por falta de capacidade"""
+    if resultado.retry_after is not None:
+        response['Retry-After'] = str(resultado.retry_after)
+    return response
+
+
+@api_view(['GET'])
+def search_faturas(request):
+    """Busca textual no texto das faturas dos clientes do usuário, ordenada por relevância.
+    
+    ``q`` aceita a sintaxe de busca web (aspas para frase, ``-`` para excluir, ``or``);
+    ``customer_id`` restringe a um cliente e ``limit`` limita os resultados.
+    """
+    termos = request.query_params.get('q', '').strip()
+    if not termos:
+        return Response({"error": "Informe o texto da busca em q"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limite = max(1, min(int(request.query_params.get('limit') or 20), MAX_PAGE_SIZE))
+        customer_id = int(request.query_params['customer_id']) if request.query_params.get('customer_id') else None
+    except ValueError:
+        return Response({"error": "limit e customer_id devem ser números"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    consulta = SearchQuery(termos, config='portuguese', search_type='websearch')
+    faturas = Fatura.objects.filter(unidade_consumidora__customer__user=request.user, busca=consulta)
+    if customer_id:
+        faturas = faturas.filter(unidade_consumidora__customer_id=customer_id)
+    
+    resultados = faturas.annotate(
+        relevancia=SearchRank(F('busca'), consulta),
+        trecho=SearchHeadline('texto', consulta, config='portuguese', max_fragments=2),
+    ).order_by('-relevancia', '-mes_referencia', 'id').values(
+        'id', 'unidade_consumidora', 'unidade_consumidora__codigo', 'unidade_consumidora__customer_id',
+        'unidade_consumidora__customer__nome', 'mes_referencia', 'valor', 'arquivo', 'relevancia', 'trecho'
+    )[:limite]
+    
+    storage = Fatura._meta.get_field('arquivo').storage
+    return Response([
+        {
+            "id": fatura['id'],
+            "customer_id": fatura['unidade_consumidora__customer_id'],
+            "customer_nome": fatura['unidade_consumidora__customer__nome'],
+            "unidade_consumidora": fatura['unidade_consumidora'],
+            "unidade_consumidora_codigo": fatura['unidade_consumidora__codigo'],
+            "mes_referencia": fatura['mes_referencia'],
+            "valor": fatura['valor'],
+            "arquivo_url": storage.url(fatura['arquivo']) if fatura['arquivo'] else None,
+            "relevancia": round(fatura['relevancia'], 4),
+            "trecho": fatura['trecho'],
+        }
+        for fatura in resultados
+    ])
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def extraction_status(request):
+    """Métricas do limitador de extrações deste processo (espera, rejeições, uso)
+    e das filas de prioridade da fila de tarefas (últimas 24h)"""
+    return Response({
+        **get_limiter().stats(),
+        "tarefas": lane_metrics(FaturaTask.objects.all(), timezone.now() - timedelta(days=1)),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def response_cache_status(request):
+    """Taxa de acerto do cache de respostas (faturas, grade anual, UCs) deste processo"""
+    return Response(response_cache_stats())
 
 
 # backend/api/views.py - Adicione esta view
@@ -359,6 +656,20 @@ def upload_faturas(request, customer_id):
                 })
                 continue
             
+            try:
+                validate_pdf(arquivo)
+            except PdfInvalido as e:
+                faturas_com_erro.append({"arquivo": arquivo.name, "erro": str(e)})
+                continue
+            
+            # Reenvio de um PDF idêntico: não armazena de novo
+            sha256 = getattr(arquivo, 'sha256', '')
+            fatura_existente = find_duplicate(request.user, sha256)
+            if fatura_existente:
+                _, aviso = duplicate_aviso(arquivo.name, sha256, fatura_existente)
+                faturas_com_erro.append({"arquivo": arquivo.name, "erro": aviso["mensagem"]})
+                continue
+            
             # Aqui você pode integrar com seu script de extração real
             # Por enquanto, vamos criar uma fatura básica
             try:
@@ -377,6 +688,7 @@ def upload_faturas(request, customer_id):
                     'unidade_consumidora': uc,
                     'mes_referencia': timezone.now().date().replace(day=1),  # Primeiro dia do mês atual
                     'arquivo': arquivo,
+                    'sha256': sha256,
                 }
                 
                 # Se dados específicos foram enviados no request, usar eles
@@ -441,6 +753,12 @@ def extract_fatura_data(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    # Validar estrutura antes de ocupar uma vaga de extração
+    try:
+        validate_pdf(arquivo)
+    except PdfInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
     try:
         # Criar arquivo temporário
         with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
@@ -451,16 +769,18 @@ def extract_fatura_data(request):
         # Caminho para o script de extração
         script_path = os.path.join(settings.BASE_DIR, 'scripts', 'extract_fatura_data.py')
         
-        # Executar script Python
-        result = subprocess.run(
-            [sys.executable, script_path, temp_pdf_path],
-            capture_output=True,
-            text=True,
-            timeout=30  # Timeout de 30 segundos
-        )
-        
-        # Limpar arquivo temporário
-        os.unlink(temp_pdf_path)
+        # Executar script Python (ocupando uma vaga do limitador global)
+        try:
+            with extraction_slot(FILA_INTERATIVA):
+                result = subprocess.run(
+                    [sys.executable, script_path, temp_pdf_path],
+                    capture_output=True,
+                    text=True,
+                    timeout=30  # Timeout de 30 segundos
+                )
+        finally:
+            # Limpar arquivo temporário
+            os.unlink(temp_pdf_path)
         
         if result.returncode == 0:
             # Parse do resultado JSON
@@ -501,6 +821,8 @@ def extract_fatura_data(request):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
             
+    except CapacidadeEsgotada as e:
+        return _capacidade_esgotada_response(e)
     except subprocess.TimeoutExpired:
         return Response(
             {"error": "Timeout na extração de dados"}, 
@@ -524,6 +846,7 @@ def upload_faturas_with_extraction(request, customer_id):
     """Upload de faturas com extração automática de dados e validações CORRIGIDAS"""
     try:
         customer = Customer.objects.get(pk=customer_id, user=request.user)
+        get_limiter().check_admission()
         
         if not request.FILES.getlist('faturas'):
             return Response(
@@ -531,197 +854,27 @@ def upload_faturas_with_extraction(request, customer_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        faturas_processadas = []
-        faturas_com_erro = []
-        avisos = []
+        resultado = ResultadoLote()
         
-        for arquivo in request.FILES.getlist('faturas'):
-            if not arquivo.name.lower().endswith('.pdf'):
-                faturas_com_erro.append({
-                    "arquivo": arquivo.name,
-                    "erro": "Apenas arquivos PDF são aceitos"
-                })
-                continue
-            
-            try:
-                # Extrair dados usando o script
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                    for chunk in arquivo.chunks():
-                        temp_file.write(chunk)
-                    temp_pdf_path = temp_file.name
-                
-                script_path = os.path.join(settings.BASE_DIR, 'scripts', 'extract_fatura_data.py')
-                result = subprocess.run(
-                    [sys.executable, script_path, temp_pdf_path],
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                )
-                
-                os.unlink(temp_pdf_path)
-                
-                if result.returncode == 0:
-                    extracted_data = json.loads(result.stdout)
-                    
-                    if extracted_data.get('status') == 'error':
-                        faturas_com_erro.append({
-                            "arquivo": arquivo.name,
-                            "erro": extracted_data.get('erro', 'Erro na extração')
-                        })
-                        continue
-                    
-                    # ✅ CORREÇÃO: Verificar UC correspondente COM VALIDAÇÃO ADEQUADA
-                    uc_codigo = extracted_data.get('unidade_consumidora')
-                    uc = None
-                    
-                    if uc_codigo:
-                        print(f"🔍 DEBUG: UC extraída do PDF: {uc_codigo}")
-                        
-                        # ✅ PRIMEIRO: Verificar se UC existe no cliente atual
-                        uc = customer.unidades_consumidoras.filter(codigo=uc_codigo).first()
-                        
-                        if uc:
-                            print(f"✅ UC {uc_codigo} encontrada no cliente atual")
-                        else:
-                            print(f"❌ UC {uc_codigo} NÃO encontrada no cliente atual")
-                            
-                            # ✅ VERIFICAR se UC existe em outros clientes
-                            uc_outros_clientes = UnidadeConsumidora.objects.filter(
-                                codigo=uc_codigo
-                            ).exclude(customer=customer).first()
-                            
-                            if uc_outros_clientes:
-                                print(f"⚠️ UC {uc_codigo} encontrada em outro cliente: {uc_outros_clientes.customer.nome}")
-                                
-                                # ✅ AVISO CORRETO: UC pertence a outro cliente
-                                avisos.append({
-                                    "tipo": "uc_outro_cliente",
-                                    "arquivo": arquivo.name,
-                                    "uc_codigo": uc_codigo,
-                                    "cliente_nome": uc_outros_clientes.customer.nome,
-                                    "cliente_id": uc_outros_clientes.customer.id,
-                                    "mensagem": f"A UC {uc_codigo} está cadastrada no cliente '{uc_outros_clientes.customer.nome}', não no cliente atual."
-                                })
-                                continue  # ✅ PULAR este arquivo, não processar
-                            else:
-                                print(f"❌ UC {uc_codigo} não encontrada em nenhum cliente")
-                                
-                                # ✅ AVISO CORRETO: UC não existe no sistema
-                                avisos.append({
-                                    "tipo": "uc_nao_encontrada",
-                                    "arquivo": arquivo.name,
-                                    "uc_codigo": uc_codigo,
-                                    "mensagem": f"A UC {uc_codigo} não está cadastrada no sistema. Cadastre-a primeiro ou verifique se o código está correto."
-                                })
-                                continue  # ✅ PULAR este arquivo, não processar
-                    else:
-                        print("❌ Nenhuma UC extraída do PDF")
-                        
-                        # ✅ ERRO: Não conseguiu extrair UC
-                        faturas_com_erro.append({
-                            "arquivo": arquivo.name,
-                            "erro": "Não foi possível extrair o código da UC do PDF"
-                        })
-                        continue
-                    
-                    # ✅ Se chegou até aqui, a UC existe no cliente atual
-                    # Processar mês de referência
-                    mes_referencia = None
-                    if extracted_data.get('mes_referencia'):
-                        try:
-                            # Formato: JAN/2024
-                            mes_ano = extracted_data['mes_referencia']
-                            mes_referencia = datetime.strptime(f"01/{mes_ano}", '%d/%b/%Y').date()
-                        except:
-                            mes_referencia = timezone.now().date().replace(day=1)
-                    else:
-                        mes_referencia = timezone.now().date().replace(day=1)
-                    
-                    print(f"📅 Data de referência: {mes_referencia}")
-                    
-                    # ✅ VERIFICAR se fatura já existe PARA ESTA UC ESPECÍFICA
-                    fatura_existente = Fatura.objects.filter(
-                        unidade_consumidora=uc,  # ✅ UC correta do cliente atual
-                        mes_referencia=mes_referencia
-                    ).first()
-                    
-                    if fatura_existente:
-                        print(f"⚠️ Fatura já existe: UC {uc.codigo}, mês {mes_referencia}")
-                        
-                        # ✅ AVISO CORRETO: Fatura duplicada para a UC correta
-                        avisos.append({
-                            "tipo": "fatura_duplicada",
-                            "arquivo": arquivo.name,
-                            "uc_codigo": uc.codigo,
-                            "mes_referencia": mes_referencia.strftime('%m/%Y'),
-                            "fatura_existente_id": fatura_existente.id,
-                            "mensagem": f"Já existe uma fatura para a UC {uc.codigo} no período {mes_referencia.strftime('%m/%Y')}."
-                        })
-                        continue  # ✅ PULAR este arquivo
-                    
-                    # ✅ Processar data de vencimento
-                    data_vencimento = None
-                    if extracted_data.get('data_vencimento'):
-                        try:
-                            data_vencimento = datetime.strptime(
-                                extracted_data['data_vencimento'], 
-                                '%d/%m/%Y'
-                            ).date()
-                        except:
-                            pass
-                    
-                    # ✅ Criar fatura para a UC CORRETA
-                    fatura = Fatura.objects.create(
-                        unidade_consumidora=uc,  # ✅ UC correta
-                        mes_referencia=mes_referencia,
-                        arquivo=arquivo,
-                        valor=extracted_data.get('valor_total'),
-                        vencimento=data_vencimento,
-                        downloaded_at=timezone.now()
-                    )
-                    
-                    print(f"✅ Fatura criada: ID {fatura.id}, UC {uc.codigo}")
-                    
-                    faturas_processadas.append({
-                        "id": fatura.id,
-                        "arquivo": arquivo.name,
-                        "uc": uc.codigo,
-                        "mes_referencia": mes_referencia,
-                        "valor": fatura.valor,
-                        "dados_extraidos": extracted_data
-                    })
-                    
-                else:
-                    faturas_com_erro.append({
-                        "arquivo": arquivo.name,
-                        "erro": f"Erro na extração: {result.stderr}"
-                    })
-                    
-            except Exception as e:
-                print(f"❌ Erro ao processar {arquivo.name}: {str(e)}")
-                faturas_com_erro.append({
-                    "arquivo": arquivo.name,
-                    "erro": str(e)
-                })
+        # Extração em paralelo (limitada), registro no banco na ordem de envio
+        itens = items_from_uploads(request.FILES.getlist('faturas'))
+        for tipo, payload in process_batch(customer, itens):
+            resultado.add(tipo, payload)
         
         # ✅ Resposta com avisos corretos
-        response_data = {
-            "message": f"{len(faturas_processadas)} fatura(s) processada(s) com sucesso",
-            "faturas_processadas": faturas_processadas,
-            "faturas_com_erro": faturas_com_erro,
-            "avisos": avisos,
-            "total_enviadas": len(request.FILES.getlist('faturas'))
-        }
+        response_data = resultado.as_response_data(len(request.FILES.getlist('faturas')))
         
-        print(f"📊 RESULTADO FINAL: {len(faturas_processadas)} processadas, {len(avisos)} avisos, {len(faturas_com_erro)} erros")
+        print(f"📊 RESULTADO FINAL: {len(resultado.faturas_processadas)} processadas, {len(resultado.avisos)} avisos, {len(resultado.faturas_com_erro)} erros")
         
-        return Response(response_data, status=status.HTTP_201_CREATED)
+        return _retry_after_lote(Response(response_data, status=status.HTTP_201_CREATED), resultado)
         
     except Customer.DoesNotExist:
         return Response(
             {"error": "Cliente não encontrado"}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    except CapacidadeEsgotada as e:
+        return _capacidade_esgotada_response(e)
     except Exception as e:
         print(f"❌ Erro geral: {str(e)}")
         return Response(
@@ -729,6 +882,294 @@ def upload_faturas_with_extraction(request, customer_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+def upload_faturas_inbox(request):
+    """Caixa de entrada: recebe PDFs de qualquer cliente do usuário e roteia cada um pela UC/CPF
+    
+    Além das listas usuais, devolve o relatório de roteamento (um item por
+    arquivo, na ordem de envio) e os totais por cliente.
+    """
+    try:
+        get_limiter().check_admission()
+        
+        arquivos = request.FILES.getlist('faturas')
+        if not arquivos:
+            return Response(
+                {"error": "Nenhum arquivo enviado"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        resultado = ResultadoLote()
+        roteamento = []
+        por_cliente = {}
+        for tipo, payload, entrada in process_inbox(request.user, items_from_uploads(arquivos)):
+            resultado.add(tipo, payload)
+            roteamento.append(entrada)
+            if entrada["roteada"]:
+                totais = por_cliente.setdefault(entrada["cliente_id"], {
+                    "cliente_id": entrada["cliente_id"],
+                    "cliente_nome": entrada["cliente_nome"],
+                    "processadas": 0, "avisos": 0, "erros": 0,
+                })
+                totais[{'processada': 'processadas', 'aviso': 'avisos'}.get(tipo, 'erros')] += 1
+        
+        response_data = resultado.as_response_data(len(arquivos))
+        response_data["roteamento"] = roteamento
+        response_data["por_cliente"] = list(por_cliente.values())
+        response_data["total_nao_roteadas"] = sum(1 for e in roteamento if not e["roteada"])
+        
+        logger.info(
+            "Caixa de entrada: %d processada(s) em %d cliente(s), %d não roteada(s)",
+            len(resultado.faturas_processadas), len(por_cliente), response_data['total_nao_roteadas']
+        )
+        
+        return _retry_after_lote(Response(response_data, status=status.HTTP_201_CREATED), resultado)
+        
+    except CapacidadeEsgotada as e:
+        return _capacidade_esgotada_response(e)
+    except Exception as e:
+        logger.exception("Erro na caixa de entrada")
+        return Response(
+            {"error": f"Erro interno: {str(e)}"}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['POST'])
+@renderer_classes([JSONRenderer, EventStreamRenderer])
+def upload_faturas_with_extraction_stream(request, customer_id):
+    """Variante SSE do upload com extração: um evento por arquivo assim que é processado
+    
+    Eventos: 'inicio', um 'processada' / 'aviso' / 'erro' por arquivo (com o mesmo
+    payload das listas de upload_faturas_with_extraction) e 'fim' com os totais.
+    """
+    try:
+        customer = Customer.objects.get(pk=customer_id, user=request.user)
+    except Customer.DoesNotExist:
+        return Response(
+            {"error": "Cliente não encontrado"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    arquivos = request.FILES.getlist('faturas')
+    if not arquivos:
+        return Response(
+            {"error": "Nenhum arquivo enviado"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        get_limiter().check_admission()
+    except CapacidadeEsgotada as e:
+        return _capacidade_esgotada_response(e)
+    
+    def eventos():
+        resultado = ResultadoLote()
+        yield sse_event('inicio', {"total_enviadas": len(arquivos)})
+        
+        lote = process_batch(customer, items_from_uploads(arquivos))
+        for indice, (tipo, payload) in enumerate(lote):
+            resultado.add(tipo, payload)
+            yield sse_event(tipo, payload, event_id=indice)
+        
+        yield sse_event('fim', resultado.as_summary(len(arquivos)))
+    
+    return sse_response(eventos())
+
+@api_view(['POST'])
+def upload_faturas_archive(request, customer_id):
+    """Upload de um ZIP/tar.gz com várias faturas, processadas membro a membro"""
+    try:
+        customer = Customer.objects.get(pk=customer_id, user=request.user)
+        
+        arquivo_compactado = request.FILES.get('arquivo')
+        if not arquivo_compactado:
+            return Response(
+                {"error": "Nenhum arquivo enviado"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        get_limiter().check_admission()
+        resultado, total_enviadas = process_archive(customer, arquivo_compactado)
+        
+        if total_enviadas == 0:
+            return Response(
+                {"error": "Arquivo compactado não contém faturas"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        logger.info(
+            "Arquivo %s: %d processada(s), %d aviso(s), %d erro(s)", arquivo_compactado.name,
+            len(resultado.faturas_processadas), len(resultado.avisos), len(resultado.faturas_com_erro)
+        )
+        
+        return _retry_after_lote(
+            Response(resultado.as_response_data(total_enviadas), status=status.HTTP_201_CREATED), resultado
+        )
+        
+    except Customer.DoesNotExist:
+        return Response(
+            {"error": "Cliente não encontrado"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except (ArquivoCompactadoInvalido, zipfile.BadZipFile, tarfile.TarError) as e:
+        return Response(
+            {"error": f"Arquivo compactado inválido: {str(e)}"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except CapacidadeEsgotada as e:
+        return _capacidade_esgotada_response(e)
+    except Exception as e:
+        logger.exception("Erro no upload do arquivo compactado")
+        return Response(
+            {"error": f"Erro interno: {str(e)}"}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+# --- Upload retomável em blocos (tus) ---
+
+def _tus_headers(response, upload):
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Upload-Offset'] = str(upload.offset)
+    response['Upload-Length'] = str(upload.tamanho)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@api_view(['POST'])
+def create_fatura_upload(request, customer_id):
+    """Inicia um upload retomável (Upload-Length + Upload-Metadata 'filename')"""
+    try:
+        customer = Customer.objects.get(pk=customer_id, user=request.user)
+    except Customer.DoesNotExist:
+        return Response(
+            {"error": "Cliente não encontrado"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        tamanho = int(request.headers.get('Upload-Length', ''))
+    except ValueError:
+        return Response(
+            {"error": "Header Upload-Length ausente ou inválido"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if tamanho <= 0 or tamanho > settings.UPLOAD_MAX_SIZE:
+        return Response(
+            {"error": f"Tamanho do upload deve estar entre 1 byte e {settings.UPLOAD_MAX_SIZE // (1024 * 1024)} MB"}, 
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    
+    metadata = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+    nome_arquivo = os.path.basename(metadata.get('filename', ''))
+    if not nome_arquivo.lower().endswith(('.pdf', '.zip', '.tar.gz', '.tgz')):
+        return Response(
+            {"error": "Apenas arquivos PDF, ZIP ou tar.gz são aceitos"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    upload = FaturaUpload.objects.create(
+        user=request.user,
+        customer=customer,
+        nome_arquivo=nome_arquivo,
+        tamanho=tamanho
+    )
+    create_staging_file(upload)
+    
+    response = Response(
+        {"id": str(upload.id), "offset": upload.offset, "tamanho": upload.tamanho}, 
+        status=status.HTTP_201_CREATED
+    )
+    response['Location'] = request.build_absolute_uri(
+        reverse('fatura_upload_detail', kwargs={'upload_id': upload.id})
+    )
+    return _tus_headers(response, upload)
+
+
+@api_view(['HEAD', 'PATCH', 'DELETE'])
+def fatura_upload_detail(request, upload_id):
+    """Consulta (HEAD), envia blocos (PATCH) ou cancela (DELETE) um upload retomável"""
+    uploads = FaturaUpload.objects.filter(user=request.user, status='RECEBENDO')
+    
+    if request.method == 'HEAD':
+        upload = uploads.filter(pk=upload_id).first()
+        if not upload:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return _tus_headers(Response(status=status.HTTP_200_OK), upload)
+    
+    if request.method == 'DELETE':
+        upload = uploads.filter(pk=upload_id).first()
+        if not upload:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        upload.status = 'CANCELADO'
+        upload.save(update_fields=['status', 'updated_at'])
+        discard_staging_file(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    # PATCH: anexar bloco
+    if request.content_type.split(';')[0].strip() != 'application/offset+octet-stream':
+        return Response(
+            {"error": "Content-Type deve ser application/offset+octet-stream"}, 
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+    try:
+        upload_offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return Response(
+            {"error": "Header Upload-Offset ausente ou inválido"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        interrupcao = None
+        with transaction.atomic():
+            upload = uploads.select_for_update().filter(pk=upload_id).first()
+            if not upload:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            try:
+                append_chunk(upload, request.stream or io.BytesIO(), upload_offset)
+            except OffsetInvalido:
+                raise
+            except Exception as e:
+                # Confirma o offset dos bytes já gravados antes de propagar o erro
+                interrupcao = e
+        if interrupcao is not None:
+            raise interrupcao
+    except OffsetInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+    except TamanhoExcedido as e:
+        return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    if not upload.is_complete:
+        return _tus_headers(Response(status=status.HTTP_204_NO_CONTENT), upload)
+    
+    # O último bloco já está confirmado: sem capacidade, o upload continua
+    # aberto e o cliente repete o PATCH (corpo vazio, offset final) após o Retry-After
+    try:
+        get_limiter().check_admission()
+    except CapacidadeEsgotada as e:
+        return _tus_headers(_capacidade_esgotada_response(e), upload)
+    
+    # Só quem marca o upload como concluído o processa (PATCHes finais repetidos)
+    if not uploads.filter(pk=upload.pk).update(status='CONCLUIDO', updated_at=timezone.now()):
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    upload.status = 'CONCLUIDO'
+    
+    # Upload completo: processar fora da transação que bloqueia a linha
+    try:
+        resultado, total_enviadas = process_completed_upload(upload)
+    except (ArquivoCompactadoInvalido, zipfile.BadZipFile, tarfile.TarError) as e:
+        return _tus_headers(Response(
+            {"error": f"Arquivo compactado inválido: {str(e)}", "sha256": upload.sha256}, 
+            status=status.HTTP_400_BAD_REQUEST
+        ), upload)
+    finally:
+        discard_staging_file(upload)
+    
+    response_data = resultado.as_response_data(total_enviadas)
+    response_data['sha256'] = upload.sha256
+    return _retry_after_lote(_tus_headers(Response(response_data, status=status.HTTP_201_CREATED), upload), resultado)
+
 @api_view(['POST'])
 def extract_fatura_data_view(request):
     """Extrai dados de uma fatura PDF - versão corrigida com mapeamento consistente"""
@@ -753,6 +1194,11 @@ def extract_fatura_data_view(request):
             'error': 'Apenas arquivos PDF são aceitos'
         }, status=400)
 
+    try:
+        validate_pdf(uploaded_file)
+    except PdfInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
     try:
         import tempfile
         import uuid
@@ -767,9 +1213,10 @@ def extract_fatura_data_view(request):
             for chunk in uploaded_file.chunks():
                 temp_file.write(chunk)
         
-        # Chamar função de extração
+        # Chamar função de extração (ocupando uma vaga do limitador global)
         from scripts.extract_fatura_data import process_single_pdf
-        extracted_data = process_single_pdf(temp_pdf_path)
+        with extraction_slot(FILA_INTERATIVA):
+            extracted_data = process_single_pdf(temp_pdf_path)
         
         # Remover arquivo temporário
         if os.path.exists(temp_pdf_path):
@@ -838,6 +1285,10 @@ def extract_fatura_data_view(request):
         
         return JsonResponse(formatted_data, status=200)
         
+    except CapacidadeEsgotada as e:
+        if os.path.exists(temp_pdf_path):
+            os.remove(temp_pdf_path)
+        return _capacidade_esgotada_response(e, response_class=JsonResponse)
     except Exception as e:
         # Limpar arquivo temporário em caso de erro
         if 'temp_pdf_path' in locals() and os.path.exists(temp_pdf_path):
@@ -855,151 +1306,122 @@ def extract_fatura_data_view(request):
 
 # backend/api/views.py - CORREÇÃO DEFINITIVA da view get_faturas_por_ano
 
+def _montar_grade_anual(customer, ano):
+    """Grade mês × UC do ano a partir do resumo mensal (FaturaResumoMensal)"""
+    # Nomes dos meses em português
+    MESES_PT_BR = {
+        1: {'nome': 'Janeiro', 'abrev': 'JAN'},
+        2: {'nome': 'Fevereiro', 'abrev': 'FEV'},
+        3: {'nome': 'Março', 'abrev': 'MAR'},
+        4: {'nome': 'Abril', 'abrev': 'ABR'},
+        5: {'nome': 'Maio', 'abrev': 'MAI'},
+        6: {'nome': 'Junho', 'abrev': 'JUN'},
+        7: {'nome': 'Julho', 'abrev': 'JUL'},
+        8: {'nome': 'Agosto', 'abrev': 'AGO'},
+        9: {'nome': 'Setembro', 'abrev': 'SET'},
+        10: {'nome': 'Outubro', 'abrev': 'OUT'},
+        11: {'nome': 'Novembro', 'abrev': 'NOV'},
+        12: {'nome': 'Dezembro', 'abrev': 'DEZ'},
+    }
+
+    # Buscar todas as UCs do cliente (uma consulta; reaproveitada abaixo)
+    ucs = list(customer.unidades_consumidoras.order_by('id'))
+
+    # Resumo mensal do ano (FaturaResumoMensal) em uma única consulta, indexado por (uc_id, mês)
+    resumos = FaturaResumoMensal.objects.filter(customer=customer, ano=ano)
+    fatura_por_uc_mes = {(resumo.unidade_consumidora_id, resumo.mes): resumo for resumo in resumos}
+    logger.debug("Grade %s do cliente %s: %d UC(s), %d fatura(s)", ano, customer.id, len(ucs), len(fatura_por_uc_mes))
+
+    # Organizar por mês
+    faturas_por_mes = {}
+    for mes in range(1, 13):
+        mes_info = MESES_PT_BR[mes]
+        faturas_por_mes[mes] = {
+            'mes_numero': mes,
+            'mes_nome': mes_info['nome'],
+            'mes_abrev': mes_info['abrev'],
+            'ucs': []
+        }
+
+        # Para cada UC, verificar se tem fatura neste mês
+        for uc in ucs:
+            fatura_mes = fatura_por_uc_mes.get((uc.id, mes))
+            uc_info = {
+                'uc_id': uc.id,
+                'uc_codigo': uc.codigo,
+                'uc_endereco': uc.endereco,
+                'uc_tipo': uc.tipo,
+                'uc_is_active': uc.is_active,  # ✅ CORREÇÃO: Usar propriedade Python
+                'fatura': None
+            }
+
+            if fatura_mes:
+                uc_info['fatura'] = {
+                    'id': fatura_mes.fatura_id,
+                    'valor': str(fatura_mes.valor) if fatura_mes.valor else None,
+                    'vencimento': fatura_mes.vencimento.strftime('%d/%m/%Y') if fatura_mes.vencimento else None,
+                    'arquivo_url': fatura_mes.arquivo.url if fatura_mes.arquivo else None,
+                    'downloaded_at': fatura_mes.downloaded_at.strftime('%d/%m/%Y') if fatura_mes.downloaded_at else None
+                }
+
+            faturas_por_mes[mes]['ucs'].append(uc_info)
+
+    # Anos disponíveis
+    anos_disponiveis = list(FaturaResumoMensal.objects.filter(
+        customer=customer
+    ).values_list('ano', flat=True).distinct())
+
+    anos_disponiveis = sorted(set(anos_disponiveis), reverse=True)
+    if not anos_disponiveis:
+        anos_disponiveis = [datetime.now().year]
+
+    # ✅ CORREÇÃO: Calcular UCs ativas usando a propriedade Python
+    ucs_ativas_count = sum(1 for uc in ucs if uc.is_active)
+
+    # Preparar resposta
+    response_data = {
+        'ano_atual': ano,
+        'anos_disponiveis': anos_disponiveis,
+        'faturas_por_mes': faturas_por_mes,
+        'total_ucs': len(ucs),
+        'total_ucs_ativas': ucs_ativas_count  # ✅ CORREÇÃO: Usar contagem manual
+    }
+    return response_data
+
+
 @api_view(['GET'])
 def get_faturas_por_ano(request, customer_id):
     """Retorna as faturas organizadas por ano e mês em português"""
     try:
-        print(f"🔍 DEBUG: Buscando faturas para customer_id={customer_id}")
-        print(f"🔍 DEBUG: User={request.user}")
-        
         # ✅ CORREÇÃO: Verificar se o customer existe e pertence ao usuário
         try:
             customer = Customer.objects.get(pk=customer_id, user=request.user)
-            print(f"✅ DEBUG: Customer encontrado: {customer.nome}")
         except Customer.DoesNotExist:
-            print(f"❌ DEBUG: Customer {customer_id} não encontrado para user {request.user}")
             return Response(
                 {"error": "Cliente não encontrado"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        ano = request.GET.get('ano', datetime.now().year)
-        print(f"🔍 DEBUG: Ano solicitado: {ano}")
-        
-        # Nomes dos meses em português
-        MESES_PT_BR = {
-            1: {'nome': 'Janeiro', 'abrev': 'JAN'},
-            2: {'nome': 'Fevereiro', 'abrev': 'FEV'},
-            3: {'nome': 'Março', 'abrev': 'MAR'},
-            4: {'nome': 'Abril', 'abrev': 'ABR'},
-            5: {'nome': 'Maio', 'abrev': 'MAI'},
-            6: {'nome': 'Junho', 'abrev': 'JUN'},
-            7: {'nome': 'Julho', 'abrev': 'JUL'},
-            8: {'nome': 'Agosto', 'abrev': 'AGO'},
-            9: {'nome': 'Setembro', 'abrev': 'SET'},
-            10: {'nome': 'Outubro', 'abrev': 'OUT'},
-            11: {'nome': 'Novembro', 'abrev': 'NOV'},
-            12: {'nome': 'Dezembro', 'abrev': 'DEZ'},
-        }
-        
-        # Buscar todas as UCs do cliente
-        ucs = customer.unidades_consumidoras.all()
-        print(f"🔍 DEBUG: UCs encontradas: {ucs.count()}")
-        for uc in ucs:
-            print(f"  - UC {uc.codigo}: {uc.endereco} (Ativa: {uc.is_active})")
-        
-        # Buscar faturas do ano
-        try:
-            faturas = Fatura.objects.filter(
-                unidade_consumidora__customer=customer,
-                mes_referencia__year=ano
-            ).order_by('mes_referencia')
-            print(f"🔍 DEBUG: Faturas encontradas: {faturas.count()}")
-            for fatura in faturas:
-                print(f"  - Fatura {fatura.id}: UC {fatura.unidade_consumidora.codigo}, Mês {fatura.mes_referencia}")
-        except Exception as e:
-            print(f"❌ DEBUG: Erro ao buscar faturas: {str(e)}")
-            faturas = Fatura.objects.none()
-        
-        # Organizar por mês
-        faturas_por_mes = {}
-        
+        # Validado antes de entrar na chave do cache e no ETag
         try:
-            for mes in range(1, 13):
-                mes_info = MESES_PT_BR[mes]
-                faturas_por_mes[mes] = {
-                    'mes_numero': mes,
-                    'mes_nome': mes_info['nome'],
-                    'mes_abrev': mes_info['abrev'],
-                    'ucs': []
-                }
-                
-                # Para cada UC, verificar se tem fatura neste mês
-                for uc in ucs:
-                    try:
-                        fatura_mes = faturas.filter(
-                            unidade_consumidora=uc,
-                            mes_referencia__month=mes
-                        ).first()
-                        
-                        uc_info = {
-                            'uc_id': uc.id,
-                            'uc_codigo': uc.codigo,
-                            'uc_endereco': uc.endereco,
-                            'uc_tipo': uc.tipo,
-                            'uc_is_active': uc.is_active,  # ✅ CORREÇÃO: Usar propriedade Python
-                            'fatura': None
-                        }
-                        
-                        if fatura_mes:
-                            uc_info['fatura'] = {
-                                'id': fatura_mes.id,
-                                'valor': str(fatura_mes.valor) if fatura_mes.valor else None,
-                                'vencimento': fatura_mes.vencimento.strftime('%d/%m/%Y') if fatura_mes.vencimento else None,
-                                'arquivo_url': fatura_mes.arquivo.url if fatura_mes.arquivo else None,
-                                'downloaded_at': fatura_mes.downloaded_at.strftime('%d/%m/%Y') if fatura_mes.downloaded_at else None
-                            }
-                        
-                        faturas_por_mes[mes]['ucs'].append(uc_info)
-                        
-                    except Exception as e:
-                        print(f"❌ DEBUG: Erro ao processar UC {uc.codigo} no mês {mes}: {str(e)}")
-                        continue
-                        
-        except Exception as e:
-            print(f"❌ DEBUG: Erro ao organizar faturas por mês: {str(e)}")
-            # Retornar estrutura mínima em caso de erro
-            faturas_por_mes = {}
-        
-        # Anos disponíveis
-        try:
-            anos_disponiveis = list(Fatura.objects.filter(
-                unidade_consumidora__customer=customer
-            ).dates('mes_referencia', 'year').values_list('mes_referencia__year', flat=True))
-            
-            anos_disponiveis = sorted(set(anos_disponiveis), reverse=True)
-            if not anos_disponiveis:
-                anos_disponiveis = [datetime.now().year]
-            
-            print(f"🔍 DEBUG: Anos disponíveis: {anos_disponiveis}")
-            
-        except Exception as e:
-            print(f"❌ DEBUG: Erro ao buscar anos disponíveis: {str(e)}")
-            anos_disponiveis = [datetime.now().year]
-        
-        # ✅ CORREÇÃO: Calcular UCs ativas usando filtro correto
-        ucs_ativas_count = 0
-        for uc in ucs:
-            if uc.is_active:  # Usar a propriedade Python
-                ucs_ativas_count += 1
-        
-        # Preparar resposta
-        response_data = {
-            'ano_atual': int(ano),
-            'anos_disponiveis': anos_disponiveis,
-            'faturas_por_mes': faturas_por_mes,
-            'total_ucs': ucs.count(),
-            'total_ucs_ativas': ucs_ativas_count  # ✅ CORREÇÃO: Usar contagem manual
-        }
-        
-        print(f"✅ DEBUG: Resposta preparada com {len(faturas_por_mes)} meses")
+            ano = int(request.GET.get('ano', datetime.now().year))
+        except (TypeError, ValueError):
+            ano = None
+        if ano is None or not datetime.min.year <= ano <= datetime.max.year:
+            return Response(
+                {"error": "Parâmetro 'ano' inválido"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response(response_data)
+        return conditional_response(
+            request, grade_validators(customer, ano),
+            lambda: cached_response(
+                request, 'grade', customer.id, lambda: Response(_montar_grade_anual(customer, ano)), str(ano)
+            )
+        )
         
     except Exception as e:
-        print(f"❌ DEBUG: Erro geral na view get_faturas_por_ano: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erro ao montar a grade anual do cliente %s", customer_id)
         
         return Response(
             {
@@ -1046,6 +1468,12 @@ def force_upload_fatura(request, customer_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        try:
+            validate_pdf(arquivo)
+        except PdfInvalido as e:
+            print(f"❌ DEBUG: PDF inválido: {e}")
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
         # Buscar UC
         uc = customer.unidades_consumidoras.filter(codigo=uc_codigo).first()
         if not uc:
@@ -1133,7 +1561,9 @@ def force_upload_fatura(request, customer_id):
             arquivo=arquivo,
             valor=valor_total,
             vencimento=data_vencimento,
-            downloaded_at=timezone.now()
+            downloaded_at=timezone.now(),
+            sha256=getattr(arquivo, 'sha256', ''),
+            dados_extraidos=dados_extraidos if isinstance(dados_extraidos, dict) else {}
         )
         
         print(f"✅ DEBUG: Fatura criada: ID {fatura.id}, Valor: {fatura.valor}, Vencimento: {fatura.vencimento}")
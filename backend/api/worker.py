@@ -0,0 +1,19 @@
+# backend/api/worker.py
+"""Ponto de entrada dos processos filhos de ``run_fatura_worker``.
+
+Fica separado de ``api.jobs`` porque o processo filho (multiprocessing
+``spawn``) importa este módulo antes de o Django estar configurado.
+"""
+import signal
+
+
+def run_worker_process(poll_interval=None, filas=None):
+    import django
+    django.setup()
+
+    from api.jobs import Worker
+
+    worker = Worker(poll_interval=poll_interval, filas=filas)
+    signal.signal(signal.SIGTERM, lambda *_: worker.parar.set())
+    signal.signal(signal.SIGINT, lambda *_: worker.parar.set())
+    worker.run()
@@ -0,0 +1,71 @@
+# backend/api/zipstream.py
+"""ZIP montado em streaming, sem arquivo temporário.
+
+O ``ZipFile`` escreve num destino sem ``seek`` (``SaidaZip``): cada entrada
+leva um descritor de dados no fim em vez de tamanhos no cabeçalho, e o
+gerador envia os bytes assim que saem. A memória fica limitada a um bloco,
+qualquer que seja o tamanho do arquivo final.
+"""
+import os
+import zipfile
+from datetime import datetime
+
+TAMANHO_BLOCO = 1024 * 1024
+
+
+class SaidaZip:
+    """Destino do ``ZipFile`` sem ``seek``: acumula os bytes até o gerador enviá-los."""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+
+    def write(self, dados):
+        if dados:  # o compressor devolve vazio enquanto acumula
+            self.partes.append(bytes(dados))
+            self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b''.join(self.partes)
+        self.partes.clear()
+        return dados
+
+
+def stream_files(arquivos):
+    """ZIP com os arquivos ``(nome_no_zip, caminho)``, gravados sem compressão.
+
+    Pensado para PDFs, que já vêm comprimidos: deflate gastaria CPU sem
+    ganho. Arquivos que não existem mais no disco são listados em
+    ``ARQUIVOS_AUSENTES.txt`` no fim do ZIP, já que a resposta já começou.
+    """
+    saida = SaidaZip()
+    ausentes = []
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED) as pacote:
+        for nome, caminho in arquivos:
+            try:
+                origem = open(caminho, 'rb')
+            except OSError:
+                ausentes.append(nome)
+                continue
+            with origem:
+                modificado = datetime.fromtimestamp(os.fstat(origem.fileno()).st_mtime)
+                info = zipfile.ZipInfo(nome, max(modificado.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+                info.compress_type = zipfile.ZIP_STORED
+                with pacote.open(info, 'w') as destino:
+                    while bloco := origem.read(TAMANHO_BLOCO):
+                        destino.write(bloco)
+                        if saida.partes:
+                            yield saida.esvaziar()
+            if saida.partes:
+                yield saida.esvaziar()
+
+        if ausentes:
+            pacote.writestr('ARQUIVOS_AUSENTES.txt', '\n'.join(ausentes) + '\n')
+    yield saida.esvaziar()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'api',
@@ -80,12 +82,26 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'tus-resumable',
+    'upload-length',
+    'upload-metadata',
+    'upload-offset',
+]
+
+# ✅ Headers do protocolo de upload retomável visíveis ao frontend
+CORS_EXPOSE_HEADERS = [
+    'location',
+    'retry-after',
+    'tus-resumable',
+    'upload-length',
+    'upload-offset',
 ]
 
 # ✅ CORS Methods permitidos
 CORS_ALLOW_METHODS = [
     'DELETE',
     'GET',
+    'HEAD',
     'OPTIONS',
     'PATCH',
     'POST',
@@ -192,6 +208,92 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024   # 50MB
 
+# ✅ Uploads vão direto para disco com SHA-256 calculado durante o stream
+FILE_UPLOAD_HANDLERS = [
+    'api.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+# ✅ Uploads retomáveis em blocos (tus)
+UPLOAD_STAGING_DIR = os.environ.get('UPLOAD_STAGING_DIR', os.path.join(BASE_DIR, 'staging', 'uploads'))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 1024 * 1024 * 1024))  # 1GB
+UPLOAD_SESSION_EXPIRY = timedelta(days=2)
+
+# ✅ Extração de faturas em paralelo
+# Teto de extrações simultâneas por processo e limite por requisição (lote)
+EXTRACTION_MAX_WORKERS = int(os.environ.get('EXTRACTION_MAX_WORKERS', os.cpu_count() or 2))
+EXTRACTION_MAX_WORKERS_PER_REQUEST = int(os.environ.get(
+    'EXTRACTION_MAX_WORKERS_PER_REQUEST', max(1, (os.cpu_count() or 2) // 2)
+))
+
+# ✅ Controle de admissão das extrações (compartilhado entre processos do host)
+EXTRACTION_HOST_SLOTS = int(os.environ.get('EXTRACTION_HOST_SLOTS', os.cpu_count() or 2))
+EXTRACTION_MAX_QUEUE = int(os.environ.get('EXTRACTION_MAX_QUEUE', 4 * EXTRACTION_HOST_SLOTS))
+EXTRACTION_SLOT_TIMEOUT = int(os.environ.get('EXTRACTION_SLOT_TIMEOUT', 120))  # segundos
+EXTRACTION_LOCK_DIR = os.environ.get(
+    'EXTRACTION_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'relatorio_expresso_extracao')
+)
+# Filas de prioridade (interativa > lote > backfill): vagas do host reservadas a
+# cada fila e espera (s) após a qual uma fila baixa deixa de ceder as compartilhadas
+EXTRACTION_LANE_RESERVED_SLOTS = {
+    'interativa': int(os.environ.get('EXTRACTION_RESERVED_INTERATIVA', 1)),
+    'lote': int(os.environ.get('EXTRACTION_RESERVED_LOTE', 0)),
+    'backfill': int(os.environ.get('EXTRACTION_RESERVED_BACKFILL', 0)),
+}
+EXTRACTION_LANE_MAX_WAIT = int(os.environ.get('EXTRACTION_LANE_MAX_WAIT', 30))
+
+# ✅ Validação estrutural dos PDFs antes da extração
+PDF_MAX_SIZE = int(os.environ.get('PDF_MAX_SIZE', 50 * 1024 * 1024))  # 50MB
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 30))
+
+# ✅ Fila de tarefas em background (FaturaTask)
+# Processos do run_fatura_worker por conjunto de filas: os dedicados à fila
+# interativa garantem que uma reextração pedida na tela não espere o backfill
+TASK_WORKER_POOLS = {
+    'interativa': int(os.environ.get('TASK_WORKERS_INTERATIVA', 1)),
+    'interativa,lote,backfill': int(os.environ.get('TASK_WORKERS_GERAIS', 2)),
+}
+TASK_POLL_INTERVAL = float(os.environ.get('TASK_POLL_INTERVAL', 2))  # segundos
+TASK_LEASE_SECONDS = int(os.environ.get('TASK_LEASE_SECONDS', 120))
+TASK_HEARTBEAT_SECONDS = int(os.environ.get('TASK_HEARTBEAT_SECONDS', 30))
+# Jobs prontos há mais tempo que isso passam na frente das filas prioritárias
+TASK_LANE_MAX_WAIT = int(os.environ.get('TASK_LANE_MAX_WAIT', 300))
+# Retentativas: backoff exponencial (base * 2^(n-1), até o teto) com jitter
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 5))
+TASK_RETRY_BASE_SECONDS = int(os.environ.get('TASK_RETRY_BASE_SECONDS', 30))
+TASK_RETRY_MAX_SECONDS = int(os.environ.get('TASK_RETRY_MAX_SECONDS', 3600))
+# Função "pacote.modulo.funcao(uc, mes_referencia) -> caminho do PDF" que baixa a fatura
+FATURA_IMPORT_BACKEND = os.environ.get('FATURA_IMPORT_BACKEND') or None
+
+# ✅ Cache das respostas por cliente (faturas, grade anual, UCs), invalidado nas escritas.
+# Arquivo por padrão (compartilhado entre API e workers); "locmem://" só com um
+# processo; "redis://..." usa o backend Redis do Django (requer o pacote redis).
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 600))  # segundos
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+if RESPONSE_CACHE_URL.startswith(('redis://', 'rediss://')):
+    _cache_respostas = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': RESPONSE_CACHE_URL,
+    }
+elif RESPONSE_CACHE_URL == 'locmem://':
+    _cache_respostas = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'respostas',
+    }
+else:
+    _cache_respostas = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        # Dentro do projeto: outra instância (ou checkout) no mesmo host não lê estas respostas
+        'LOCATION': os.environ.get('RESPONSE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'respostas')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000))},
+    }
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'respostas': _cache_respostas,
+}
+
+# ✅ Exportação de planilhas: linhas lidas do cursor do servidor por lote
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
 
 # Logging configuration - Simplificado para evitar erros
 LOGGING = {
@@ -131,6 +131,14 @@ def extract_uc_info(text):
     except Exception:
         return None
 
+def extract_cpf_cnpj(text):
+    """Captura o CPF do titular impresso na fatura."""
+    try:
+        match = re.search(r'CNPJ/CPF: (\d{3}\.\d{3}\.\d{3}-\d{2})', text)
+        return match.group(1) if match else None
+    except Exception:
+        return None
+
 def safe_decimal_convert(value_str):
     """Converte string de moeda brasileira para Decimal de forma segura."""
     if not value_str:
@@ -152,11 +160,7 @@ def extract_data_from_text(text, pdf_path=None):
     data = {}
 
     # Extração de CPF/CNPJ
-    try:
-        cpf_match = re.search(r'CNPJ/CPF: (\d{3}\.\d{3}\.\d{3}-\d{2})', text)
-        data['cpf_cnpj'] = cpf_match.group(1) if cpf_match else None
-    except Exception:
-        data['cpf_cnpj'] = None
+    data['cpf_cnpj'] = extract_cpf_cnpj(text)
 
     # Extração de Consumo (kWh)
     try:
@@ -286,8 +290,11 @@ def extract_data_from_text(text, pdf_path=None):
 
     return data
 
-def process_single_pdf(pdf_path):
-    """Processa um único PDF e retorna os dados extraídos."""
+def process_single_pdf(pdf_path, incluir_texto=False):
+    """Processa um único PDF e retorna os dados extraídos.
+
+    Com ``incluir_texto=True`` o texto bruto do PDF vem em ``texto`` (indexado na busca).
+    """
     try:
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"Arquivo não encontrado: {pdf_path}")
@@ -301,6 +308,8 @@ def process_single_pdf(pdf_path):
         # Adicionar metadata
         data['arquivo_processado'] = os.path.basename(pdf_path)
         data['status'] = 'success'
+        if incluir_texto:
+            data['texto'] = text
         
         return data
         
@@ -311,17 +320,67 @@ def process_single_pdf(pdf_path):
             'erro': str(e)
         }
 
+def probe_pdf(pdf_path):
+    """Modo rápido: lê só o texto da primeira página, sem OCR.
+
+    Extrai apenas UC, CPF do titular, mês de referência e vencimento,
+    suficientes para rotear a fatura e decidir se ela será armazenada. ``status`` é 'incompleto' quando a
+    primeira página não traz esses campos (ex.: PDF escaneado).
+    """
+    try:
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"Arquivo não encontrado: {pdf_path}")
+
+        with pdfplumber.open(pdf_path) as pdf:
+            text = (pdf.pages[0].extract_text() or '') if pdf.pages else ''
+
+        data = {
+            'unidade_consumidora': extract_uc_info(text),
+            'cpf_cnpj': extract_cpf_cnpj(text),
+        }
+        data.update(extract_reference_month_and_due_date(text))
+        data['arquivo_processado'] = os.path.basename(pdf_path)
+        data['modo'] = 'probe'
+        data['status'] = 'success' if data['unidade_consumidora'] and data['mes_referencia'] else 'incompleto'
+        return data
+
+    except Exception as e:
+        return {
+            'arquivo_processado': os.path.basename(pdf_path) if pdf_path else 'unknown',
+            'modo': 'probe',
+            'status': 'error',
+            'erro': str(e)
+        }
+
 def main():
     """Função principal para uso via linha de comando."""
-    if len(sys.argv) != 2:
+    args = sys.argv[1:]
+    probe = '--probe' in args
+    if probe:
+        args.remove('--probe')
+    incluir_texto = '--texto' in args
+    if incluir_texto:
+        args.remove('--texto')
+    triagem = '--triagem' in args
+    if triagem:
+        args.remove('--triagem')
+
+    if len(args) != 1:
         print(json.dumps({
             'status': 'error',
-            'erro': 'Uso: python extract_fatura_data.py <caminho_do_pdf>'
+            'erro': 'Uso: python extract_fatura_data.py [--probe | --texto | --triagem] <caminho_do_pdf>'
         }))
         sys.exit(1)
     
-    pdf_path = sys.argv[1]
-    result = process_single_pdf(pdf_path)
+    pdf_path = args[0]
+    if triagem:
+        # Probe em uma linha; a extração completa (com texto) só se o chamador responder 'continuar'
+        print(json.dumps(probe_pdf(pdf_path), ensure_ascii=False), flush=True)
+        if sys.stdin.readline().strip() != 'continuar':
+            return
+        result = process_single_pdf(pdf_path, incluir_texto=True)
+    else:
+        result = probe_pdf(pdf_path) if probe else process_single_pdf(pdf_path, incluir_texto)
     
     # Imprimir resultado como JSON
     print(json.dumps(result, ensure_ascii=False, indent=2))
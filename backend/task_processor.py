@@ -1 +1,16 @@
-print('Bot de faturas em desenvolvimento')
+# backend/task_processor.py
+"""Processador de tarefas em background (importações e reextrações de faturas).
+
+Atalho para ``python manage.py run_fatura_worker``; aceita os mesmos
+argumentos, ex.: ``python task_processor.py --processos 4``.
+"""
+import os
+import sys
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('run_fatura_worker', *sys.argv[1:])